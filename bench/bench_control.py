@@ -0,0 +1,97 @@
+"""Control socket scenario"""
+import json
+import socket
+import threading
+import time
+
+from harness import check, ddc_commands, start_switcher, stop_switcher, wait_idle
+
+from latency import LatencyHistogram
+
+
+class ControlClient:
+    """Blocking JSON-lines client for the switcher's control socket"""
+
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.reader = self.sock.makefile("rb")
+
+    def request(self, **request):
+        self.sock.sendall(json.dumps(request).encode() + b"\n")
+        return json.loads(self.reader.readline())
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+def bench_control(args):
+    """Many clients polling status over the control socket, then actions sent through it"""
+    switcher, thread = start_switcher(args)
+    path = switcher.CONTROL_SOCKET
+    round_trip = LatencyHistogram(window=args.clients * args.control_requests)
+    errors = []
+    commands_before = ddc_commands(switcher)
+
+    def poll():
+        client = ControlClient(path)
+        for _ in range(args.control_requests):
+            start = time.perf_counter()
+            reply = client.request(cmd="status")
+            round_trip.record((time.perf_counter() - start) * 1000)
+            if not reply.get("ok"):
+                errors.append(reply)
+        client.close()
+
+    pollers = [threading.Thread(target=poll) for _ in range(args.clients)]
+    wall_start = time.monotonic()
+    for poller in pollers:
+        poller.start()
+    for poller in pollers:
+        poller.join()
+    wall = time.monotonic() - wall_start
+    polled_commands = ddc_commands(switcher) - commands_before
+
+    # Actions take the same dispatcher path as key presses
+    client = ControlClient(path)
+    checks = {}
+    for alias, expected in (("computer_b", "usbc"), ("computer_a", "displayport")):
+        client.request(cmd="action", action=alias)
+        time.sleep(0.005)
+        wait_idle(switcher)
+        checks[alias] = check(switcher.current_input == expected, f"input is {switcher.current_input}")
+    client.request(cmd="vcp", code="0x10", value=42)
+    time.sleep(0.005)
+    wait_idle(switcher)
+    checks["vcp_brightness"] = check(switcher.displays[0].state.get(0x10) == 42, "brightness was not written")
+    rejected = client.request(cmd="vcp", code="0x10", value=-1, id=7)
+    checks["bad_request_rejected"] = check(rejected.get("ok") is False and rejected.get("id") == 7, rejected)
+    status = client.request(cmd="status")
+    client.close()
+
+    total = args.clients * args.control_requests
+    result = {
+        "clients": args.clients,
+        "requests": total,
+        "requests_per_s": round(total / wall),
+        "round_trip_ms": round_trip.summary(),
+        "errors": len(errors),
+        "ddc_commands_while_polling": polled_commands,
+        "checks": checks,
+        "last_action": status.get("last_action"),
+        "server": switcher.control_server.snapshot(),
+    }
+    stop_switcher(switcher, thread)
+    return result
+
+
+SCENARIOS = {
+    "control": bench_control,
+}
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group("control scenario")
+    group.add_argument("--clients", type=int, default=8, help="concurrent status pollers (control)")
+    group.add_argument("--control-requests", type=int, default=500, help="status requests per client (control)")
@@ -0,0 +1,311 @@
+"""Encoder scenarios: encoder, timers, brightness and probe"""
+import json
+import random
+import threading
+import time
+
+import harness  # Puts the stand-ins and the repo on sys.path first
+from harness import check, cpu_seconds, parse_range
+
+import evdev
+from paho.mqtt import client as mqtt_stub
+
+import hue_lightstrip_encoder as encoder
+from latency import LatencyStats
+from mqtt_publisher import MQTTPublisher
+from scheduler import Scheduler
+
+
+def trailing_timer_messages(click_times, delay=0.3):
+    """Messages the old fixed trailing timer would send: one per burst of clicks"""
+    gaps = [later - earlier for earlier, later in zip(click_times, click_times[1:])]
+    return 1 + sum(1 for gap in gaps if gap >= delay) if click_times else 0
+
+
+def bench_encoder(args):
+    """Spins of evenly spaced clicks separated by pauses: MQTT volume and latency"""
+    published = []
+    latency = LatencyStats()
+    scheduler = Scheduler("bench-flush").start()
+    batcher = encoder.EncoderBatcher(
+        lambda change: published.append((change, time.monotonic())),
+        scheduler.call_later,
+        latency=latency,
+    )
+    evdev.register_device(harness.ENCODER_DEVICE, "binepad BNK8 Consumer Control")
+
+    def read_encoder():
+        try:
+            for event in evdev.InputDevice(harness.ENCODER_DEVICE).read_loop():
+                direction = encoder.encoder_direction(event)
+                if direction:
+                    batcher.handle_encoder_event(direction, event.timestamp())
+        except OSError:
+            pass  # Fake device unplugged at the end of the run
+
+    reader = threading.Thread(target=read_encoder, name="bench-encoder")
+    reader.start()
+
+    clicks = args.spins * args.clicks_per_spin
+    click_times = []
+    cpu_start, wall_start = cpu_seconds(), time.monotonic()
+    next_click = wall_start  # Paced to deadlines, so one late wakeup doesn't shift the rest of a spin
+    for spin in range(args.spins):
+        code = evdev.ecodes.KEY_BRIGHTNESSUP if spin % 2 == 0 else evdev.ecodes.KEY_BRIGHTNESSDOWN
+        for _ in range(args.clicks_per_spin):
+            click_times.append(evdev.inject(harness.ENCODER_DEVICE, evdev.ecodes.EV_KEY, code, 1).timestamp())
+            evdev.inject(harness.ENCODER_DEVICE, evdev.ecodes.EV_KEY, code, 0)
+            next_click += args.click_interval
+            time.sleep(max(0.0, next_click - time.monotonic()))
+        next_click += args.spin_pause
+        time.sleep(max(0.0, next_click - time.monotonic()))
+    time.sleep(2 / encoder.MAX_SEND_RATE)
+    wall = time.monotonic() - wall_start
+    scheduler.stop()
+    batcher.cancel()
+    evdev.unregister_device(harness.ENCODER_DEVICE)
+    reader.join()
+    trailing = trailing_timer_messages(click_times)
+    # A click the bench itself injected QUIET_TIME late (a loaded machine) rightly ends a batch early
+    stalls = trailing_timer_messages(click_times, encoder.QUIET_TIME) - trailing
+    return {
+        "clicks": clicks,
+        "messages": len(published),
+        "messages_per_click": round(len(published) / clicks, 3),
+        "trailing_300ms_messages": trailing,
+        "injection_stalls": stalls,
+        "net_change": sum(change for change, _ in published),
+        "batcher": batcher.snapshot(),
+        "wall_s": round(wall, 3),
+        "cpu_ms_per_click": round((cpu_seconds() - cpu_start) * 1000 / clicks, 3),
+        "latency_ms": latency.snapshot(),
+        "checks": {"no_more_messages_than_trailing": check(
+            len(published) <= trailing + stalls, f"{len(published)} > {trailing} + {stalls} stalls")},
+    }
+
+
+def timer_call_later(delay, callback):
+    """The encoder's old batch deadline: one threading.Timer per (re)schedule"""
+    timer = threading.Timer(delay, callback)
+    timer.start()
+    return timer
+
+
+class ThreadStartCounter:
+    """Counts threads started while active"""
+
+    def __enter__(self):
+        self.count = 0
+        self.original = threading.Thread.start
+
+        def counting_start(thread):
+            self.count += 1
+            self.original(thread)
+
+        threading.Thread.start = counting_start
+        return self
+
+    def __exit__(self, *exc):
+        threading.Thread.start = self.original
+
+
+def bench_timers(args):
+    """
+    Microbenchmark: a burst of clicks, each cancelling and re-arming the batch
+    deadline as the old handle_encoder_event did, on threading.Timer vs Scheduler
+    """
+    delay = 0.05
+    result = {"clicks": args.burst_clicks}
+    for name in ("threading_timer", "scheduler"):
+        fired = threading.Event()
+        with ThreadStartCounter() as threads:
+            scheduler = Scheduler("bench-timers").start() if name == "scheduler" else None
+            call_later = scheduler.call_later if scheduler else timer_call_later
+            cpu_start, wall_start = time.process_time(), time.monotonic()
+            handle = None
+            for _ in range(args.burst_clicks):
+                if handle:
+                    handle.cancel()
+                handle = call_later(delay, fired.set)
+            burst_s = time.monotonic() - wall_start
+            fired.wait(5)
+            # Cancelled Timer threads exit on their own; let them finish for a fair CPU count
+            time.sleep(delay * 2)
+            cpu = time.process_time() - cpu_start
+            if scheduler:
+                scheduler.stop()
+        result[name] = {
+            "threads_started": threads.count,
+            "cpu_ms": round(cpu * 1000, 2),
+            "cpu_us_per_click": round(cpu * 1e6 / args.burst_clicks, 1),
+            "burst_ms": round(burst_s * 1000, 2),
+            "fired": check(fired.is_set(), "the deadline never fired"),
+        }
+    return result
+
+
+class FakeLight:
+    """
+    Broker-side stand-in for Home Assistant and the lightstrip
+    Applies relative and absolute brightness commands, loses a fraction of
+    them, and publishes its state as retained HA-style JSON, delay seconds
+    (or a (min, max) range) after the command, like an automation and bridge.
+    """
+
+    def __init__(self, level=50, drop_rate=0.0, seed=1, delay=0.0):
+        self.level = level
+        self.drop_rate = drop_rate
+        self.delay = delay
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.commands = 0
+        self.lost = 0
+        mqtt_stub.broker.hooks.append(self.on_message)
+        self.publish_state()
+
+    def publish_state(self, level=None):
+        level = self.level if level is None else level
+        state = json.dumps({"state": "ON" if level else "OFF", "brightness": round(level * 255 / 100)})
+        mqtt_stub.broker.route(mqtt_stub.MQTTMessage(encoder.MQTT_STATE_TOPIC, state.encode(), retain=True))
+
+    def set_external(self, level):
+        """A change made from the Hue app or a wall switch"""
+        with self.lock:
+            self.level = level
+            self.publish_state()
+
+    def on_message(self, message):
+        if message.topic not in (encoder.MQTT_TOPIC, encoder.MQTT_SET_TOPIC):
+            return
+        with self.lock:
+            self.commands += 1
+            if self.random.random() < self.drop_rate:
+                self.lost += 1
+                return
+            value = int(message.payload)
+            if message.topic == encoder.MQTT_TOPIC:
+                value += self.level
+            self.level = encoder.clamp_brightness(value)
+            delay = self.random.uniform(*self.delay) if isinstance(self.delay, tuple) else self.delay
+            if delay:
+                threading.Timer(delay, self.publish_state, (self.level,)).start()
+            else:
+                self.publish_state()
+
+
+def bench_brightness(args):
+    """Relative deltas vs the absolute brightness model against a light that loses commands"""
+    results = {}
+    for mode in ("relative", "absolute"):
+        mqtt_stub.broker.reset()
+        encoder.BRIGHTNESS_MODE = mode
+        light = FakeLight(drop_rate=args.drop_rate)
+        publisher = MQTTPublisher("bench-broker").start()
+        while not publisher.connected():
+            time.sleep(0.01)
+        publish, model = encoder.brightness_publisher(publisher)
+        intended = light.level
+
+        def track(change):
+            nonlocal intended
+            intended = encoder.clamp_brightness(intended + change)
+            publish(change)
+
+        scheduler = Scheduler("bench-flush").start()
+        batcher = encoder.EncoderBatcher(track, scheduler.call_later)
+        time.sleep(0.1)  # Retained state reaches the model
+        for spin in range(args.spins):
+            if spin == args.spins // 2:
+                light.set_external(20)
+                intended = 20
+                time.sleep(0.1)
+            direction = 1 if spin % 3 else -1
+            for _ in range(args.clicks_per_spin):
+                batcher.handle_encoder_event(direction)
+                time.sleep(args.click_interval)
+            time.sleep(args.spin_pause)
+        time.sleep(2 / encoder.MAX_SEND_RATE)
+        scheduler.stop()
+        publisher.stop()
+        results[mode] = {
+            "commands": light.commands,
+            "lost": light.lost,
+            "intended": intended,
+            "light": light.level,
+            "drift": light.level - intended,
+            "model": model.snapshot() if model else None,
+        }
+    encoder.BRIGHTNESS_MODE = "relative"
+    return dict(results, drop_rate=args.drop_rate)
+
+
+def bench_probe(args):
+    """Round-trip probe on the brightness path: publish-to-ack and publish-to-state-change against a slow light"""
+    delay = parse_range(args.automation_delay)
+    shortest, longest = delay if isinstance(delay, tuple) else (delay, delay)
+    result = {"ack_latency_s": args.ack_latency, "automation_delay_s": args.automation_delay, "drop_rate": args.drop_rate}
+    checks = result["checks"] = {}
+    encoder.LATENCY_PROBE = True
+    try:
+        for mode in ("relative", "absolute"):
+            mqtt_stub.broker.reset()
+            mqtt_stub.broker.ack_latency = args.ack_latency
+            encoder.BRIGHTNESS_MODE = mode
+            light = FakeLight(drop_rate=args.drop_rate, delay=delay)
+            publisher = MQTTPublisher("bench-broker").start()
+            while not publisher.connected():
+                time.sleep(0.01)
+            publish, model = encoder.brightness_publisher(publisher)
+            probe = encoder.latency_probe(publisher)
+            latency = LatencyStats()
+            scheduler = Scheduler("bench-flush").start()
+            batcher = encoder.EncoderBatcher(publish, scheduler.call_later, latency=latency)
+            time.sleep(0.1)  # Retained state reaches the model and the probe
+            for spin in range(args.spins):
+                direction = 1 if spin % 3 else -1
+                for _ in range(args.clicks_per_spin):
+                    batcher.handle_encoder_event(direction)
+                    time.sleep(args.click_interval)
+                time.sleep(args.spin_pause)
+            time.sleep(2 / encoder.MAX_SEND_RATE + longest + args.ack_latency)
+            scheduler.stop()
+            brightness = latency.snapshot().get("brightness", {})
+            result[mode] = {
+                "messages": batcher.snapshot()["messages"],
+                "light_commands": light.commands,
+                "lost": light.lost,
+                "batch_wait_ms": brightness.get("batch_wait"),
+                "probe": probe.snapshot(),
+            }
+            publisher.stop()
+            # The probe's times can't be shorter than the delays the stand-ins add. Only absolute
+            # targets go out at PROBE_QOS; relative deltas stay at QoS 0 and get no ack
+            acks, states = result[mode]["probe"]["ack_ms"], result[mode]["probe"]["state_ms"]
+            if mode == "absolute":
+                checks["absolute_ack_ms"] = check(acks.get("count") and acks["p50"] >= args.ack_latency * 1000, acks)
+            else:
+                checks["relative_not_acked"] = check(not acks.get("count"), acks)
+            checks[f"{mode}_state_ms"] = check(states.get("count") and states["p50"] >= shortest * 1000, states)
+    finally:
+        encoder.LATENCY_PROBE = False
+        encoder.BRIGHTNESS_MODE = "relative"
+    return result
+
+
+SCENARIOS = {
+    "encoder": bench_encoder,
+    "timers": bench_timers,
+    "brightness": bench_brightness,
+    "probe": bench_probe,
+}
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group("encoder scenarios")
+    group.add_argument("--drop-rate", type=float, default=0.1,
+                       help="fraction of brightness commands the fake light loses (brightness, probe)")
+    group.add_argument("--ack-latency", type=float, default=0.02,
+                       help="seconds the stand-in broker takes to ack a QoS 1 publish (probe)")
+    group.add_argument("--automation-delay", default="0.15:0.4",
+                       help="seconds (or min:max) from a brightness command to the light's state message (probe)")
+    group.add_argument("--burst-clicks", type=int, default=1000, help="clicks in the timers microbenchmark")
@@ -0,0 +1,67 @@
+"""
+Gesture scenario: taps with and without the speculative wake on a sleeping monitor
+The recognizer's own cases are unit tests in tests/test_gestures.py.
+"""
+import os
+import time
+
+from harness import SWITCH_KEYS, check, hold, start_switcher, stop_switcher, wait_idle
+
+import gestures
+
+
+def bench_gestures(args):
+    """Taps on keys with and without a double-tap action, with and without the speculative wake"""
+    # A tap on a key with a double-tap action, to a monitor in standby that takes
+    # --wake-latency to power on: the wake overlaps the double-tap window
+    os.environ["FAKE_DDCUTIL_WAKE_LATENCY"] = str(args.wake_latency)
+    mapping = {(code, gestures.DOUBLE_TAP): "hdmi_standby" for code in SWITCH_KEYS}
+    configs = {
+        "tap_only": {},
+        "gestures": {"gesture_mapping": mapping, "speculative_wake": False},
+        "gestures_speculative": {"gesture_mapping": mapping},
+    }
+    result = {"wake_latency_s": args.wake_latency, "checks": {}}
+    try:
+        for name, attrs in configs.items():
+            switcher, thread = start_switcher(args, **attrs)
+            totals = []
+            for i in range(args.gesture_rounds):
+                switcher.request_action("hdmi_standby")
+                time.sleep(0.005)
+                wait_idle(switcher)
+                hold(SWITCH_KEYS[i % 2], 0.08)
+                deadline = time.monotonic() + 10
+                while switcher.last_action["action"] == "hdmi_standby" and time.monotonic() < deadline:
+                    time.sleep(0.002)
+                wait_idle(switcher)
+                totals.append(switcher.last_action["ms"])
+            summary = {"tap_ms": sorted(totals), "actions": dict(switcher.action_results)}
+            if attrs:
+                # A double tap on the same key runs the other action
+                hold(SWITCH_KEYS[0], 0.05)
+                time.sleep(0.05)
+                hold(SWITCH_KEYS[0], 0.05)
+                time.sleep(0.05)
+                wait_idle(switcher)
+                summary["double_tap_ran"] = switcher.last_action["action"]
+                result["checks"][f"{name}_double_tap"] = check(
+                    summary["double_tap_ran"] == "hdmi_standby", f"ran {summary['double_tap_ran']}")
+                summary["gestures"] = switcher.stats_providers()["gestures"]()
+            result[name] = summary
+            stop_switcher(switcher, thread)
+    finally:
+        del os.environ["FAKE_DDCUTIL_WAKE_LATENCY"]
+    return result
+
+
+SCENARIOS = {
+    "gestures": bench_gestures,
+}
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group("gestures scenario")
+    group.add_argument("--wake-latency", type=float, default=0.4,
+                       help="seconds a fake monitor takes to power on from standby (gestures)")
+    group.add_argument("--gesture-rounds", type=int, default=6, help="taps per configuration (gestures)")
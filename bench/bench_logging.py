@@ -0,0 +1,102 @@
+"""Logging scenario: synchronous file handler vs the queued pipeline"""
+import logging
+import os
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler
+
+import harness  # noqa: F401  (puts the repo on sys.path)
+import log_setup
+from latency import LatencyHistogram
+
+
+class SlowRotatingFileHandler(RotatingFileHandler):
+    """The old synchronous handler, with a simulated SD card write per flush"""
+
+    def __init__(self, path, write_s):
+        super().__init__(path, maxBytes=log_setup.LOG_MAX_BYTES, backupCount=log_setup.LOG_BACKUPS)
+        self.write_s = write_s
+        self.writes = 0
+
+    def flush(self):
+        super().flush()
+        if self.stream:
+            self.writes += 1
+            time.sleep(self.write_s)
+
+
+class SlowBatchFileHandler(log_setup.BatchFileHandler):
+    """BatchFileHandler with the same simulated write cost per batch"""
+
+    def __init__(self, path, write_s):
+        super().__init__(path)
+        self.write_s = write_s
+
+    def flush(self):
+        pending = bool(self.pending)
+        super().flush()
+        if pending:
+            time.sleep(self.write_s)
+
+
+def bench_logging(args):
+    """Caller-side cost of the hot path's log lines: synchronous file handler vs the queued pipeline"""
+    write_s = args.log_write_ms / 1000
+    disabled = logging.root.manager.disable
+    logging.disable(logging.NOTSET)
+    logger = logging.getLogger("macropad.bench")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    result = {"records": args.log_records, "write_ms": args.log_write_ms}
+    with tempfile.TemporaryDirectory(prefix="macropad-log-") as log_dir:
+        for name in ("sync", "pipeline"):
+            path = os.path.join(log_dir, f"{name}.log")
+            if name == "sync":
+                handler = SlowRotatingFileHandler(path, write_s)
+                handler.setFormatter(logging.Formatter(log_setup.LOG_FORMAT))
+                logger.addHandler(handler)
+                pipeline = None
+            else:
+                handler = SlowBatchFileHandler(path, write_s)
+                handler.setFormatter(logging.Formatter(log_setup.LOG_FORMAT))
+                pipeline = log_setup.LogPipeline([handler], levels_file=os.path.join(log_dir, "levels.json")).start()
+                logger.addHandler(pipeline.handler)
+
+            per_call = LatencyHistogram(window=args.log_records)
+            wall_start = time.monotonic()
+            for i in range(args.log_records):
+                start = time.perf_counter()
+                logger.info(f"Button press - scancode: 458862, keycode: KEY_F23, action: displayport ({i})")
+                per_call.record((time.perf_counter() - start) * 1e6)
+                if i % 4 == 3:
+                    time.sleep(0.002)  # Four lines per press, a press every 2 ms
+            caller_s = time.monotonic() - wall_start
+            logger.handlers.clear()
+            if pipeline:
+                pipeline.stop()
+                writes = handler.stats["writes"]
+            else:
+                handler.close()
+                writes = handler.writes
+            with open(path) as f:
+                lines = sum(1 for _ in f)
+            result[name] = {
+                "caller_us": per_call.summary(),
+                "caller_s": round(caller_s, 3),
+                "file_writes": writes,
+                "lines_written": lines,
+            }
+    logging.disable(disabled)
+    return result
+
+
+SCENARIOS = {
+    "logging": bench_logging,
+}
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group("logging scenario")
+    group.add_argument("--log-records", type=int, default=4000, help="log lines in the logging scenario")
+    group.add_argument("--log-write-ms", type=float, default=0.5,
+                       help="simulated SD card cost of each log file write (logging)")
@@ -0,0 +1,194 @@
+"""MQTT scenarios: the offline-tolerant publisher and the Home Assistant bridge"""
+import json
+import threading
+import time
+
+from harness import SWITCH_KEYS, check, press, start_switcher, stop_switcher, wait_idle
+
+from paho.mqtt import client as mqtt_stub
+
+import hue_lightstrip_encoder as encoder
+import switcher_mqtt
+from latency import LatencyHistogram
+from mqtt_publisher import MQTTPublisher
+from scheduler import Scheduler
+
+
+def bench_mqtt(args):
+    """Encoder spins through MQTTPublisher while the stand-in broker goes offline and back"""
+    mqtt_stub.broker.reset()
+    publisher = MQTTPublisher("bench-broker", reconnect_min=0.05, reconnect_max=0.5, qos=args.qos).start()
+    scheduler = Scheduler("bench-flush").start()
+    changes = []
+
+    def publish(change):
+        changes.append(change)
+        publisher.publish_delta(encoder.MQTT_TOPIC, change)
+
+    batcher = encoder.EncoderBatcher(publish, scheduler.call_later)
+    max_depth = 0
+    outage_start = args.spins // 3
+    wall_start = time.monotonic()
+    for spin in range(args.spins):
+        if spin == outage_start:
+            mqtt_stub.broker.set_online(False)
+            threading.Timer(args.outage, mqtt_stub.broker.set_online, (True,)).start()
+        direction = 1 if spin % 3 else -1
+        for _ in range(args.clicks_per_spin):
+            batcher.handle_encoder_event(direction)
+            max_depth = max(max_depth, publisher.snapshot()["outbox_depth"])
+            time.sleep(args.click_interval)
+        time.sleep(args.spin_pause)
+    time.sleep(2 / encoder.MAX_SEND_RATE)
+    scheduler.stop()
+    deadline = time.monotonic() + 5
+    while publisher.snapshot()["outbox_depth"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    delivered = [int(m.payload) for m in mqtt_stub.broker.messages if m.topic == encoder.MQTT_TOPIC]
+    stats = publisher.snapshot()
+    publisher.stop()
+    return {
+        "outage_s": args.outage,
+        "wall_s": round(time.monotonic() - wall_start, 3),
+        "batched_messages": len(changes),
+        "delivered_messages": len(delivered),
+        "net_change_batched": sum(changes),
+        "net_change_delivered": sum(delivered),
+        "max_outbox_depth": max_depth,
+        "publisher": stats,
+        "checks": {"net_change_delivered": check(sum(delivered) == sum(changes),
+                                                 f"{sum(delivered)} delivered, {sum(changes)} batched")},
+    }
+
+
+class FakeHomeAssistant:
+    """MQTT client that records the switcher's state, availability and discovery messages"""
+
+    def __init__(self, prefix=switcher_mqtt.TOPIC_PREFIX):
+        self.prefix = prefix
+        self.cond = threading.Condition()
+        self.states = []  # (time.time() received, state dict)
+        self.availability = []
+        self.discovery = {}
+        self.client = mqtt_stub.Client("home-assistant")
+        self.client.on_message = self.on_message
+        self.client.connect("bench-broker")
+        self.client.subscribe(f"{prefix}/#")
+        self.client.subscribe(f"{switcher_mqtt.DISCOVERY_PREFIX}/#")
+        self.client.loop_start()
+
+    def on_message(self, client, userdata, message):
+        with self.cond:
+            if message.topic == f"{self.prefix}/state":
+                self.states.append((time.time(), json.loads(message.payload)))
+            elif message.topic == f"{self.prefix}/availability":
+                self.availability.append(message.payload.decode())
+            elif message.topic.endswith("/config"):
+                self.discovery[message.topic] = json.loads(message.payload)
+            self.cond.notify_all()
+
+    def wait_for(self, predicate, timeout=10):
+        with self.cond:
+            if not self.cond.wait_for(predicate, timeout):
+                raise RuntimeError("Expected MQTT message did not arrive")
+
+    def wait_state(self, computer, after):
+        """Time the first state with computer arrived after the given index"""
+        self.wait_for(lambda: any(s["computer"] == computer for _, s in self.states[after:]))
+        return next(t for t, s in self.states[after:] if s["computer"] == computer)
+
+    def command(self, payload):
+        self.client.publish(f"{self.prefix}/set", payload)
+
+    def stop(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def bench_ha(args):
+    """Switcher state pushed to a Home Assistant stand-in, commands sent back, and the will on a crash"""
+    mqtt_stub.broker.reset()
+    publisher = MQTTPublisher("bench-broker", reconnect_min=0.05, reconnect_max=0.5)
+    ha = FakeHomeAssistant()
+    switcher, thread = start_switcher(args, mqtt_publisher=publisher)
+    ha.wait_for(lambda: ha.states and ha.availability[-1:] == ["online"])
+    computers = ["computer_a", "computer_b"]
+
+    press_push, after_action = LatencyHistogram(), LatencyHistogram()
+    for i in range(args.presses):
+        seen = len(ha.states)
+        start = time.time()
+        press(SWITCH_KEYS[i % 2])
+        arrived = ha.wait_state(computers[i % 2], seen)
+        press_push.record((arrived - start) * 1000)
+        after_action.record((arrived - switcher.last_action["finished"]) * 1000)
+    wait_idle(switcher)
+
+    command_round_trip = LatencyHistogram()
+    for i in range(args.presses):
+        seen = len(ha.states)
+        start = time.time()
+        ha.command(computers[(i + 1) % 2])
+        command_round_trip.record((ha.wait_state(computers[(i + 1) % 2], seen) - start) * 1000)
+    ha.command("not_an_action")
+    ha.command(json.dumps({"code": "0x10", "value": 30}))
+    time.sleep(0.05)
+    wait_idle(switcher)
+
+    ha.wait_for(lambda: ha.states[-1][1] == state_payload_now(switcher))
+
+    # A late subscriber gets the current state from the retained message
+    late_messages = []
+    late = mqtt_stub.Client("late")
+    late.on_message = lambda client, userdata, message: late_messages.append(json.loads(message.payload))
+    late.connect("bench-broker")
+    late.subscribe(f"{switcher_mqtt.TOPIC_PREFIX}/state")
+    for _ in range(3):  # CONNACK, SUBACK, then the retained message
+        late.loop(timeout=1)
+    late.disconnect()
+
+    # The switcher's connection dies: its will marks it offline until it reconnects
+    start = time.monotonic()
+    mqtt_stub.broker.kill(publisher.client)
+    ha.wait_for(lambda: ha.availability[-2:] == ["offline", "online"])
+    recovery_ms = (time.monotonic() - start) * 1000
+
+    result = {
+        "presses": args.presses,
+        "press_to_state_ms": press_push.summary(),
+        "state_after_action_ms": after_action.summary(),
+        "command_to_state_ms": command_round_trip.summary(),
+        "state_messages": len(ha.states),
+        "actions": dict(switcher.action_results),
+        "discovery_entities": sorted(topic.split("/")[1] + ":" + topic.split("/")[3] for topic in ha.discovery),
+        "checks": {
+            "retained_state": check(late_messages == [state_payload_now(switcher)], late_messages),
+            # The unknown action and the raw VCP write, which MQTT_VCP_COMMANDS leaves off
+            "bad_commands_rejected": check(switcher.mqtt.stats["rejected"] == 2, switcher.mqtt.stats),
+        },
+        "availability": ha.availability,
+        "reconnect_online_ms": round(recovery_ms, 1),
+        "bridge": {k: v for k, v in switcher.mqtt.snapshot().items() if k != "publisher"},
+    }
+    stop_switcher(switcher, thread)
+    publisher.stop()
+    ha.wait_for(lambda: ha.availability[-1] == "offline")
+    result["checks"]["offline_after_stop"] = check(ha.availability[-1] == "offline", ha.availability[-1])
+    ha.stop()
+    return result
+
+
+def state_payload_now(switcher):
+    return switcher_mqtt.state_payload(switcher.status())
+
+
+SCENARIOS = {
+    "mqtt": bench_mqtt,
+    "ha": bench_ha,
+}
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group("mqtt scenarios")
+    group.add_argument("--outage", type=float, default=1.5, help="seconds the broker is offline (mqtt)")
+    group.add_argument("--qos", type=int, choices=[0, 1], default=0)
@@ -0,0 +1,152 @@
+"""Pipeline scenario: actions from an actions file"""
+import json
+import os
+import time
+
+import harness  # Puts the stand-ins and the repo on sys.path first
+from harness import check, press, start_switcher, stop_switcher, wait_idle
+
+import evdev
+from paho.mqtt import client as mqtt_stub
+
+import pipelines
+from latency import LatencyHistogram
+from mqtt_publisher import MQTTPublisher
+
+
+def desk_steps(payload, parallel):
+    """Wake, then input + USB + brightness together (or one by one), then an MQTT publish"""
+    together = [
+        {"type": "vcp_set", "input": "displayport", "force": True},
+        {"type": "gpio_pulse", "usb_input": 1},
+        {"type": "vcp_set", "code": "0x10", "value": 70, "force": True},
+    ]
+    middle = [{"parallel": together}] if parallel else together
+    return [{"type": "vcp_set", "code": "0xD6", "value": 1, "force": True}] + middle + [
+        {"type": "mqtt_publish", "topic": "bench/desk", "payload": payload, "retain": True},
+    ]
+
+
+BENCH_ACTIONS = {
+    "actions": {
+        "desk_parallel": {"steps": desk_steps({"desk": "parallel"}, True)},
+        "desk_sequential": {"steps": desk_steps({"desk": "sequential"}, False)},
+        # A budget far below the fake monitor's latency: cancelled, then skipped as optional
+        "over_budget_optional": {"steps": [
+            {"type": "vcp_set", "code": "0x10", "value": 20, "force": True, "timeout": 0.01, "optional": True},
+            {"type": "mqtt_publish", "topic": "bench/budget", "payload": "optional", "retain": True},
+        ]},
+        "over_budget_required": {"steps": [
+            {"type": "vcp_set", "code": "0x10", "value": 20, "force": True, "timeout": 0.01},
+            {"type": "mqtt_publish", "topic": "bench/budget", "payload": "required", "retain": True},
+        ]},
+        "long_delay": {"steps": [{"type": "delay", "seconds": 5}]},
+    },
+    "keys": {"KEY_F21": "desk_parallel"},
+}
+
+
+BAD_ACTIONS = {
+    "typo": {"actions": {"a": {"steps": [{"type": "vcp_set", "code": 16, "value": 1, "timout": 2}]}}},
+    "bad_input": {"actions": {"a": {"steps": [{"type": "vcp_set", "input": "vga"}]}}},
+    "bad_pin": {"actions": {"a": {"steps": [{"type": "gpio_pulse", "pin": 4}]}}},
+    "unknown_action": {"keys": {"KEY_F21": "nope"}},
+    "unknown_key": {"actions": {"a": {"steps": [{"type": "delay", "seconds": 1}]}}, "keys": {"KEY_Q9": "a"}},
+}
+
+
+def bench_pipelines(args):
+    """Pipelines from an actions file: compile cost, parallel vs sequential steps, budgets and supersession"""
+    mqtt_stub.broker.reset()
+    publisher = MQTTPublisher("bench-broker", reconnect_min=0.05, reconnect_max=0.5)
+    path = os.path.join(os.path.dirname(harness.INPUT_DIR), "actions.json")
+    with open(path, "w") as f:
+        json.dump(BENCH_ACTIONS, f)
+    switcher, thread = start_switcher(args, ACTIONS_FILE=path, mqtt_publisher=publisher)
+
+    # Compiling is a startup cost; a press only looks its action up
+    rounds = 200
+    start = time.perf_counter()
+    for _ in range(rounds):
+        pipelines.compile_config(BENCH_ACTIONS, switcher.step_builders(), switcher.actions, switcher.key_code)
+    compile_ms = (time.perf_counter() - start) * 1000 / rounds
+    rejected = {}
+    for name, config in BAD_ACTIONS.items():
+        try:
+            pipelines.compile_config(config, switcher.step_builders(), switcher.actions, switcher.key_code)
+            rejected[name] = "ACCEPTED"
+        except pipelines.PipelineError as e:
+            rejected[name] = str(e)
+
+    def run(action):
+        seen = switcher.last_action
+        switcher.request_action(action)
+        deadline = time.monotonic() + 30
+        while switcher.last_action is seen and time.monotonic() < deadline:
+            time.sleep(0.001)
+        wait_idle(switcher)
+        return switcher.last_action
+
+    totals = {}
+    for name in ("desk_sequential", "desk_parallel"):
+        histogram = LatencyHistogram()
+        for _ in range(args.presses):
+            histogram.record(run(name)["ms"])
+        totals[name] = histogram.summary()
+
+    # The same pipeline from its key
+    seen = switcher.last_action
+    press(evdev.ecodes.KEY_F21)
+    while switcher.last_action is seen:
+        time.sleep(0.001)
+    wait_idle(switcher)
+    key_press = switcher.last_action
+
+    budget = {}
+    for name in ("over_budget_optional", "over_budget_required"):
+        last = run(name)
+        published = mqtt_stub.broker.retained.get("bench/budget")
+        budget[name] = {"success": last["success"], "ms": last["ms"],
+                        "published": published.payload.decode() if published else None}
+        mqtt_stub.broker.retained.pop("bench/budget", None)
+
+    # A newer press cuts a running delay short
+    switcher.request_action("long_delay")
+    time.sleep(0.1)
+    start = time.monotonic()
+    run("usbc")
+    superseded = {"newer_action_done_ms": round((time.monotonic() - start) * 1000, 1),
+                  "newer_action_success": switcher.last_action["success"]}
+
+    retained = mqtt_stub.broker.retained.get("bench/desk")
+    optional, required = budget["over_budget_optional"], budget["over_budget_required"]
+    checks = {
+        "bad_files_rejected": check("ACCEPTED" not in rejected.values(),
+                                    [name for name, error in rejected.items() if error == "ACCEPTED"]),
+        "key_press": check(key_press["action"] == "desk_parallel" and key_press["success"], key_press),
+        "optional_step_skipped": check(optional["success"] and optional["published"] == "optional", optional),
+        "required_step_fails_action": check(not required["success"] and required["published"] is None, required),
+        "newer_action_succeeds": check(superseded["newer_action_success"], superseded),
+    }
+    result = {
+        "compile_ms": round(compile_ms, 3),
+        "rejected": rejected,
+        "press_to_done_ms": totals,
+        "key_press": {"action": key_press["action"], "success": key_press["success"], "ms": key_press["ms"]},
+        "retained_desk": json.loads(retained.payload) if retained else None,
+        "budgets": budget,
+        "superseded": superseded,
+        "checks": checks,
+        "latency_ms": {name: stages for name, stages in switcher.latency.snapshot().items()
+                       if name.startswith("desk")},
+        "pipelines": {name: {k: v for k, v in stats.items() if k != "step_ms"}
+                      for name, stats in switcher.stats_providers()["pipelines"]().items()},
+    }
+    stop_switcher(switcher, thread)
+    publisher.stop()
+    return result
+
+
+SCENARIOS = {
+    "pipelines": bench_pipelines,
+}
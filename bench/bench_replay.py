@@ -0,0 +1,258 @@
+"""Replay scenario, and the trace replay that bench/replay.py drives"""
+import json
+import os
+import threading
+import time
+
+import harness  # Puts the stand-ins and the repo on sys.path first
+from harness import SWITCH_KEYS, check, ddc_commands, start_switcher, stop_switcher, wait_idle
+
+import evdev
+from paho.mqtt import client as mqtt_stub
+from RPi import GPIO
+
+import ddc_ci
+import event_trace
+import hue_lightstrip_encoder as encoder
+from latency import LatencyHistogram, LatencyStats
+from mqtt_publisher import MQTTPublisher
+from scheduler import Scheduler
+
+
+ENCODER_SETTINGS = ("MAX_SEND_RATE", "STEP_SIZE", "ACCELERATION", "VELOCITY_WINDOW", "QUIET_TIME")
+
+
+def parse_overrides(text):
+    """'switcher.parallel_switching=false,encoder.STEP_SIZE=3' -> (switcher attrs, encoder settings)"""
+    switcher_attrs, encoder_settings = {}, {}
+    for item in filter(None, (text or "").split(",")):
+        name, _, raw = item.partition("=")
+        side, _, attr = name.strip().partition(".")
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            value = raw
+        if side == "switcher" and attr:
+            switcher_attrs[attr] = value
+        elif side == "encoder" and attr in ENCODER_SETTINGS:
+            encoder_settings[attr] = tuple(map(tuple, value)) if attr == "ACCELERATION" else value
+        else:
+            raise ValueError(f"Unknown override {name!r}: use switcher.<attr> or encoder.{'/'.join(ENCODER_SETTINGS)}")
+    return switcher_attrs, encoder_settings
+
+
+def scale_summary(summary, speed):
+    """A latency summary measured during an accelerated replay, in trace time"""
+    return {key: value if key == "count" else round(value * speed, 2) for key, value in summary.items()}
+
+
+def scale_latency(snapshot, speed):
+    return {action: {stage: scale_summary(summary, speed) for stage, summary in stages.items()}
+            for action, stages in snapshot.items()}
+
+
+def fake_ddcutil_commands(path, skip):
+    """Counts of 'setvcp 60'-style commands in the fake ddcutil log, after the first skip lines"""
+    counts = {}
+    try:
+        with open(path) as f:
+            lines = f.readlines()[skip:]
+    except FileNotFoundError:
+        return counts
+    for line in lines:
+        fields = line.split()
+        if len(fields) >= 3:
+            command = f"{fields[1]} {fields[2]}"
+            counts[command] = counts.get(command, 0) + 1
+    return counts
+
+
+def synthetic_trace(path):
+    """A trace of hammered F23/F24 presses and hard encoder spins, for trying replay without hardware"""
+    events = []
+    t = 1700000000.0
+
+    def key(device, code, value, at):
+        events.append(event_trace.TraceEvent(device, int(at), int(round((at - int(at)) * 1e6)),
+                                             evdev.ecodes.EV_KEY, code, value))
+
+    for i in range(12):  # Hammering F23/F24, 40 ms apart
+        key(0, SWITCH_KEYS[i % 2], 1, t)
+        key(0, SWITCH_KEYS[i % 2], 0, t + 0.02)
+        t += 0.04
+    t += 1.5
+    for gap, clicks, code in ((0.015, 40, evdev.ecodes.KEY_BRIGHTNESSUP), (0.06, 20, evdev.ecodes.KEY_BRIGHTNESSDOWN)):
+        for _ in range(clicks):  # A hard spin, then a slower one back
+            key(1, code, 1, t)
+            key(1, code, 0, t + 0.004)
+            t += gap
+        t += 0.5
+    for i in range(4):  # Deliberate presses, each allowed to finish
+        key(0, SWITCH_KEYS[i % 2], 1, t)
+        key(0, SWITCH_KEYS[i % 2], 0, t + 0.08)
+        t += 1.2
+    devices = [{"role": "buttons", "name": "binepad BNK8", "path": "synthetic"},
+               {"role": "encoder", "name": "binepad BNK8 Consumer Control", "path": "synthetic"}]
+    with event_trace.TraceWriter(path, devices, started=events[0].timestamp()) as writer:
+        for event in events:
+            writer.write(event.device, event)
+    return path
+
+
+def replay_trace(args, header, events, speed=1.0, overrides=""):
+    """
+    Feed recorded events to the switcher and the encoder batcher, speed times faster than recorded
+    Timing settings and fake DDC/GPIO delays are divided by speed; latencies are
+    multiplied back, so results are in trace time. Startup of the fake ddcutil
+    process doesn't scale: use --backend native for fast replays.
+    """
+    switcher_attrs, encoder_settings = parse_overrides(overrides)
+    roles = {index: device.get("role") for index, device in enumerate(header["devices"])}
+    mqtt_stub.broker.reset()
+    saved = {name: getattr(encoder, name) for name in ENCODER_SETTINGS}
+    saved_ddc = ddc_ci.WRITE_DELAY, ddc_ci.READ_DELAY
+    saved_env = dict(os.environ)
+    ddc_log = os.path.join(os.path.dirname(harness.INPUT_DIR), "replay_ddcutil.log")
+    try:
+        for name, value in encoder_settings.items():
+            setattr(encoder, name, value)
+        # The batcher reads VELOCITY_WINDOW from the module; its other settings are passed in
+        encoder.VELOCITY_WINDOW = encoder.VELOCITY_WINDOW / speed
+        ddc_ci.WRITE_DELAY, ddc_ci.READ_DELAY = saved_ddc[0] / speed, saved_ddc[1] / speed
+        os.environ["FAKE_DDCUTIL_LATENCY"] = ":".join(
+            str(float(part) / speed) for part in args.ddc_latency.split(":")
+        )
+        os.environ["FAKE_DDCUTIL_LOG"] = ddc_log
+        if os.path.exists(ddc_log):
+            os.unlink(ddc_log)
+
+        publisher = MQTTPublisher("bench-broker", reconnect_min=0.05, reconnect_max=0.5).start()
+        scheduler = Scheduler("replay-flush").start()
+        latency = LatencyStats()
+        publish, _ = encoder.brightness_publisher(publisher)
+        batcher = encoder.EncoderBatcher(
+            publish, scheduler.call_later,
+            max_send_rate=encoder.MAX_SEND_RATE * speed,
+            step_size=encoder.STEP_SIZE,
+            acceleration=tuple((interval / speed, multiplier) for interval, multiplier in encoder.ACCELERATION),
+            latency=latency,
+            quiet_time=encoder.QUIET_TIME / speed,
+        )
+        evdev.register_device(harness.ENCODER_DEVICE, "binepad BNK8 Consumer Control")
+
+        def read_encoder():
+            try:
+                for event in evdev.InputDevice(harness.ENCODER_DEVICE).read_loop():
+                    direction = encoder.encoder_direction(event)
+                    if direction:
+                        batcher.handle_encoder_event(direction, event.timestamp())
+            except OSError:
+                pass
+
+        reader = threading.Thread(target=read_encoder, name="replay-encoder")
+        reader.start()
+        switcher, thread = start_switcher(args, speed=speed, **switcher_attrs)
+        startup_commands = sum(fake_ddcutil_commands(ddc_log, 0).values())
+        startup_pulses = len(GPIO.pulses())
+
+        paths = {index: harness.BUTTON_DEVICE if role == "buttons" else harness.ENCODER_DEVICE
+                 for index, role in roles.items() if role in event_trace.ROLES}
+        lag = LatencyHistogram(window=max(1, len(events)))
+        first = events[0].timestamp()
+        start = time.time() + 0.05
+        for event in events:
+            path = paths.get(event.device)
+            if path is None:
+                continue
+            target = start + (event.timestamp() - first) / speed
+            delay = target - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            lag.record(max(0.0, time.time() - target) * 1000)
+            evdev.inject(path, event.type, event.code, event.value, timestamp=target)
+        replay_s = time.time() - start
+        time.sleep(0.01)
+        wait_idle(switcher)
+        time.sleep(2 / (encoder.MAX_SEND_RATE * speed))
+
+        changes = [int(m.payload) for m in mqtt_stub.broker.messages if m.topic == encoder.MQTT_TOPIC]
+        result = {
+            "speed": speed,
+            "overrides": overrides or None,
+            "trace_s": round(events[-1].timestamp() - first, 3),
+            "replay_s": round(replay_s, 3),
+            "injection_lag_ms": lag.summary(),
+            "switcher": {
+                "actions": dict(switcher.action_results),
+                "dispatcher": {k: v for k, v in switcher.dispatcher.snapshot().items() if k not in ("in_flight", "queue_depth")},
+                "ddc_commands": fake_ddcutil_commands(ddc_log, startup_commands) if args.backend == "ddcutil"
+                else ddc_commands(switcher),
+                "usb_pulses": len(GPIO.pulses()) - startup_pulses if args.gpio == "rpi" else switcher.gpio.snapshot()["pulses"],
+                "final_input": switcher.current_input,
+                "latency_ms": scale_latency(switcher.latency.snapshot(), speed),
+            },
+            "encoder": {
+                "clicks": batcher.snapshot()["clicks"],
+                "mqtt_messages": len(changes),
+                "messages_per_click": batcher.snapshot()["messages_per_click"],
+                "net_change": sum(changes),
+                "largest_change": max(changes, key=abs) if changes else 0,
+                "latency_ms": scale_latency(latency.snapshot(), speed),
+            },
+        }
+        stop_switcher(switcher, thread)
+        scheduler.stop()
+        batcher.cancel()
+        evdev.unregister_device(harness.ENCODER_DEVICE)
+        reader.join()
+        publisher.stop()
+        return result
+    finally:
+        for name, value in saved.items():
+            setattr(encoder, name, value)
+        ddc_ci.WRITE_DELAY, ddc_ci.READ_DELAY = saved_ddc
+        os.environ.clear()
+        os.environ.update(saved_env)
+
+
+def bench_replay(args):
+    """A synthetic trace replayed at 1x and --replay-speed, then with a different encoder configuration"""
+    path = args.trace or synthetic_trace(os.path.join(os.path.dirname(harness.INPUT_DIR), "synthetic.trace"))
+    header, events = event_trace.read_trace(path)
+    runs = {
+        "1x": replay_trace(args, header, events),
+        f"{args.replay_speed:g}x": replay_trace(args, header, events, args.replay_speed),
+        f"{args.replay_speed:g}x_variant": replay_trace(args, header, events, args.replay_speed, args.variant),
+    }
+    fast = runs[f"{args.replay_speed:g}x"]
+    # How many hammered presses run before being coalesced depends on DDC timing, so actions can differ
+    checks = {}
+    for side, key in (("encoder", "mqtt_messages"), ("encoder", "net_change"), ("switcher", "final_input")):
+        slow, quick = runs["1x"][side][key], fast[side][key]
+        checks[f"{key}_matches_1x"] = check(slow == quick, f"{quick} at {args.replay_speed:g}x, {slow} at 1x")
+    result = {"trace": path, "events": len(events), "trace_bytes": os.path.getsize(path), "checks": checks}
+    for name, run in runs.items():
+        result[name] = {
+            "replay_s": run["replay_s"],
+            "actions": run["switcher"]["actions"],
+            "ddc_commands": run["switcher"]["ddc_commands"],
+            "coalesced": run["switcher"]["dispatcher"]["coalesced"],
+            "mqtt_messages": run["encoder"]["mqtt_messages"],
+            "net_change": run["encoder"]["net_change"],
+            "switch_total_ms": {action: stages.get("total") for action, stages in run["switcher"]["latency_ms"].items()},
+            "brightness_total_ms": run["encoder"]["latency_ms"].get("brightness", {}).get("total"),
+        }
+    return result
+
+
+SCENARIOS = {
+    "replay": bench_replay,
+}
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group("replay scenario")
+    group.add_argument("--replay-speed", type=float, default=4.0, help="replay speed-up to compare with 1x (replay)")
+    group.add_argument("--trace", help="event trace to replay instead of a synthetic one (replay)")
+    group.add_argument("--variant", default="encoder.MAX_SEND_RATE=5,encoder.STEP_SIZE=3",
+                       help="overrides for the variant run (replay), e.g. switcher.parallel_switching=false")
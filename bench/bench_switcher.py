@@ -0,0 +1,216 @@
+"""Switcher scenarios: switch, burst, hung, hotplug and verify"""
+import argparse
+import os
+import time
+
+import harness  # Puts the stand-ins and the repo on sys.path first
+from harness import SWITCH_KEYS, check, cpu_seconds, parse_range, press, pulse_summary, start_switcher, stop_switcher, wait_idle
+
+import evdev
+
+import ddc_ci
+
+
+def bench_switch(args):
+    """Sequential presses, each allowed to finish: per-action latency and CPU"""
+    switcher, thread = start_switcher(args)
+    cpu_start, wall_start = cpu_seconds(), time.monotonic()
+    for i in range(args.presses):
+        press(SWITCH_KEYS[i % 2])
+        time.sleep(0.005)  # Let the read loop pick the press up
+        wait_idle(switcher)
+    wall = time.monotonic() - wall_start
+    cpu = cpu_seconds() - cpu_start
+    result = {
+        "presses": args.presses,
+        "wall_s": round(wall, 3),
+        "actions_per_s": round(args.presses / wall, 2),
+        "cpu_ms_per_action": round(cpu * 1000 / args.presses, 2),
+        "latency_ms": switcher.latency.snapshot(),
+        "actions": dict(switcher.action_results),
+        "gpio_pulses": pulse_summary(switcher),
+        "state_cache": switcher.stats_providers()["state_cache"](),
+        "dispatcher": switcher.dispatcher.snapshot(),
+    }
+    stop_switcher(switcher, thread)
+    return result
+
+
+def bench_burst(args):
+    """Mashed alternating presses: coalescing and time until the last target lands"""
+    switcher, thread = start_switcher(args)
+    cpu_start, wall_start = cpu_seconds(), time.monotonic()
+    for i in range(args.presses):
+        press(SWITCH_KEYS[i % 2])
+        time.sleep(args.press_interval)
+    last_press = time.monotonic()
+    time.sleep(0.005)
+    wait_idle(switcher)
+    wall = time.monotonic() - wall_start
+    expected = switcher.button_mapping[SWITCH_KEYS[(args.presses - 1) % 2]]
+    result = {
+        "presses": args.presses,
+        "press_interval_s": args.press_interval,
+        "wall_s": round(wall, 3),
+        "settle_after_last_press_ms": round((time.monotonic() - last_press) * 1000, 1),
+        "cpu_ms_per_press": round((cpu_seconds() - cpu_start) * 1000 / args.presses, 2),
+        "actions": dict(switcher.action_results),
+        "final_input": switcher.current_input,
+        "checks": {"final_input": check(switcher.current_input == expected, f"expected {expected}")},
+        "dispatcher": switcher.dispatcher.snapshot(),
+        "latency_ms": switcher.latency.snapshot(),
+    }
+    stop_switcher(switcher, thread)
+    return result
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    # A killed but unreaped child still shows as a zombie
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().split(")")[-1].split()[0] != "Z"
+    except OSError:
+        return False
+
+
+def bench_hung(args):
+    """A monitor that never answers: command kills on supersession/timeout, then the circuit breaker"""
+    pid_file = os.path.join(os.path.dirname(harness.INPUT_DIR), "hung_pids")
+    os.environ["FAKE_DDCUTIL_HANG_BUSES"] = "2"
+    os.environ["FAKE_DDCUTIL_PIDS"] = pid_file
+    switcher, thread = start_switcher(argparse.Namespace(**dict(vars(args), backend="ddcutil")))
+    try:
+        # A press superseding one stuck on the hung monitor kills its ddcutil at once
+        press(SWITCH_KEYS[0])
+        time.sleep(args.ddc_timeout / 2)
+        press(SWITCH_KEYS[1])
+        time.sleep(0.005)
+        wait_idle(switcher)
+
+        press_ms = []
+        for i in range(args.presses):
+            start = time.monotonic()
+            press(SWITCH_KEYS[i % 2])
+            time.sleep(0.005)
+            wait_idle(switcher)
+            press_ms.append(round((time.monotonic() - start) * 1000, 1))
+        result = {
+            "ddc_timeout_s": args.ddc_timeout,
+            "press_ms": press_ms,
+            "actions": dict(switcher.action_results),
+            "dispatcher": switcher.dispatcher.snapshot(),
+            "breakers": switcher.stats_providers()["ddc"](),
+        }
+    finally:
+        del os.environ["FAKE_DDCUTIL_HANG_BUSES"]
+    stop_switcher(switcher, thread)
+    with open(pid_file) as f:
+        pids = [int(line) for line in f if line.strip()]
+    result["hung_processes_started"] = len(pids)
+    result["hung_processes_left"] = sum(1 for pid in pids if pid_alive(pid))
+    result["checks"] = {"hung_processes_killed": check(
+        result["hung_processes_left"] == 0, f"{result['hung_processes_left']} of {len(pids)} still running")}
+    return result
+
+
+def bench_hotplug(args):
+    """Unplug and replug the pad: time from the node reappearing to presses working again"""
+    switcher, thread = start_switcher(args)
+    for cycle in range(args.replugs):
+        evdev.unregister_device(harness.BUTTON_DEVICE)
+        time.sleep(args.unplug_time)
+        evdev.register_device(harness.BUTTON_DEVICE, "binepad BNK8", SWITCH_KEYS)
+        deadline = time.monotonic() + 10
+        while switcher.device_stats["reattaches"] <= cycle:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Macro pad was not reattached")
+            time.sleep(0.001)
+        press(SWITCH_KEYS[cycle % 2])
+        time.sleep(0.005)
+        wait_idle(switcher)
+    result = {
+        "replugs": args.replugs,
+        "device": dict(switcher.device_stats),
+        "actions": dict(switcher.action_results),
+    }
+    stop_switcher(switcher, thread)
+    return result
+
+
+def bench_verify(args):
+    """Input switches on monitors slow to settle: ddcutil-style verify vs polled read-back vs none"""
+    settle = parse_range(args.settle)
+    harness.FAKE_MONITOR = {"settle": {ddc_ci.VCP_INPUT_SOURCE: settle, ddc_ci.VCP_POWER_MODE: settle},
+                    "drop_rate": args.write_drop_rate}
+    os.environ["FAKE_DDCUTIL_SETTLE"] = args.settle
+    os.environ["FAKE_DDCUTIL_VERIFY_DELAY"] = str(args.verify_delay)
+    os.environ["FAKE_DDCUTIL_DROP_RATE"] = str(args.write_drop_rate)
+    longest = settle[1] if isinstance(settle, tuple) else settle
+    result = {"settle_s": args.settle, "write_drop_rate": args.write_drop_rate}
+    try:
+        for mode in ("off", "backend", "poll"):
+            switcher, thread = start_switcher(args, VERIFY_MODE=mode)
+            halves = []
+            wrong = 0
+            for i in range(args.presses):
+                press(SWITCH_KEYS[i % 2])
+                time.sleep(0.005)
+                wait_idle(switcher)
+                if i + 1 == args.presses // 2:
+                    halves.append(dict(switcher.displays[0].settle.stats))
+                # What the monitors really show once settled, against what the switcher believes
+                time.sleep(longest)
+                for display in switcher.displays:
+                    shown, _ = display.ddc.get_vcp(ddc_ci.VCP_INPUT_SOURCE)
+                    believed = display.state.input_source()
+                    wrong += believed is not None and believed != shown & 0xFF
+            halves.append(dict(switcher.displays[0].settle.stats))
+            latency = switcher.latency.snapshot()
+            run = {
+                "actions": dict(switcher.action_results),
+                "believed_wrong_input": wrong,
+                "input_switch_ms": {action: latency.get(action, {}).get("input_switch") for action in ("displayport", "usbc")},
+                "verified_ms": {action: latency.get(action, {}).get("input_switch_verified") for action in ("displayport", "usbc")},
+                "verify": switcher.stats_providers()["verify"](),
+            }
+            if mode == "poll" and len(halves) == 2:
+                first, total = halves
+                second = {key: total[key] - first[key] for key in total}
+                run["reads_per_switch"] = {
+                    "first_half": round(first["reads"] / max(1, first["verified"] + first["unverified"]), 2),
+                    "second_half": round(second["reads"] / max(1, second["verified"] + second["unverified"]), 2),
+                }
+            result[mode] = run
+            stop_switcher(switcher, thread)
+    finally:
+        harness.FAKE_MONITOR = {}
+        for name in ("FAKE_DDCUTIL_SETTLE", "FAKE_DDCUTIL_VERIFY_DELAY", "FAKE_DDCUTIL_DROP_RATE"):
+            del os.environ[name]
+    return result
+
+
+SCENARIOS = {
+    "switch": bench_switch,
+    "burst": bench_burst,
+    "hotplug": bench_hotplug,
+    "hung": bench_hung,
+    "verify": bench_verify,
+}
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group("switcher scenarios")
+    group.add_argument("--replugs", type=int, default=5)
+    group.add_argument("--unplug-time", type=float, default=0.2, help="seconds the pad stays unplugged")
+    group.add_argument("--settle", default="0.15:0.35",
+                       help="seconds (or min:max) a fake monitor takes to show a written input (verify)")
+    group.add_argument("--verify-delay", type=float, default=0.1,
+                       help="fixed sleep of the fake ddcutil's own verify (verify)")
+    group.add_argument("--write-drop-rate", type=float, default=0.1,
+                       help="probability a Set VCP is lost on the bus (verify)")
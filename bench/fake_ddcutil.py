@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Fake ddcutil for hardware-free benchmarks
+Understands the setvcp/getvcp/detect invocations the switcher makes.
+Behaviour is controlled by environment variables:
+
+    FAKE_DDCUTIL_LATENCY       seconds per command, or "min:max" for a uniform range
+    FAKE_DDCUTIL_FAILURE_RATE  probability (0-1) that a command fails with exit code 1
+    FAKE_DDCUTIL_STATE         JSON file holding each bus's VCP values between invocations
+    FAKE_DDCUTIL_DISPLAYS      comma-separated buses that `detect` reports (default "2")
+    FAKE_DDCUTIL_LOG           file that each invocation is appended to
+    FAKE_DDCUTIL_HANG_BUSES    comma-separated buses whose monitor never answers: the
+                               command starts a helper child and both sleep forever
+    FAKE_DDCUTIL_PIDS          file that hung invocations append their pids to
+    FAKE_DDCUTIL_WAKE_LATENCY  extra seconds a power-on (setvcp D6 1) takes from standby
+    FAKE_DDCUTIL_SETTLE        seconds (or "min:max") a written 60/D6 value takes to show up
+                               in getvcp; setvcp without --noverify then sleeps
+                               FAKE_DDCUTIL_VERIFY_DELAY and fails if it hasn't yet
+    FAKE_DDCUTIL_DROP_RATE     probability (0-1) that a setvcp is silently ignored
+"""
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+DEFAULT_STATE = {"60": 0x0F, "D6": 0x01}
+SETTLING_CODES = ("60", "D6")
+
+
+def parse_latency(value):
+    if ":" in value:
+        low, high = value.split(":", 1)
+        return random.uniform(float(low), float(high))
+    return float(value)
+
+
+def load_state(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def settled(state):
+    """Apply the written values whose settle time has passed"""
+    settling = state.get("settling", {})
+    for code, (value, ready_at) in list(settling.items()):
+        if time.time() >= ready_at:
+            state[code] = value
+            del settling[code]
+    return state
+
+
+def save_state(path, state):
+    if path:
+        tmp_path = f"{path}.{os.getpid()}.tmp"  # Parallel commands each write their own
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+
+def main(argv):
+    args = [arg for arg in argv if not arg.startswith("--")]
+    bus = next((arg.split("=", 1)[1] for arg in argv if arg.startswith("--bus=")), "?")
+
+    log_path = os.environ.get("FAKE_DDCUTIL_LOG")
+    if log_path:
+        with open(log_path, "a") as f:
+            f.write(f"{time.time():.6f} {' '.join(argv)}\n")
+
+    hung_buses = os.environ.get("FAKE_DDCUTIL_HANG_BUSES", "").split(",")
+    if bus in hung_buses and args and args[0] in ("setvcp", "getvcp"):
+        # Like a wedged i2c transfer: only killing the whole process group cleans this up
+        child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(3600)"])
+        pid_path = os.environ.get("FAKE_DDCUTIL_PIDS")
+        if pid_path:
+            with open(pid_path, "a") as f:
+                f.write(f"{os.getpid()}\n{child.pid}\n")
+        time.sleep(3600)
+
+    time.sleep(parse_latency(os.environ.get("FAKE_DDCUTIL_LATENCY", "0")))
+    if random.random() < float(os.environ.get("FAKE_DDCUTIL_FAILURE_RATE", "0")):
+        print("DDC communication failed", file=sys.stderr)
+        return 1
+
+    state_path = os.environ.get("FAKE_DDCUTIL_STATE")
+    states = load_state(state_path)
+    state = states.setdefault(bus, dict(DEFAULT_STATE))
+
+    if not args:
+        print("Usage: ddcutil COMMAND", file=sys.stderr)
+        return 2
+
+    command = args[0]
+    if command == "setvcp" and len(args) >= 3:
+        code, value = args[1].upper(), int(args[2], 0)
+        if code == "D6" and value == 1 and state.get("D6") != 1:
+            time.sleep(float(os.environ.get("FAKE_DDCUTIL_WAKE_LATENCY", "0")))
+            states = load_state(state_path)  # Other commands may have run meanwhile
+            state = states.setdefault(bus, dict(DEFAULT_STATE))
+        settle = parse_latency(os.environ.get("FAKE_DDCUTIL_SETTLE", "0")) if code in SETTLING_CODES else 0
+        if random.random() < float(os.environ.get("FAKE_DDCUTIL_DROP_RATE", "0")):
+            pass  # Lost on the bus: the monitor never saw it
+        elif settle > 0:
+            state.setdefault("settling", {})[code] = [value, time.time() + settle]
+        else:
+            state.get("settling", {}).pop(code, None)
+            state[code] = value
+        save_state(state_path, states)
+        if "--noverify" not in argv:
+            # ddcutil's own verification: a fixed sleep, then one read-back
+            time.sleep(float(os.environ.get("FAKE_DDCUTIL_VERIFY_DELAY", "0")))
+            state = settled(load_state(state_path).get(bus, state))
+            if state.get(code) != value:
+                print(f"Verification failed for feature {code}", file=sys.stderr)
+                return 1
+        return 0
+    if command == "getvcp" and len(args) >= 2:
+        code = args[1].upper()
+        state = settled(state)
+        if code not in state:
+            print(f"VCP {code} ERR")
+            return 1
+        print(f"VCP {code} SNC x{state[code]:02x}")
+        return 0
+    if command == "detect":
+        buses = os.environ.get("FAKE_DDCUTIL_DISPLAYS", "2").split(",")
+        for number, display_bus in enumerate(buses, 1):
+            print(f"Display {number}\n   I2C bus:  /dev/i2c-{display_bus}\n"
+                  f"   Monitor:  FAK:Fake Monitor:{int(display_bus):07d}")
+        return 0
+
+    print(f"Unrecognized command: {command}", file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,157 @@
+"""
+Shared setup for the bench scenarios
+Puts the stand-in evdev/RPi.GPIO/paho modules from bench/stubs and the repo on
+sys.path, installs the fake ddcutil, and runs DDCMonitorSwitcher on fake devices.
+"""
+import os
+import sys
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path[:0] = [os.path.join(BENCH_DIR, "stubs"), REPO_DIR]
+
+import evdev  # noqa: E402  (the stand-in from bench/stubs)
+from RPi import GPIO  # noqa: E402
+
+import ddc_ci  # noqa: E402
+import ddc_switcher  # noqa: E402
+import displays  # noqa: E402
+
+# Set by use_input_dir(): fake nodes live in the run's temp dir so inotify sees them
+INPUT_DIR = None
+BUTTON_DEVICE = None
+ENCODER_DEVICE = None
+SWITCH_KEYS = [evdev.ecodes.KEY_F23, evdev.ecodes.KEY_F24]
+# Timing settings divided by the replay speed, so an accelerated replay behaves like real time
+SCALED_SWITCHER_TIMES = ("SWITCH_PULSE_DURATION", "DOUBLE_TAP_WINDOW", "LONG_PRESS_TIME")
+# Keyword arguments for each native fake monitor (FakeI2CDevice), e.g. a settle time
+FAKE_MONITOR = {}
+
+
+def install_fake_ddcutil(workdir, latency, failure_rate):
+    """Put bench/fake_ddcutil.py on PATH as ddcutil with the given behaviour"""
+    os.symlink(os.path.join(BENCH_DIR, "fake_ddcutil.py"), os.path.join(workdir, "ddcutil"))
+    os.environ["PATH"] = f"{workdir}{os.pathsep}{os.environ['PATH']}"
+    os.environ["FAKE_DDCUTIL_LATENCY"] = latency
+    os.environ["FAKE_DDCUTIL_FAILURE_RATE"] = str(failure_rate)
+    os.environ["FAKE_DDCUTIL_STATE"] = os.path.join(workdir, "vcp_state.json")
+
+
+def bench_displays(args, inputs, state_ttl):
+    """One fake monitor per --displays, on buses 2, 3, ..."""
+    result = []
+    for index in range(args.displays):
+        bus = 2 + index
+        if args.backend == "native":
+            ddc = ddc_ci.I2CBackend(bus, device=ddc_ci.FakeI2CDevice(**FAKE_MONITOR))
+        else:
+            ddc = ddc_ci.DdcutilBackend(bus, timeout=args.ddc_timeout)
+        result.append(displays.Display(f"display{index + 1}", bus, ddc, inputs, state_ttl=state_ttl))
+    return result
+
+
+def use_input_dir(workdir):
+    global INPUT_DIR, BUTTON_DEVICE, ENCODER_DEVICE
+    INPUT_DIR = os.path.join(workdir, "input")
+    os.makedirs(INPUT_DIR)
+    BUTTON_DEVICE = os.path.join(INPUT_DIR, "bench-buttons")
+    ENCODER_DEVICE = os.path.join(INPUT_DIR, "bench-encoder")
+
+
+def cpu_seconds():
+    """CPU time of this process and its reaped children (fake ddcutil runs)"""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def start_switcher(args, speed=1.0, **attrs):
+    """
+    Run DDCMonitorSwitcher.run() on a thread, reading the fake button device; attrs override config
+    speed > 1 shortens the switcher's timing settings to match a replay running that much faster.
+    """
+    GPIO.reset()
+    evdev.register_device(BUTTON_DEVICE, "binepad BNK8", SWITCH_KEYS)
+    switcher = ddc_switcher.DDCMonitorSwitcher(install_signal_handlers=False)
+    if args.gpio == "fake":
+        switcher.cleanup_usb_switch_gpio()
+        switcher.gpio_backend = "fake"
+        switcher.setup_usb_switch_gpio()
+    switcher.displays = bench_displays(args, switcher.inputs, switcher.STATE_TTL)
+    switcher.state_cache_enabled = not args.no_cache
+    switcher.parallel_switching = not args.sequential
+    switcher.stats_file = None
+    switcher.DEVICE_CACHE = os.path.join(INPUT_DIR, "..", "input_devices.json")
+    switcher.INPUT_DIRS = (INPUT_DIR,)
+    switcher.CONTROL_SOCKET = os.path.join(os.path.dirname(INPUT_DIR), "control.sock")
+    switcher.ACTIONS_FILE = None
+    for name, value in attrs.items():
+        setattr(switcher, name, value)
+    for name in SCALED_SWITCHER_TIMES:
+        setattr(switcher, name, getattr(switcher, name) / speed)
+    thread = threading.Thread(target=switcher.run, name="bench-switcher")
+    thread.start()
+    while not switcher.dispatcher.running or not switcher.control_server:
+        time.sleep(0.001)
+    return switcher, thread
+
+
+def stop_switcher(switcher, thread):
+    # Unplugging the fake device ends run()'s read loop, which then calls stop()
+    switcher.stop_requested.set()
+    evdev.unregister_device(BUTTON_DEVICE)
+    thread.join()
+
+
+def wait_idle(switcher, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = switcher.dispatcher.snapshot()
+        if stats["in_flight"] is None and stats["queue_depth"] == 0:
+            return
+        time.sleep(0.002)
+    raise RuntimeError("Switcher did not become idle")
+
+
+def press(code):
+    """Inject a key press (down + up) on the fake button device"""
+    evdev.inject(BUTTON_DEVICE, evdev.ecodes.EV_KEY, code, evdev.KeyEvent.key_down)
+    evdev.inject(BUTTON_DEVICE, evdev.ecodes.EV_KEY, code, evdev.KeyEvent.key_up)
+
+
+def hold(code, seconds):
+    """Press a key, hold it, release it"""
+    evdev.inject(BUTTON_DEVICE, evdev.ecodes.EV_KEY, code, evdev.KeyEvent.key_down)
+    time.sleep(seconds)
+    evdev.inject(BUTTON_DEVICE, evdev.ecodes.EV_KEY, code, evdev.KeyEvent.key_up)
+
+
+def pulse_summary(switcher):
+    """Widths the backend measured, checked against the pin changes RPi.GPIO saw"""
+    widths = [width * 1000 for _, _, width in GPIO.pulses()]
+    summary = switcher.gpio.snapshot()
+    if widths:
+        summary["observed_mean_ms"] = round(sum(widths) / len(widths), 3)
+        summary["observed_max_ms"] = round(max(widths), 3)
+    return summary
+
+
+def ddc_commands(switcher):
+    """DDC commands attempted so far on every display, per the circuit breakers"""
+    return sum(
+        stats["successes"] + stats["failures"] for stats in switcher.stats_providers()["ddc"]().values()
+    )
+
+
+def parse_range(text):
+    """'0.15:0.35' -> (0.15, 0.35); '0.2' -> 0.2"""
+    if ":" in text:
+        low, high = text.split(":", 1)
+        return float(low), float(high)
+    return float(text)
+
+
+def check(ok, detail):
+    """A scenario's pass/fail result: "ok", or "FAILED: detail", which makes run_bench.py exit non-zero"""
+    return "ok" if ok else f"FAILED: {detail}"
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Replay a recorded input trace through the switcher and the encoder batcher
+Traces come from tools/record_events.py. Events are fed to the real switcher
+and EncoderBatcher through the bench stand-ins (fake ddcutil or FakeI2CDevice,
+RPi.GPIO stub, in-process MQTT broker), at 1x or faster, once with the current
+settings and once per --variant, so configurations are compared on identical input.
+
+    python3 bench/replay.py desk.trace
+    python3 bench/replay.py desk.trace --speed 8 --backend native
+    python3 bench/replay.py desk.trace --variant encoder.MAX_SEND_RATE=5,encoder.STEP_SIZE=3 \\
+        --variant switcher.parallel_switching=false
+    python3 bench/replay.py --synthesize demo.trace     # write a synthetic trace to try it on
+
+Latencies are reported in trace time: measured times are multiplied by --speed.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402  (also puts the stand-ins on sys.path)
+import bench_replay  # noqa: E402
+import event_trace  # noqa: E402
+
+SUMMARY = (
+    ("replay_s", lambda run: run["replay_s"]),
+    ("actions ok/failed", lambda run: "{succeeded}/{failed}".format(**run["switcher"]["actions"])),
+    ("coalesced", lambda run: run["switcher"]["dispatcher"]["coalesced"]),
+    ("superseded", lambda run: run["switcher"]["dispatcher"]["superseded"]),
+    ("ddc commands", lambda run: run["switcher"]["ddc_commands"]),
+    ("usb pulses", lambda run: run["switcher"]["usb_pulses"]),
+    ("final input", lambda run: run["switcher"]["final_input"]),
+    ("switch p50/p95 ms", lambda run: percentiles(run["switcher"]["latency_ms"], None)),
+    ("encoder clicks", lambda run: run["encoder"]["clicks"]),
+    ("mqtt messages", lambda run: run["encoder"]["mqtt_messages"]),
+    ("net change", lambda run: run["encoder"]["net_change"]),
+    ("brightness p50/p95 ms", lambda run: percentiles(run["encoder"]["latency_ms"], "brightness")),
+)
+
+
+def percentiles(latency, action):
+    """p50/p95 of the 'total' stage, of one action or of the slowest action"""
+    totals = [stages["total"] for name, stages in latency.items()
+              if (action is None or name == action) and stages.get("total", {}).get("count")]
+    if not totals:
+        return "-"
+    worst = max(totals, key=lambda total: total["p95"])
+    return f"{worst['p50']:.0f}/{worst['p95']:.0f}"
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("trace", nargs="?", help="trace file from tools/record_events.py")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay this many times faster than recorded")
+    parser.add_argument("--variant", action="append", default=[],
+                        help="comma-separated switcher.<attr>=VALUE / encoder.<SETTING>=VALUE overrides")
+    parser.add_argument("--synthesize", metavar="PATH", help="write a synthetic trace to PATH and exit")
+    parser.add_argument("--backend", choices=["ddcutil", "native"], default="ddcutil")
+    parser.add_argument("--ddc-latency", default="0.02:0.08",
+                        help="fake ddcutil seconds per command, or min:max (default %(default)s)")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--ddc-timeout", type=float, default=1.0)
+    parser.add_argument("--displays", type=int, default=1)
+    parser.add_argument("--gpio", choices=["rpi", "fake"], default="rpi")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--sequential", action="store_true")
+    parser.add_argument("--json", help="also write the full results to this file")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the daemons' logging")
+    args = parser.parse_args(argv)
+    if not args.trace and not args.synthesize:
+        parser.error("a trace file (or --synthesize PATH) is required")
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+    for variant in args.variant:
+        try:
+            bench_replay.parse_overrides(variant)
+        except ValueError as e:
+            parser.error(str(e))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.synthesize:
+        bench_replay.synthetic_trace(args.synthesize)
+        print(f"Wrote a synthetic trace to {args.synthesize}")
+        return
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    else:
+        logging.disable(logging.CRITICAL)
+
+    header, events = event_trace.read_trace(args.trace)
+    if not events:
+        raise SystemExit(f"{args.trace} holds no events")
+    devices = ", ".join(f"{device['role']} ({device['name']})" for device in header["devices"])
+    span = events[-1].timestamp() - events[0].timestamp()
+    print(f"{args.trace}: {len(events)} events over {span:.1f} s from {devices}, replaying at {args.speed:g}x")
+
+    runs = {}
+    with tempfile.TemporaryDirectory(prefix="macropad-replay-") as workdir:
+        harness.install_fake_ddcutil(workdir, args.ddc_latency, args.failure_rate)
+        harness.use_input_dir(workdir)
+        runs["baseline"] = bench_replay.replay_trace(args, header, events, args.speed)
+        for variant in args.variant:
+            runs[variant] = bench_replay.replay_trace(args, header, events, args.speed, variant)
+
+    names = list(runs)
+    width = max(12, *(len(str(value(run))) + 2 for run in runs.values() for _, value in SUMMARY))
+    print(f"\n{'':<24}" + "".join(f"{f'[{i}]':>{width}}" for i in range(len(names))))
+    for label, value in SUMMARY:
+        print(f"{label:<24}" + "".join(f"{str(value(runs[name])):>{width}}" for name in names))
+    for i, name in enumerate(names):
+        print(f"[{i}] {name}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(runs, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
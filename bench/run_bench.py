@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Hardware-free benchmark for the macro pad daemons
+Drives DDCMonitorSwitcher and the encoder batching with synthetic evdev
+events. It uses stand-in evdev/RPi.GPIO/paho modules from bench/stubs and
+either a fake ddcutil on PATH or the native DDC/CI backend on a FakeI2CDevice.
+Reports throughput, latency percentiles, CPU time per action and GPIO pulse
+widths, so regressions show up in repeatable runs on any Linux box.
+Scenarios live in one bench_<area>.py module per part of the daemons. Each
+reports pass/fail checks, and the run exits non-zero if any check fails.
+
+Usage:
+    python3 bench/run_bench.py                                  # all scenarios
+    python3 bench/run_bench.py switch --backend ddcutil --ddc-latency 0.05:0.2
+    python3 bench/run_bench.py burst --failure-rate 0.1
+    python3 bench/run_bench.py switch --displays 3
+    python3 bench/run_bench.py hotplug --replugs 10
+    python3 bench/run_bench.py hung --presses 6 --ddc-timeout 2
+    python3 bench/run_bench.py encoder --spins 20
+    python3 bench/run_bench.py timers --burst-clicks 1000
+    python3 bench/run_bench.py mqtt --outage 3
+    python3 bench/run_bench.py brightness --drop-rate 0.2
+    python3 bench/run_bench.py logging --log-write-ms 2
+    python3 bench/run_bench.py control --clients 16
+    python3 bench/run_bench.py ha --presses 10
+    python3 bench/run_bench.py gestures --wake-latency 1.0
+    python3 bench/run_bench.py pipelines --displays 2
+    python3 bench/run_bench.py replay --replay-speed 8 --backend native
+    python3 bench/run_bench.py verify --settle 0.1:0.6 --write-drop-rate 0.2
+    python3 bench/run_bench.py probe --ack-latency 0.05 --automation-delay 0.3:0.8
+    python3 bench/run_bench.py --json results.json
+"""
+import argparse
+import json
+import logging
+import sys
+import tempfile
+
+import harness  # Puts the stand-ins and the repo on sys.path first
+import bench_control
+import bench_encoder
+import bench_gestures
+import bench_logging
+import bench_mqtt
+import bench_pipelines
+import bench_replay
+import bench_switcher
+
+MODULES = (bench_switcher, bench_encoder, bench_mqtt, bench_logging, bench_control,
+           bench_gestures, bench_pipelines, bench_replay)
+SCENARIOS = {name: scenario for module in MODULES for name, scenario in module.SCENARIOS.items()}
+
+
+def print_latency(latency, indent="  "):
+    for action, stages in sorted(latency.items()):
+        print(f"{indent}{action}:")
+        for stage, summary in sorted(stages.items()):
+            if summary.get("count"):
+                print(
+                    f"{indent}  {stage:<14} n={summary['count']:<5} p50={summary['p50']:>9.2f}"
+                    f"  p95={summary['p95']:>9.2f}  p99={summary['p99']:>9.2f}  max={summary['max']:>9.2f}"
+                )
+
+
+def print_report(name, result):
+    print(f"== {name} ==")
+    for key, value in result.items():
+        if key == "latency_ms":
+            print("  latency (ms):")
+            print_latency(value, indent="    ")
+        else:
+            print(f"  {key}: {value}")
+    print()
+
+
+def failed_checks(result, path):
+    """(path, message) for every "FAILED: ..." check in a scenario's result"""
+    if isinstance(result, dict):
+        return [failure for key, value in result.items() for failure in failed_checks(value, f"{path}.{key}")]
+    if isinstance(result, str) and result.startswith("FAILED"):
+        return [(path, result)]
+    return []
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("scenarios", nargs="*", help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--backend", choices=["ddcutil", "native"], default="ddcutil")
+    parser.add_argument("--ddc-latency", default="0.02:0.08",
+                        help="fake ddcutil seconds per command, or min:max (default %(default)s)")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--no-cache", action="store_true", help="disable the monitor state cache")
+    parser.add_argument("--sequential", action="store_true", help="run DDC and USB legs back to back")
+    parser.add_argument("--gpio", choices=["rpi", "fake"], default="rpi",
+                        help="GPIO backend: the RPi.GPIO stand-in or the in-memory fake")
+    parser.add_argument("--ddc-timeout", type=float, default=1.0, help="seconds before a fake ddcutil process group is killed")
+    parser.add_argument("--displays", type=int, default=1, help="number of fake monitors to switch")
+    parser.add_argument("--presses", type=int, default=20)
+    parser.add_argument("--press-interval", type=float, default=0.02)
+    parser.add_argument("--spins", type=int, default=10)
+    parser.add_argument("--clicks-per-spin", type=int, default=12)
+    parser.add_argument("--click-interval", type=float, default=0.03)
+    parser.add_argument("--spin-pause", type=float, default=0.6)
+    parser.add_argument("--json", help="also write results to this file")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the daemons' logging")
+    for module in MODULES:
+        if hasattr(module, "add_arguments"):
+            module.add_arguments(parser)
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = args.scenarios or list(SCENARIOS)
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    else:
+        logging.disable(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory(prefix="macropad-bench-") as workdir:
+        harness.install_fake_ddcutil(workdir, args.ddc_latency, args.failure_rate)
+        harness.use_input_dir(workdir)
+        results = {}
+        for name in scenarios:
+            results[name] = SCENARIOS[name](args)
+            print_report(name, results[name])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+
+    failures = [failure for name, result in results.items() for failure in failed_checks(result, name)]
+    for path, message in failures:
+        print(f"{path}: {message}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
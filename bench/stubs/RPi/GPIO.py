@@ -0,0 +1,68 @@
+"""
+Stand-in for RPi.GPIO used by the benchmark harness
+Records every output change with a monotonic timestamp so pulse widths can be
+measured.
+"""
+import threading
+import time
+
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+
+history = []  # (pin, value, monotonic time)
+levels = {}
+_lock = threading.Lock()
+_mode = None
+
+
+def setmode(mode):
+    global _mode
+    _mode = mode
+
+
+def setup(pin, direction, initial=LOW):
+    if _mode is None:
+        raise RuntimeError("Please set pin numbering mode using GPIO.setmode")
+    with _lock:
+        levels[pin] = initial
+
+
+def output(pin, value):
+    if pin not in levels:
+        raise RuntimeError("The GPIO channel has not been set up as an OUTPUT")
+    with _lock:
+        levels[pin] = value
+        history.append((pin, value, time.monotonic()))
+
+
+def cleanup(pins=None):
+    with _lock:
+        for pin in list(levels) if pins is None else pins:
+            levels.pop(pin, None)
+
+
+def pulses():
+    """Completed HIGH->LOW pulses as (pin, start, width in seconds)"""
+    result = []
+    started = {}
+    with _lock:
+        events = list(history)
+    for pin, value, at in events:
+        if value == HIGH:
+            started[pin] = at
+        elif pin in started:
+            start = started.pop(pin)
+            result.append((pin, start, at - start))
+    return result
+
+
+def reset():
+    global _mode
+    with _lock:
+        history.clear()
+        levels.clear()
+    _mode = None
@@ -0,0 +1,119 @@
+"""
+Stand-in for python-evdev used by the benchmark harness
+Implements the subset the daemons use. Devices are registered in memory and
+fed with inject(), so key and encoder events can be driven synthetically.
+"""
+import asyncio
+import errno
+import os
+import queue
+import time
+
+from . import ecodes
+
+_devices = {}
+_CLOSED = object()
+
+
+class InputEvent:
+    def __init__(self, sec, usec, type, code, value):
+        self.sec = sec
+        self.usec = usec
+        self.type = type
+        self.code = code
+        self.value = value
+
+    @classmethod
+    def now(cls, type, code, value, timestamp=None):
+        """Build an event stamped like the kernel would (CLOCK_REALTIME)"""
+        t = time.time() if timestamp is None else timestamp
+        return cls(int(t), int(round((t - int(t)) * 1e6)), type, code, value)
+
+    def timestamp(self):
+        return self.sec + self.usec / 1000000.0
+
+
+class KeyEvent:
+    key_up = 0
+    key_down = 1
+    key_hold = 2
+
+    def __init__(self, event):
+        self.event = event
+        self.scancode = event.code
+        self.keycode = ecodes.KEY.get(event.code, f"KEY_{event.code}")
+        self.keystate = event.value
+
+
+def categorize(event):
+    if event.type == ecodes.EV_KEY:
+        return KeyEvent(event)
+    return event
+
+
+class _FakeDevice:
+    def __init__(self, path, name, keys):
+        self.path = path
+        self.name = name
+        self.keys = list(keys)
+        self.events = queue.Queue()
+
+
+def register_device(path, name, keys=()):
+    """Create an in-memory input device that InputDevice(path) will open"""
+    _devices[path] = _FakeDevice(path, name, keys)
+    if os.path.isdir(os.path.dirname(path)):
+        open(path, "a").close()  # A node on disk lets inotify watchers see the plug
+    return path
+
+
+def unregister_device(path):
+    """Simulate an unplug: readers get ENODEV"""
+    fake = _devices.pop(path, None)
+    if fake:
+        fake.events.put(_CLOSED)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def inject(path, type, code, value, timestamp=None):
+    """Queue one event on a registered device"""
+    event = InputEvent.now(type, code, value, timestamp)
+    _devices[path].events.put(event)
+    return event
+
+
+def list_devices():
+    return list(_devices)
+
+
+class InputDevice:
+    def __init__(self, path):
+        fake = _devices.get(path)
+        if fake is None:
+            raise OSError(errno.ENOENT, f"No such device: {path}")
+        self.fake = fake
+        self.path = path
+        self.name = fake.name
+        self.closed = False
+
+    def capabilities(self):
+        return {ecodes.EV_KEY: self.fake.keys}
+
+    def _next_event(self, timeout=None):
+        event = self.fake.events.get(timeout=timeout)
+        if event is _CLOSED:
+            raise OSError(errno.ENODEV, "No such device")
+        return event
+
+    def read_loop(self):
+        while not self.closed:
+            yield self._next_event()
+
+    async def async_read_loop(self):
+        loop = asyncio.get_running_loop()
+        while not self.closed:
+            yield await loop.run_in_executor(None, self._next_event)
+
+    def close(self):
+        self.closed = True
@@ -0,0 +1,20 @@
+"""Event codes used by the macro pad daemons (values match linux/input-event-codes.h)"""
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_MSC = 0x04
+
+KEY_BRIGHTNESSDOWN = 224
+KEY_BRIGHTNESSUP = 225
+KEY_F21 = 191
+KEY_F22 = 192
+KEY_F23 = 193
+KEY_F24 = 194
+
+KEY = {
+    KEY_BRIGHTNESSDOWN: "KEY_BRIGHTNESSDOWN",
+    KEY_BRIGHTNESSUP: "KEY_BRIGHTNESSUP",
+    KEY_F21: "KEY_F21",
+    KEY_F22: "KEY_F22",
+    KEY_F23: "KEY_F23",
+    KEY_F24: "KEY_F24",
+}
@@ -0,0 +1,260 @@
+"""
+Stand-in for paho.mqtt.client used by the benchmark harness
+Clients talk to an in-process Broker instead of a network socket. The broker
+routes publishes to matching subscriptions, keeps retained messages, runs
+broker-side hooks (e.g. a fake light), publishes the will of a killed client
+and can be taken offline to exercise reconnects. Callbacks run from loop() or the loop_start() thread, as with
+paho 1.x.
+"""
+import queue
+import threading
+import time
+
+MQTT_ERR_SUCCESS = 0
+MQTT_ERR_NO_CONN = 4
+MQTT_ERR_CONN_LOST = 7
+
+
+def topic_matches_sub(sub, topic):
+    sub_parts = sub.split("/")
+    topic_parts = topic.split("/")
+    for i, part in enumerate(sub_parts):
+        if part == "#":
+            return True
+        if i >= len(topic_parts) or (part != "+" and part != topic_parts[i]):
+            return False
+    return len(sub_parts) == len(topic_parts)
+
+
+class MQTTMessage:
+    def __init__(self, topic, payload, qos=0, retain=False, mid=0):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.mid = mid
+        self.timestamp = time.monotonic()
+
+
+class MQTTMessageInfo:
+    def __init__(self, mid, rc=MQTT_ERR_SUCCESS):
+        self.mid = mid
+        self.rc = rc
+        self._published = threading.Event()
+        if rc == MQTT_ERR_SUCCESS:
+            self._published.set()
+
+    def wait_for_publish(self, timeout=None):
+        self._published.wait(timeout)
+
+    def is_published(self):
+        return self._published.is_set()
+
+
+class Broker:
+    """In-process broker shared by every stand-in client"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.online = True
+        self.clients = set()
+        self.retained = {}
+        self.messages = []  # Every MQTTMessage routed, in order
+        self.latency = 0.0  # Seconds added before each delivery/ack
+        self.ack_latency = 0.0  # Seconds before a QoS 1 publish is acknowledged, without blocking
+        self.hooks = []  # Broker-side handlers called with every routed message
+
+    def set_online(self, online):
+        """Taking the broker offline drops every connection"""
+        with self.lock:
+            self.online = online
+            dropped = list(self.clients) if not online else []
+            if not online:
+                self.clients.clear()
+        for client in dropped:
+            client._events.put(("lost",))
+
+    def attach(self, client):
+        with self.lock:
+            if not self.online:
+                raise ConnectionRefusedError(111, "Connection refused")
+            self.clients.add(client)
+
+    def kill(self, client):
+        """Drop one client as if its process died: its will is published"""
+        with self.lock:
+            if client not in self.clients:
+                return
+            self.clients.discard(client)
+        client._events.put(("lost",))
+        if client.will:
+            topic, payload, qos, retain = client.will
+            self.route(MQTTMessage(topic, payload, qos, retain))
+
+    def detach(self, client):
+        with self.lock:
+            self.clients.discard(client)
+
+    def route(self, message):
+        with self.lock:
+            self.messages.append(message)
+            if message.retain:
+                self.retained[message.topic] = message
+            clients = list(self.clients)
+        for client in clients:
+            client._deliver(message)
+        for hook in list(self.hooks):
+            hook(message)
+
+    def reset(self):
+        with self.lock:
+            self.online = True
+            self.clients.clear()
+            self.retained.clear()
+            self.messages.clear()
+            self.hooks.clear()
+            self.latency = 0.0
+            self.ack_latency = 0.0
+
+
+broker = Broker()
+
+
+class Client:
+    def __init__(self, client_id="", clean_session=None, userdata=None, *args, **kwargs):
+        self.client_id = client_id
+        self.userdata = userdata
+        self.broker = broker
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.on_publish = None
+        self.on_subscribe = None
+        self.published = []  # (topic, payload, monotonic time)
+        self.subscriptions = {}
+        self.will = None
+        self.lock = threading.Lock()
+        self.mid = 0
+        self.connected = False
+        self._events = queue.Queue()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def will_set(self, topic, payload=None, qos=0, retain=False):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.will = (topic, payload or b"", qos, retain)
+
+    def _next_mid(self):
+        with self.lock:
+            self.mid += 1
+            return self.mid
+
+    def connect(self, host, port=1883, keepalive=60):
+        self.broker.attach(self)
+        self._events = queue.Queue()  # Nothing from a previous session survives
+        self.connected = True
+        self._events.put(("connack",))
+        return MQTT_ERR_SUCCESS
+
+    def reconnect(self):
+        return self.connect(None)
+
+    def disconnect(self):
+        if self.connected:
+            self.broker.detach(self)
+            self.connected = False
+            self._events.put(("disconnected",))
+        return MQTT_ERR_SUCCESS
+
+    def _deliver(self, message):
+        for sub in list(self.subscriptions):
+            if topic_matches_sub(sub, message.topic):
+                self._events.put(("message", message))
+                return
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        mid = self._next_mid()
+        if not self.connected:
+            return MQTTMessageInfo(mid, MQTT_ERR_NO_CONN)
+        if isinstance(payload, str):
+            payload = payload.encode()
+        elif isinstance(payload, (int, float)):
+            payload = str(payload).encode()
+        with self.lock:
+            self.published.append((topic, payload, time.monotonic()))
+        message = MQTTMessage(topic, payload or b"", qos, retain, mid)
+        if self.broker.latency:
+            time.sleep(self.broker.latency)
+        self.broker.route(message)
+        if qos == 0:
+            # paho reports a QoS 0 message published as soon as it is written, from publish() itself
+            if self.on_publish:
+                self.on_publish(self, self.userdata, mid)
+        elif self.broker.ack_latency:
+            events = self._events
+            threading.Timer(self.broker.ack_latency, events.put, (("puback", mid),)).start()
+        else:
+            self._events.put(("puback", mid))
+        return MQTTMessageInfo(mid)
+
+    def subscribe(self, topic, qos=0):
+        mid = self._next_mid()
+        if not self.connected:
+            return (MQTT_ERR_NO_CONN, mid)
+        self.subscriptions[topic] = qos
+        self._events.put(("suback", mid, qos))
+        with self.broker.lock:
+            retained = [m for t, m in self.broker.retained.items() if topic_matches_sub(topic, t)]
+        for message in retained:
+            self._events.put(("message", message))
+        return (MQTT_ERR_SUCCESS, mid)
+
+    def loop(self, timeout=1.0):
+        """Run one pending callback, waiting up to timeout for it"""
+        try:
+            event = self._events.get(timeout=timeout)
+        except queue.Empty:
+            return MQTT_ERR_SUCCESS if self.connected else MQTT_ERR_NO_CONN
+
+        kind = event[0]
+        if kind == "connack":
+            if self.on_connect:
+                self.on_connect(self, self.userdata, {}, 0)
+        elif kind == "lost":
+            self.connected = False
+            if self.on_disconnect:
+                self.on_disconnect(self, self.userdata, MQTT_ERR_CONN_LOST)
+            return MQTT_ERR_CONN_LOST
+        elif kind == "disconnected":
+            if self.on_disconnect:
+                self.on_disconnect(self, self.userdata, MQTT_ERR_SUCCESS)
+            return MQTT_ERR_NO_CONN
+        elif kind == "message":
+            if self.on_message:
+                self.on_message(self, self.userdata, event[1])
+        elif kind == "puback":
+            if self.on_publish:
+                self.on_publish(self, self.userdata, event[1])
+        elif kind == "suback":
+            if self.on_subscribe:
+                self.on_subscribe(self, self.userdata, event[1], (event[2],))
+        return MQTT_ERR_SUCCESS
+
+    def loop_start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop_forever, name="paho-stub", daemon=True)
+        self._thread.start()
+
+    def _loop_forever(self):
+        while not self._stop.is_set():
+            self.loop(timeout=0.05)
+
+    def loop_stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,229 @@
+"""
+Control Socket
+JSON-lines control API for scripts on the attached computers. One thread
+multiplexes every client with selectors, so many pollers cost no extra
+threads. Each request is a JSON object on one line and gets one reply line:
+
+    {"cmd": "status"}
+    {"cmd": "action", "action": "displayport"}
+    {"cmd": "vcp", "display": "main", "code": "0x10", "value": 80}
+
+Handlers run on the socket thread and must not block: actions go to the
+switcher's dispatcher and status is answered from memory.
+"""
+import json
+import logging
+import os
+import selectors
+import socket
+import stat
+import threading
+import time
+
+from latency import LatencyHistogram
+
+log = logging.getLogger('macropad.control')
+
+CONTROL_SOCKET = '/run/macropad/control.sock'
+SOCKET_MODE = 0o660  # Owner and group (e.g. a 'macropad' group for local scripts)
+MAX_LINE = 64 * 1024  # Longer requests close the connection
+RECV_SIZE = 65536
+
+
+class ControlError(Exception):
+    """Sent back to the client as {"ok": false, "error": ...}"""
+
+
+class _Client:
+    __slots__ = ('sock', 'kind', 'inbuf', 'outbuf')
+
+    def __init__(self, sock, kind):
+        self.sock = sock
+        self.kind = kind
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+
+
+class ControlServer:
+    """
+    Serves commands, a dict of name -> handler(request) returning a dict
+    tcp_commands limits which commands TCP clients may use (None allows all);
+    the Unix socket is protected by its file permissions instead.
+    """
+
+    def __init__(self, commands, unix_path=CONTROL_SOCKET, tcp_address=None, tcp_commands=None):
+        self.commands = commands
+        self.unix_path = unix_path
+        self.tcp_address = tcp_address
+        self.tcp_commands = tcp_commands
+        self.selector = selectors.DefaultSelector()
+        self.listeners = []
+        self.clients = set()
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.running = False
+        self.thread = threading.Thread(target=self._run, name='control-socket', daemon=True)
+        self.handle_ms = LatencyHistogram()
+        self.stats = {'connections': 0, 'requests': 0, 'errors': 0}
+
+    def start(self):
+        if self.unix_path:
+            self._remove_stale_socket()
+            os.makedirs(os.path.dirname(self.unix_path), exist_ok=True)
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(self.unix_path)
+            os.chmod(self.unix_path, SOCKET_MODE)
+            self._listen(listener, 'unix')
+            log.info(f"Control socket listening on {self.unix_path}")
+        if self.tcp_address:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind(self.tcp_address)
+            self._listen(listener, 'tcp')
+            log.info(f"Control socket listening on TCP {self.tcp_address[0]}:{self.tcp_address[1]}")
+        self.wake_r.setblocking(False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ, None)
+        self.running = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        try:
+            self.wake_w.send(b'x')
+        except OSError:
+            pass
+        if self.thread.is_alive():
+            self.thread.join(timeout=5)
+        for client in list(self.clients):
+            self._close(client)
+        for listener in self.listeners:
+            listener.close()
+        self.listeners = []
+        if self.unix_path:
+            self._remove_stale_socket()
+        self.selector.close()
+        self.wake_r.close()
+        self.wake_w.close()
+
+    def snapshot(self):
+        return dict(self.stats, clients=len(self.clients), handle_ms=self.handle_ms.summary())
+
+    def handle_request(self, line, kind='unix'):
+        """Reply to one request line; also usable without a socket"""
+        self.stats['requests'] += 1
+        start = time.perf_counter()
+        request_id = None
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                raise ControlError(f"Invalid JSON: {e}")
+            if not isinstance(request, dict):
+                raise ControlError("Request must be a JSON object")
+            request_id = request.get('id')
+            name = request.get('cmd')
+            handler = self.commands.get(name)
+            if handler is None:
+                raise ControlError(f"Unknown command: {name}")
+            if kind == 'tcp' and self.tcp_commands is not None and name not in self.tcp_commands:
+                raise ControlError(f"Command {name} is not allowed over TCP")
+            reply = dict(handler(request), ok=True)
+        except ControlError as e:
+            self.stats['errors'] += 1
+            reply = {'ok': False, 'error': str(e)}
+        except Exception as e:
+            self.stats['errors'] += 1
+            log.error(f"Control command failed: {e}")
+            reply = {'ok': False, 'error': f"Internal error: {e}"}
+        if request_id is not None:
+            reply['id'] = request_id
+        self.handle_ms.record((time.perf_counter() - start) * 1000)
+        return json.dumps(reply, default=str).encode() + b'\n'
+
+    def _remove_stale_socket(self):
+        try:
+            if stat.S_ISSOCK(os.lstat(self.unix_path).st_mode):
+                os.unlink(self.unix_path)
+        except FileNotFoundError:
+            pass
+
+    def _listen(self, listener, kind):
+        listener.listen(64)
+        listener.setblocking(False)
+        self.selector.register(listener, selectors.EVENT_READ, kind)
+        self.listeners.append(listener)
+
+    def _run(self):
+        while self.running:
+            for key, events in self.selector.select():
+                if key.fileobj is self.wake_r:
+                    continue
+                if isinstance(key.data, str):
+                    self._accept(key.fileobj, key.data)
+                    continue
+                client = key.data
+                if events & selectors.EVENT_READ:
+                    self._read(client)
+                if events & selectors.EVENT_WRITE and client in self.clients:
+                    self._flush(client)
+
+    def _accept(self, listener, kind):
+        try:
+            sock, _ = listener.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        sock.setblocking(False)
+        client = _Client(sock, kind)
+        self.clients.add(client)
+        self.selector.register(sock, selectors.EVENT_READ, client)
+        self.stats['connections'] += 1
+
+    def _read(self, client):
+        try:
+            data = client.sock.recv(RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close(client)
+            return
+        client.inbuf += data
+        while True:
+            end = client.inbuf.find(b'\n')
+            if end < 0:
+                break
+            line = bytes(client.inbuf[:end]).strip()
+            del client.inbuf[:end + 1]
+            if line:
+                client.outbuf += self.handle_request(line, client.kind)
+        if len(client.inbuf) > MAX_LINE:
+            client.outbuf += json.dumps({'ok': False, 'error': 'Request too long'}).encode() + b'\n'
+            self._flush(client)
+            self._close(client)
+            return
+        if client.outbuf:
+            self._flush(client)
+
+    def _flush(self, client):
+        try:
+            sent = client.sock.send(client.outbuf)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self._close(client)
+            return
+        del client.outbuf[:sent]
+        # Only wait for writability while a reply is stuck behind a slow reader
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.outbuf else 0)
+        self.selector.modify(client.sock, events, client)
+
+    def _close(self, client):
+        if client not in self.clients:
+            return
+        self.clients.discard(client)
+        try:
+            self.selector.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+        client.sock.close()
@@ -0,0 +1,664 @@
+"""
+Native DDC/CI over /dev/i2c-N
+Speaks the VCP Set/Get protocol directly on an open bus file descriptor instead
+of forking ddcutil for every command. ddcutil is kept as a fallback backend,
+and FakeI2CDevice stands in for a monitor so the protocol can be exercised
+without one attached. set_vcp_polled confirms a write by reading it back on
+a schedule learned from the monitor's own settle times.
+"""
+import errno
+import fcntl
+import logging
+import os
+import random
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from latency import LatencyHistogram
+
+log = logging.getLogger('macropad.ddc')
+
+I2C_SLAVE = 0x0703          # ioctl: set the slave address for the open bus
+DDC_CI_ADDRESS = 0x37       # 7-bit DDC/CI address (0x6E/0x6F on the wire)
+DISPLAY_WRITE_ADDRESS = 0x6E
+HOST_ADDRESS = 0x51
+REPLY_CHECKSUM_SEED = 0x50  # Replies are checksummed against the virtual host address
+
+SET_VCP_OPCODE = 0x03
+GET_VCP_OPCODE = 0x01
+GET_VCP_REPLY_OPCODE = 0x02
+GET_VCP_REPLY_LENGTH = 11
+
+# Minimum spacing required by the DDC/CI spec
+WRITE_DELAY = 0.05  # After a Set VCP before the bus may be used again
+READ_DELAY = 0.04   # Between a Get VCP request and reading its reply
+
+VCP_INPUT_SOURCE = 0x60
+VCP_POWER_MODE = 0xD6
+POWER_ON = 0x01
+POWER_STANDBY = 0x02
+
+COMMAND_RETRIES = 3
+
+DDCUTIL_TIMEOUT = 10.0   # Seconds before a ddcutil process group is killed
+KILL_GRACE = 0.2         # Seconds between SIGTERM and SIGKILL for that group
+COMMAND_POLL = 0.05      # Seconds between cancellation checks while ddcutil runs
+BREAKER_THRESHOLD = 3    # Consecutive failures that open a bus's circuit breaker
+BREAKER_COOLDOWN = 30.0  # Seconds an open breaker fails fast before one trial command
+BREAKER_WINDOW = 20      # Recent commands the reported failure rate covers
+
+# Polled verification: read a written value back until the monitor shows it
+VERIFY_FIRST_POLL = 0.05     # Seconds from a write to the first read-back until settle times are learned
+VERIFY_MIN_INTERVAL = 0.02   # First gap between later read-backs; doubles each time
+VERIFY_MAX_INTERVAL = 0.5
+VERIFY_REWRITE_AFTER = 1.0   # Seconds a write may stay unconfirmed before it is repeated...
+REWRITE_FACTOR = 3           # ...or this many learned settle times, if that is longer
+VERIFY_DEADLINE = 5.0        # Seconds from the first write until verification gives up
+SETTLE_HISTORY = 20          # Verified writes per VCP code the learned settle time covers
+SETTLE_PROBE = 0.9           # Learned settle time after a write confirmed by its first read
+
+
+class DDCError(Exception):
+    """Raised when a DDC/CI command could not be completed"""
+
+
+class DDCTimeout(DDCError):
+    """The monitor did not answer before the command's deadline"""
+
+
+class DDCCancelled(DDCError):
+    """The command was abandoned because its action was superseded"""
+
+
+class BreakerOpen(DDCError):
+    """The bus's circuit breaker is open, so the command was not attempted"""
+
+
+def checksum(data, seed):
+    """XOR checksum used by DDC/CI packets"""
+    value = seed
+    for byte in data:
+        value ^= byte
+    return value
+
+
+def build_set_vcp(code, value):
+    """Build a Set VCP Feature packet (without the destination address byte)"""
+    packet = bytes([HOST_ADDRESS, 0x84, SET_VCP_OPCODE, code, (value >> 8) & 0xFF, value & 0xFF])
+    return packet + bytes([checksum(packet, DISPLAY_WRITE_ADDRESS)])
+
+
+def build_get_vcp(code):
+    """Build a Get VCP Feature request packet"""
+    packet = bytes([HOST_ADDRESS, 0x82, GET_VCP_OPCODE, code])
+    return packet + bytes([checksum(packet, DISPLAY_WRITE_ADDRESS)])
+
+
+def parse_get_vcp_reply(data, code):
+    """Parse a Get VCP Feature reply, returning (current, maximum)"""
+    if len(data) < 3 or data[0] != DISPLAY_WRITE_ADDRESS or not data[1] & 0x80:
+        raise DDCError(f"Malformed VCP reply: {data.hex()}")
+
+    length = data[1] & 0x7F
+    if length == 0:
+        # Null message: the monitor is busy and wants the request repeated
+        raise DDCError("Monitor returned null message (busy)")
+    if length != 8 or len(data) < GET_VCP_REPLY_LENGTH:
+        raise DDCError(f"Unexpected VCP reply length {length}")
+    if checksum(data[:10], REPLY_CHECKSUM_SEED) != data[10]:
+        raise DDCError("VCP reply checksum mismatch")
+    if data[2] != GET_VCP_REPLY_OPCODE or data[4] != code:
+        raise DDCError(f"VCP reply for wrong request: {data.hex()}")
+    if data[3] != 0:
+        raise DDCError(f"VCP 0x{code:02X} unsupported by monitor")
+
+    maximum = (data[6] << 8) | data[7]
+    current = (data[8] << 8) | data[9]
+    return current, maximum
+
+
+def kill_group(proc):
+    """SIGTERM the process group, then SIGKILL whatever is left after KILL_GRACE"""
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            break
+        try:
+            proc.wait(timeout=KILL_GRACE)
+            break
+        except subprocess.TimeoutExpired:
+            continue
+    try:
+        proc.communicate(timeout=KILL_GRACE)  # Reap it and close the pipes
+    except subprocess.TimeoutExpired:
+        pass
+
+
+def run_command(cmd, timeout=DDCUTIL_TIMEOUT, cancel=None):
+    """
+    Run cmd in its own process group and return (returncode, stdout)
+    On timeout, or as soon as cancel (a threading.Event) is set, the whole
+    group is killed, so no child of ddcutil outlives its command.
+    """
+    if cancel is not None and cancel.is_set():
+        raise DDCCancelled(f"{' '.join(cmd[:2])} cancelled")
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            text=True, start_new_session=True)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            stdout, _ = proc.communicate(timeout=COMMAND_POLL)
+            return proc.returncode, stdout
+        except subprocess.TimeoutExpired:
+            pass
+        if cancel is not None and cancel.is_set():
+            kill_group(proc)
+            raise DDCCancelled(f"{' '.join(cmd[:2])} cancelled")
+        if time.monotonic() >= deadline:
+            kill_group(proc)
+            raise DDCTimeout(f"{' '.join(cmd[:2])} timed out after {timeout:.1f}s")
+
+
+class CircuitBreaker:
+    """
+    Fails fast for a bus whose monitor keeps not answering
+    After threshold consecutive failures the breaker opens: commands raise
+    BreakerOpen at once for cooldown seconds. Then one trial command is let
+    through; success closes the breaker, failure opens it again. Cancelled
+    commands count as neither. A probe command (waking the monitor) is never
+    failed fast: it is let through as the trial at once. A neutral command
+    (a background read) records nothing, so it can neither open nor close
+    the breaker.
+    """
+
+    def __init__(self, name, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN, window=BREAKER_WINDOW):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.state = 'closed'  # closed -> open -> half_open -> closed or open
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.results = deque(maxlen=window)  # True for success
+        self.time_to_failure = LatencyHistogram()  # ms a failing command took to fail
+        self.stats = {'successes': 0, 'failures': 0, 'fast_failures': 0, 'opened': 0}
+
+    @contextmanager
+    def guard(self, probe=False, neutral=False):
+        """Wrap one command: fail fast while open, record its outcome otherwise"""
+        if neutral:
+            self._admit_neutral()
+            yield
+            return
+        self._admit(probe)
+        start = time.monotonic()
+        try:
+            yield
+        except DDCCancelled:
+            self._release_trial()
+            raise
+        except DDCError:
+            self._record_failure((time.monotonic() - start) * 1000)
+            raise
+        except BaseException:
+            self._release_trial()
+            raise
+        self._record_success()
+
+    def _admit(self, probe=False):
+        with self.lock:
+            if self.state == 'open':
+                remaining = self.opened_at + self.cooldown - time.monotonic()
+                if remaining > 0 and not probe:
+                    self.stats['fast_failures'] += 1
+                    raise BreakerOpen(f"{self.name} not answering, failing fast for another {remaining:.0f}s")
+                self.state = 'half_open'
+                log.info(f"{self.name} breaker half-open, trying one command")
+            if self.state == 'half_open':
+                if self.trial_running and not probe:
+                    self.stats['fast_failures'] += 1
+                    raise BreakerOpen(f"{self.name} breaker trial in progress")
+                self.trial_running = True
+
+    def _admit_neutral(self):
+        with self.lock:
+            if self.state == 'open':
+                remaining = self.opened_at + self.cooldown - time.monotonic()
+                if remaining > 0:
+                    self.stats['fast_failures'] += 1
+                    raise BreakerOpen(f"{self.name} not answering, failing fast for another {remaining:.0f}s")
+
+    def _release_trial(self):
+        with self.lock:
+            self.trial_running = False
+
+    def _record_success(self):
+        with self.lock:
+            if self.state != 'closed':
+                log.info(f"{self.name} answering again, breaker closed")
+            self.state = 'closed'
+            self.trial_running = False
+            self.consecutive_failures = 0
+            self.results.append(True)
+            self.stats['successes'] += 1
+
+    def _record_failure(self, ms):
+        with self.lock:
+            self.trial_running = False
+            self.consecutive_failures += 1
+            self.results.append(False)
+            self.stats['failures'] += 1
+            self.time_to_failure.record(ms)
+            if self.state == 'half_open' or (
+                self.state == 'closed' and self.consecutive_failures >= self.threshold
+            ):
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.stats['opened'] += 1
+                log.warning(
+                    f"{self.name} breaker open after {self.consecutive_failures} failures in a row "
+                    f"(last took {ms:.0f} ms); failing fast for {self.cooldown:.0f}s"
+                )
+
+    def snapshot(self):
+        with self.lock:
+            failures = self.results.count(False)
+            return dict(
+                self.stats,
+                state=self.state,
+                consecutive_failures=self.consecutive_failures,
+                failure_rate=round(failures / len(self.results), 3) if self.results else 0.0,
+                open_remaining_s=(
+                    round(max(0.0, self.opened_at + self.cooldown - time.monotonic()), 1)
+                    if self.state == 'open' else 0.0
+                ),
+                time_to_failure_ms=self.time_to_failure.summary(),
+            )
+
+
+class I2CDevice:
+    """Open /dev/i2c-N file descriptor addressed to the DDC/CI slave"""
+
+    def __init__(self, bus_number):
+        self.path = f'/dev/i2c-{bus_number}'
+        self.fd = os.open(self.path, os.O_RDWR)
+        try:
+            fcntl.ioctl(self.fd, I2C_SLAVE, DDC_CI_ADDRESS)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def write(self, data):
+        return os.write(self.fd, data)
+
+    def read(self, length):
+        return os.read(self.fd, length)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class I2CBackend:
+    """DDC/CI backend that keeps the bus open and speaks VCP directly"""
+
+    name = 'native'
+
+    def __init__(self, bus_number, device=None):
+        self.bus_number = bus_number
+        self.device = device if device is not None else I2CDevice(bus_number)
+        self.lock = threading.Lock()
+        self.ready_at = 0.0
+        self.breaker = CircuitBreaker(f'i2c-{bus_number}')
+
+    def _wait_ready(self):
+        delay = self.ready_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _write(self, packet, settle):
+        self._wait_ready()
+        try:
+            self.device.write(packet)
+        finally:
+            self.ready_at = time.monotonic() + settle
+
+    def set_vcp(self, code, value, verify=False, cancel=None, probe=False, neutral=False):
+        """Set a VCP feature, optionally reading it back to confirm (see CircuitBreaker for probe and neutral)"""
+        packet = build_set_vcp(code, value)
+        with self.breaker.guard(probe, neutral), self.lock:
+            last_error = None
+            for _ in range(COMMAND_RETRIES):
+                if cancel is not None and cancel.is_set():
+                    raise DDCCancelled(f"Set VCP 0x{code:02X} on i2c-{self.bus_number} cancelled")
+                try:
+                    self._write(packet, WRITE_DELAY)
+                    break
+                except OSError as e:
+                    last_error = e
+            else:
+                raise DDCError(f"Set VCP 0x{code:02X} failed on i2c-{self.bus_number}: {last_error}")
+
+        if verify:
+            current, _ = self.get_vcp(code, cancel, neutral)
+            if current & 0xFF != value & 0xFF:
+                raise DDCError(f"Verification of VCP 0x{code:02X} failed (read {current}, expected {value})")
+
+    def get_vcp(self, code, cancel=None, neutral=False):
+        """Read a VCP feature, returning (current, maximum)"""
+        packet = build_get_vcp(code)
+        with self.breaker.guard(neutral=neutral), self.lock:
+            last_error = None
+            for _ in range(COMMAND_RETRIES):
+                if cancel is not None and cancel.is_set():
+                    raise DDCCancelled(f"Get VCP 0x{code:02X} on i2c-{self.bus_number} cancelled")
+                try:
+                    self._write(packet, READ_DELAY)
+                    self._wait_ready()
+                    reply = self.device.read(GET_VCP_REPLY_LENGTH)
+                    self.ready_at = time.monotonic() + WRITE_DELAY
+                    return parse_get_vcp_reply(reply, code)
+                except (OSError, DDCError) as e:
+                    last_error = e
+            raise DDCError(f"Get VCP 0x{code:02X} failed on i2c-{self.bus_number}: {last_error}")
+
+    def close(self):
+        with self.lock:
+            self.device.close()
+
+
+class DdcutilBackend:
+    """
+    Fallback backend that forks ddcutil, in its own process group, for each command
+    Runs on one bus are serialized like the native backend's commands, so a
+    background read can't interleave with a switch on the wire.
+    """
+
+    name = 'ddcutil'
+
+    def __init__(self, bus_number, timeout=DDCUTIL_TIMEOUT):
+        self.bus_number = bus_number
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.breaker = CircuitBreaker(f'i2c-{bus_number}')
+
+    @contextmanager
+    def _bus(self, cancel):
+        """Hold the bus for one run; a cancelled command stops waiting for a slow one ahead of it"""
+        while not self.lock.acquire(timeout=COMMAND_POLL):
+            if cancel is not None and cancel.is_set():
+                raise DDCCancelled(f"ddcutil on bus {self.bus_number} cancelled while waiting for the bus")
+        try:
+            yield
+        finally:
+            self.lock.release()
+
+    def _run(self, args, cancel=None, probe=False, neutral=False):
+        cmd = ['ddcutil'] + args + [f'--bus={self.bus_number}']
+        with self.breaker.guard(probe, neutral), self._bus(cancel):
+            try:
+                returncode, stdout = run_command(cmd, self.timeout, cancel)
+            except OSError as e:
+                raise DDCError(f"Could not run ddcutil: {e}")
+            if returncode != 0:
+                raise DDCError(f"ddcutil {args[0]} failed with code {returncode}")
+        return stdout
+
+    def set_vcp(self, code, value, verify=False, cancel=None, probe=False, neutral=False):
+        args = ['setvcp', f'{code:02X}', str(value)]
+        if not verify:
+            args.append('--noverify')
+        self._run(args, cancel, probe, neutral)
+
+    def get_vcp(self, code, cancel=None, neutral=False):
+        # --brief output: "VCP 60 SNC x0f" (non-continuous) or "VCP 10 C 50 100"
+        fields = self._run(['getvcp', f'{code:02X}', '--brief'], cancel, neutral=neutral).split()
+        try:
+            if fields[0] != 'VCP':
+                raise ValueError(fields[0])
+            if fields[2] == 'C':
+                return int(fields[3]), int(fields[4])
+            if fields[2] == 'SNC':
+                return int(fields[3].lstrip('x'), 16), 0
+            raise ValueError(fields[2])
+        except (IndexError, ValueError):
+            raise DDCError(f"Unexpected ddcutil getvcp output: {' '.join(fields)}")
+
+    def close(self):
+        pass
+
+
+class SettleTimes:
+    """
+    How long one monitor takes to show a written VCP value, learned per code
+    Each verified write adds an estimate (see set_vcp_polled); the median of
+    the recent ones is when the next verification reads back first.
+    """
+
+    def __init__(self, history=SETTLE_HISTORY):
+        self.lock = threading.Lock()
+        self.history = history
+        self.samples = {}   # VCP code -> deque of settle times in seconds
+        self.verified = {}  # VCP code -> LatencyHistogram of ms from first write to confirmation
+        self.stats = {'verified': 0, 'unverified': 0, 'reads': 0, 'rewrites': 0}
+
+    def typical(self, code):
+        """Median learned settle time in seconds, or None before the first verified write"""
+        with self.lock:
+            samples = sorted(self.samples.get(code, ()))
+        return samples[len(samples) // 2] if samples else None
+
+    def record(self, code, settle, ms, reads, writes):
+        with self.lock:
+            self.samples.setdefault(code, deque(maxlen=self.history)).append(settle)
+            self.verified.setdefault(code, LatencyHistogram()).record(ms)
+            self.stats['verified'] += 1
+            self.stats['reads'] += reads
+            self.stats['rewrites'] += writes - 1
+
+    def record_failure(self, reads, writes):
+        with self.lock:
+            self.stats['unverified'] += 1
+            self.stats['reads'] += reads
+            self.stats['rewrites'] += writes - 1
+
+    def snapshot(self):
+        with self.lock:
+            codes = sorted(self.verified)
+            result = dict(self.stats)
+        for code in codes:
+            typical = self.typical(code)
+            result[f'0x{code:02X}'] = {
+                'typical_settle_ms': None if typical is None else round(typical * 1000, 1),
+                'verified_ms': self.verified[code].summary(),
+            }
+        return result
+
+
+def set_vcp_polled(ddc, code, value, settle, cancel=None, deadline=VERIFY_DEADLINE, probe=False):
+    """
+    Set a VCP feature, then read it back until the monitor shows value
+    The first read-back comes at the monitor's learned settle time, later ones
+    at exponentially growing intervals. A write still unconfirmed after
+    VERIFY_REWRITE_AFTER, or REWRITE_FACTOR settle times for a slower
+    monitor, is sent again.
+    Returns (ms from the first write to the matching read, reads, writes);
+    raises DDCError once deadline seconds pass without a match. The whole
+    verification is one command to the breaker, a trial if probe is set (as
+    for a wake); reads the monitor ignores while it settles don't count.
+    """
+    with ddc.breaker.guard(probe):
+        return _set_vcp_polled(ddc, code, value, settle, cancel, deadline)
+
+
+def _set_vcp_polled(ddc, code, value, settle, cancel, deadline):
+    start = time.monotonic()
+    give_up = start + deadline
+    typical = settle.typical(code)
+    first_poll = VERIFY_FIRST_POLL if typical is None else max(VERIFY_MIN_INTERVAL, typical)
+    rewrite_after = max(VERIFY_REWRITE_AFTER, REWRITE_FACTOR * first_poll)
+    reads = writes = 0
+    last_seen = None
+    try:
+        while True:
+            ddc.set_vcp(code, value, cancel=cancel, neutral=True)
+            writes += 1
+            written = time.monotonic()
+            poll_at, interval, missed = first_poll, VERIFY_MIN_INTERVAL, 0.0
+            while True:
+                delay = min(written + poll_at, give_up) - time.monotonic()
+                if delay > 0:
+                    if cancel is None:
+                        time.sleep(delay)
+                    elif cancel.wait(delay):
+                        raise DDCCancelled(f"Verification of VCP 0x{code:02X} cancelled")
+                read_at = time.monotonic() - written
+                reads += 1
+                try:
+                    current, _ = ddc.get_vcp(code, cancel, neutral=True)
+                except DDCCancelled:
+                    raise
+                except DDCError as e:
+                    current, last_seen = None, f'unreadable ({e})'  # Monitors may not answer while they switch
+                if current is not None and current & 0xFF == value & 0xFF:
+                    ms = (time.monotonic() - start) * 1000
+                    # A first read that already matches only bounds the settle time from above,
+                    # so the estimate creeps down until reads start to miss
+                    settled = (missed + read_at) / 2 if missed else read_at * SETTLE_PROBE
+                    settle.record(code, settled, ms, reads, writes)
+                    return ms, reads, writes
+                if current is not None:
+                    last_seen = current
+                missed = read_at
+                if time.monotonic() >= give_up:
+                    raise DDCError(
+                        f"VCP 0x{code:02X} still {last_seen} {deadline:.1f}s after writing {value} "
+                        f"({writes} writes, {reads} reads)"
+                    )
+                if time.monotonic() - written >= rewrite_after:
+                    log.debug(f"VCP 0x{code:02X} not {value} after {rewrite_after:.2f}s (read {last_seen}), writing again")
+                    break
+                poll_at = max(poll_at + interval, time.monotonic() - written)
+                interval = min(interval * 2, VERIFY_MAX_INTERVAL)
+    except DDCError:
+        settle.record_failure(reads, writes)
+        raise
+
+
+def open_backend(bus_number, prefer='auto'):
+    """Open a DDC backend: 'native', 'ddcutil' or 'auto' (native with ddcutil fallback)"""
+    if prefer == 'ddcutil':
+        return DdcutilBackend(bus_number)
+
+    try:
+        backend = I2CBackend(bus_number)
+        log.info(f"Using native DDC/CI backend on /dev/i2c-{bus_number}")
+        return backend
+    except OSError as e:
+        if prefer == 'native':
+            raise DDCError(f"Cannot open /dev/i2c-{bus_number}: {e}")
+        log.warning(f"Native DDC/CI unavailable ({e}), falling back to ddcutil")
+        return DdcutilBackend(bus_number)
+
+
+class FakeI2CDevice:
+    """
+    In-memory monitor on the DDC/CI slave address
+    Drop-in replacement for I2CDevice: decodes Set/Get VCP packets, checks
+    their checksums and records writes that violate the inter-command delays.
+    settle maps VCP codes to the seconds (or a (min, max) range) a written
+    value takes to show up in reads; drop_rate is the chance a Set VCP is lost.
+    silent maps VCP codes to the seconds the monitor ignores reads after a
+    write that changes that code, as some do while waking from standby.
+    """
+
+    def __init__(self, vcp=None, maxima=None, busy_replies=0, settle=None, drop_rate=0.0, silent=None):
+        self.vcp = {VCP_INPUT_SOURCE: 0x0F, VCP_POWER_MODE: POWER_ON}
+        self.vcp.update(vcp or {})
+        self.maxima = maxima or {}
+        self.busy_replies = busy_replies
+        self.settle = settle or {}
+        self.drop_rate = drop_rate
+        self.silent = silent or {}
+        self.silent_until = 0.0
+        self.settling = {}  # VCP code -> (value, monotonic time it shows up)
+        self.writes = []
+        self.timing_violations = 0
+        self.pending_reply = None
+        self.last_write = None
+        self.last_spacing = 0.0
+        self.closed = False
+
+    def write(self, data):
+        now = time.monotonic()
+        if self.last_write is not None and now - self.last_write < self.last_spacing:
+            self.timing_violations += 1
+        self.last_write = now
+        data = bytes(data)
+        self.writes.append(data)
+
+        if data[0] != HOST_ADDRESS or checksum(data[:-1], DISPLAY_WRITE_ADDRESS) != data[-1]:
+            # Real monitors silently drop corrupt packets
+            self.pending_reply = None
+            self.last_spacing = 0.0
+            return len(data)
+
+        opcode, code = data[2], data[3]
+        if opcode == SET_VCP_OPCODE:
+            value = (data[4] << 8) | data[5]
+            settle = self.settle.get(code, 0.0)
+            if isinstance(settle, tuple):
+                settle = random.uniform(*settle)
+            if random.random() < self.drop_rate:
+                self.last_spacing = WRITE_DELAY
+                return len(data)  # Lost on the bus: the monitor never saw it
+            if code in self.silent and self.vcp.get(code) != value and code not in self.settling:
+                self.silent_until = now + self.silent[code]
+            if settle > 0:
+                self.settling[code] = (value, now + settle)
+            else:
+                self.settling.pop(code, None)
+                self.vcp[code] = value
+            self.last_spacing = WRITE_DELAY
+        elif opcode == GET_VCP_OPCODE:
+            self.pending_reply = code
+            self.last_spacing = READ_DELAY
+        return len(data)
+
+    def read(self, length):
+        now = time.monotonic()
+        if self.last_write is not None and now - self.last_write < READ_DELAY:
+            self.timing_violations += 1
+        code, self.pending_reply = self.pending_reply, None
+        self.last_write = now
+        self.last_spacing = WRITE_DELAY
+        if code is None:
+            raise OSError(errno.EIO, "No reply pending")
+        if now < self.silent_until:
+            raise OSError(errno.EIO, "Monitor not answering")
+        if code in self.settling and now >= self.settling[code][1]:
+            self.vcp[code] = self.settling.pop(code)[0]
+
+        if self.busy_replies > 0:
+            self.busy_replies -= 1
+            reply = bytes([DISPLAY_WRITE_ADDRESS, 0x80])
+        elif code in self.vcp:
+            current = self.vcp[code]
+            maximum = self.maxima.get(code, 0xFF)
+            reply = bytes([DISPLAY_WRITE_ADDRESS, 0x88, GET_VCP_REPLY_OPCODE, 0x00, code, 0x00,
+                           maximum >> 8, maximum & 0xFF, current >> 8, current & 0xFF])
+        else:
+            reply = bytes([DISPLAY_WRITE_ADDRESS, 0x88, GET_VCP_REPLY_OPCODE, 0x01, code, 0x00,
+                           0, 0, 0, 0])
+        reply += bytes([checksum(reply, REPLY_CHECKSUM_SEED)])
+        return reply.ljust(length, b'\x00')[:length]
+
+    def close(self):
+        self.closed = True
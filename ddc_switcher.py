@@ -3,35 +3,62 @@
 DDC Monitor Input Switcher with USB Switch Control
 Listens for macro pad button presses and switches monitor inputs via DDC commands
 Also controls USB switch via GPIO optocouplers
-Simple version: Always wakes monitor before switching (F23/F24 only)
+Wakes the monitor before switching (F23/F24) unless it is known to be on
 """
 import evdev
-import subprocess
+import functools
+import json
 import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as LegTimeout, wait as wait_futures
 import logging
-from logging.handlers import RotatingFileHandler
 from pathlib import Path
-import RPi.GPIO as GPIO
 import atexit
 import signal
 import sys
-
-# Configure logging with rotation
-log_handler = RotatingFileHandler(
-    '/var/log/ddc_switcher.log',
-    maxBytes=1024*1024,  # 1MB max file size
-    backupCount=3        # Keep 3 backup files
-)
-console_handler = logging.StreamHandler()
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[log_handler, console_handler]
-)
+import threading
+
+import control_socket
+import ddc_ci
+import displays
+import gestures
+import gpio_backends
+import input_devices
+import log_setup
+import pipelines
+import switcher_mqtt
+from dispatcher import ActionDispatcher, ActionSuperseded, CancelToken
+from latency import STATS_DIR, LatencyStats, StatsDumper, Trace, trace_stage
+from monitor_state import StateRefresher
+from mqtt_publisher import MQTTPublisher
+from scheduler import Scheduler
+
+log = logging.getLogger('macropad.switcher')
+
+LOG_FILE = '/var/log/ddc_switcher.log'
+
+# Per-subsystem verbosity, e.g. {'ddc': 'DEBUG', 'gpio': 'WARNING'}; can also be
+# changed while running through log_setup.LOG_LEVELS_FILE
+LOG_LEVELS = {}
+
+def setup_logging(log_file=LOG_FILE, levels=LOG_LEVELS):
+    """Log through the queued pipeline: rotated at 1MB with 3 backups, written in batches"""
+    return log_setup.setup(log_file, levels)
 
 class DDCMonitorSwitcher:
-    def __init__(self):
+    def __init__(self, install_signal_handlers=True):
+        self.created_at = time.monotonic()  # Origin of the time-to-ready measurement
         self.bus_number = 2  # Monitor on i2c-2
+        # Monitors that follow a computer switch. 'match' is an EDID identity
+        # ('MFG:model:serial') or just its serial or model; its bus is then found by
+        # discovery and cached in DISPLAY_CACHE. Entries without 'match' use the
+        # fixed 'bus'. 'inputs' overrides the VCP codes for that monitor.
+        self.displays_config = [
+            {'name': 'main', 'bus': self.bus_number},
+            # {'name': 'left', 'match': 'ABC1234', 'bus': 3,
+            #  'inputs': {'displayport': 15, 'usbc': 18, 'hdmi': 17}},
+        ]
+        self.DISPLAY_CACHE = displays.DISPLAY_CACHE
+        self.ddc_backend = 'auto'  # 'native' (/dev/i2c-N), 'ddcutil', or 'auto' (native with ddcutil fallback)
         self.inputs = {
             'displayport': 15,  # VCP code for DisplayPort
             'usbc': 27,         # VCP code for USB-C
@@ -42,44 +69,180 @@ class DDCMonitorSwitcher:
             evdev.ecodes.KEY_F24: 'usbc',         # Button 2 -> USB-C + USB Input 2
             evdev.ecodes.KEY_F22: 'hdmi_standby', # Button 3 -> HDMI + Standby (no USB change)
         }
+        # Extra actions per (key, gesture) on top of button_mapping's taps. A key with
+        # only a tap still acts on key-down; one with more gestures waits for release
+        # (long press) or for the double-tap window, and wakes the monitors meanwhile.
+        self.gesture_mapping = {
+            # (evdev.ecodes.KEY_F23, gestures.DOUBLE_TAP): 'hdmi_standby',
+            # (evdev.ecodes.KEY_F24, gestures.LONG_PRESS): 'hdmi_standby',
+        }
+        self.DOUBLE_TAP_WINDOW = gestures.DOUBLE_TAP_WINDOW  # Seconds from release to a second press
+        self.LONG_PRESS_TIME = gestures.LONG_PRESS_TIME      # Seconds held for a long press
+        self.speculative_wake = True  # Start the wake on key-down while the gesture is still unknown
+        self.gesture_call_later = None  # Timer source (loop.call_later in the daemon); own Scheduler if None
+        self.gestures = None
+        self.gesture_scheduler = None
+        self.speculation_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='speculate')
+        # Written on key-down by the gesture path, popped by the action and display threads
+        self.speculation_lock = threading.Lock()
+        self.speculative_wakes = {}  # Display name -> Future of a wake started on key-down
+        self.speculation_stats = {'wakes': 0, 'joined': 0, 'failed': 0}
 
         # USB Switch GPIO Configuration - CHANGED PINS
         self.USB_SWITCH_INPUT_1_GPIO = 17  # GPIO 17 for Input 1 (Computer A) - CHANGED from 27
         self.USB_SWITCH_INPUT_2_GPIO = 27  # GPIO 27 for Input 2 (Computer B) - CHANGED from 22
         self.SWITCH_PULSE_DURATION = 0.1   # Hold optocoupler active for 100ms
         self.usb_switch_enabled = True
+        self.gpio_backend = 'auto'  # 'rpi' (RPi.GPIO), 'gpiod' (character device), 'fake', or 'auto'
+        self.GPIO_CHIP = gpio_backends.GPIO_CHIP  # Used by the gpiod backend
+        self.gpio = None
+
+        # Run the monitor (DDC) and USB legs of a computer switch concurrently
+        self.parallel_switching = True
+        self.DDC_LEG_TIMEOUT = 20.0  # Seconds allowed for wake + input switch
+        self.LEG_CANCEL_GRACE = 1.0  # Seconds a timed-out DDC leg gets to stop before the action returns
+        self.USB_LEG_TIMEOUT = 2.0   # Seconds allowed for the optocoupler pulse to complete
+        self.leg_executor = self.new_leg_executor()
+
+        # Monitor state cache: skip wake/switch commands that would not change anything
+        self.state_cache_enabled = True
+        self.STATE_TTL = 30.0               # Seconds a read or written VCP value is trusted
+        self.STATE_REFRESH_INTERVAL = 10.0  # Background refresh period while idle
+        self.STATE_IDLE_TIME = 5.0          # Seconds without a button press before refreshing
+        self.state_refreshers = []
+        self.last_activity = time.monotonic()
+
+        # How wakes and input switches are confirmed: 'poll' reads the value back at growing
+        # intervals, starting at each monitor's learned settle time, and rewrites it if it
+        # doesn't show; 'backend' is ddcutil's fixed-sleep verify (native: one immediate
+        # read-back) for input switches only; 'off' trusts the write
+        self.VERIFY_MODE = 'poll'
+        self.VERIFY_DEADLINE = ddc_ci.VERIFY_DEADLINE  # Seconds a polled verification may take
+
+        # Latest-wins dispatcher: the read loop only queues actions, a worker runs them
+        self.dispatcher = ActionDispatcher(self.execute_action, name='ddc-dispatcher')
+        self.action_token = None
+        self.task_context = threading.local()  # Token and trace of a leg or display task on a pool thread
+        self.action_results = {'succeeded': 0, 'failed': 0}
+        self.last_action = None
+
+        # Dispatch table of the actions keys, gestures and commands can name. Pipelines
+        # from ACTIONS_FILE are compiled into it at startup (and may replace these).
+        self.actions = {
+            'displayport': self.switch_to_computer_a,   # Computer A: DisplayPort + USB Input 1
+            'usbc': self.switch_to_computer_b,          # Computer B: USB-C + USB Input 2
+            'hdmi_standby': self.switch_to_hdmi_and_standby,  # HDMI + Standby (no USB change)
+        }
+        self.parameterized_actions = {'vcp': self.set_raw_vcp}  # ('vcp', display, code, value)
+        self.ACTIONS_FILE = pipelines.ACTIONS_FILE  # None disables pipelines
+        self.pipelines = {}
+        self.step_executor = ThreadPoolExecutor(max_workers=pipelines.STEP_WORKERS, thread_name_prefix='step')
+
+        # Local control API (JSON lines) for scripts; actions go through the dispatcher
+        self.CONTROL_SOCKET = control_socket.CONTROL_SOCKET  # None disables the Unix socket
+        self.CONTROL_TCP = None  # e.g. ('0.0.0.0', 8765) to also listen on TCP
+        self.CONTROL_TCP_ACTIONS = False  # TCP clients may only ping and read status unless True
+        self.control_server = None
+
+        # Retained state, a command topic and Home Assistant discovery over MQTT
+        self.MQTT_BROKER = None  # e.g. '192.168.1.100'; None disables MQTT unless mqtt_publisher is set
+        self.MQTT_PORT = 1883
+        self.MQTT_USER = None
+        self.MQTT_PASSWORD = None
+        self.MQTT_TOPIC_PREFIX = switcher_mqtt.TOPIC_PREFIX
+        self.MQTT_DISCOVERY_PREFIX = switcher_mqtt.DISCOVERY_PREFIX  # None disables discovery
+        self.MQTT_VCP_COMMANDS = False  # The command topic only takes actions unless True
+        self.mqtt_publisher = None  # A publisher to share (macropad_daemon.py); made from MQTT_BROKER otherwise
+        self.owns_mqtt_publisher = False
+        self.mqtt = None
+
+        # Per-action/per-stage latency histograms, dumped periodically as JSON
+        self.latency = LatencyStats()
+        self.action_trace = None
+        self.stats_file = f'{STATS_DIR}/ddc_switcher.json'
+        self.stats_dumper = None
+
+        # Macro pad attachment: cached by-id path for fast startup, re-attach on replug
+        self.MACRO_PAD_NAME = "binepad BNK8"  # Not the "Keyboard" variant
+        self.DEVICE_CACHE = input_devices.DEVICE_CACHE
+        self.INPUT_DIRS = input_devices.INPUT_DIRS
+        self.REATTACH_POLL = input_devices.REATTACH_POLL
+        self.stop_requested = threading.Event()
+        self.device_stats = {'ready_ms': None, 'reattaches': 0, 'last_outage_ms': None, 'last_reattach_ms': None}
 
         self.device = None
         self.current_input = None
+        self.usb_input = None  # Last USB input switched to; the switch itself can't be read back
         self.gpio_initialized = False
 
+        # Locate every monitor and open its DDC/CI bus once, kept open between presses
+        self.displays = displays.open_displays(
+            self.displays_config, self.inputs, self.ddc_backend, self.STATE_TTL, self.DISPLAY_CACHE
+        )
+        if not self.displays:
+            log.error(f"No configured display found, falling back to bus {self.bus_number}")
+            self.displays = [displays.Display(
+                'main', self.bus_number, ddc_ci.open_backend(self.bus_number, self.ddc_backend),
+                self.inputs, state_ttl=self.STATE_TTL,
+            )]
+        # Wake + switch is issued to all monitors at once
+        self.display_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='display')
+
         # Initialize USB switch GPIO
         self.setup_usb_switch_gpio()
 
-        # Register cleanup handlers
+        # Register cleanup handlers (an embedding event loop installs its own signal handlers)
         atexit.register(self.cleanup_usb_switch_gpio)
-        signal.signal(signal.SIGINT, self.signal_handler)
-        signal.signal(signal.SIGTERM, self.signal_handler)
+        if install_signal_handlers:
+            signal.signal(signal.SIGINT, self.signal_handler)
+            signal.signal(signal.SIGTERM, self.signal_handler)
+
+    @property
+    def ddc(self):
+        """DDC backend of the primary (first) display"""
+        return self.displays[0].ddc
+
+    @property
+    def state(self):
+        """State cache of the primary (first) display"""
+        return self.displays[0].state
+
+    @property
+    def active_token(self):
+        """Cancel token of the action this thread works for; leg and display tasks carry their own"""
+        return getattr(self.task_context, 'token', self.action_token)
+
+    @property
+    def active_trace(self):
+        """Latency trace of the action this thread works for"""
+        return getattr(self.task_context, 'trace', self.action_trace)
+
+    def run_as_task(self, token, trace, func, *args):
+        """Run func on a pool thread for the action owning token and trace, even after it has returned"""
+        self.task_context.token, self.task_context.trace = token, trace
+        try:
+            return func(*args)
+        finally:
+            del self.task_context.token, self.task_context.trace
 
     def signal_handler(self, sig, frame):
         """Handle program termination signals"""
-        logging.info("Program terminating, cleaning up...")
-        self.cleanup_usb_switch_gpio()
-        if self.device:
-            self.device.close()
+        log.info("Program terminating, cleaning up...")
+        self.stop()
         sys.exit(0)
 
     def setup_usb_switch_gpio(self):
         """Initialize GPIO pins for USB switch control"""
         try:
-            GPIO.setmode(GPIO.BCM)
-            GPIO.setup(self.USB_SWITCH_INPUT_1_GPIO, GPIO.OUT, initial=GPIO.LOW)
-            GPIO.setup(self.USB_SWITCH_INPUT_2_GPIO, GPIO.OUT, initial=GPIO.LOW)
+            self.gpio = gpio_backends.open_backend(
+                [self.USB_SWITCH_INPUT_1_GPIO, self.USB_SWITCH_INPUT_2_GPIO],
+                self.gpio_backend, self.GPIO_CHIP,
+            )
             self.gpio_initialized = True
             self.usb_switch_enabled = True
-            logging.info("USB switch GPIO pins initialized successfully")
+            log.info(f"USB switch GPIO pins initialized successfully ({self.gpio.name} backend)")
         except Exception as e:
-            logging.error(f"Failed to initialize USB switch GPIO: {e}")
+            log.error(f"Failed to initialize USB switch GPIO: {e}")
             self.usb_switch_enabled = False
             self.gpio_initialized = False
 
@@ -87,67 +250,132 @@ class DDCMonitorSwitcher:
         """Clean up GPIO resources"""
         if self.gpio_initialized:
             try:
-                GPIO.output(self.USB_SWITCH_INPUT_1_GPIO, GPIO.LOW)
-                GPIO.output(self.USB_SWITCH_INPUT_2_GPIO, GPIO.LOW)
-                GPIO.cleanup([self.USB_SWITCH_INPUT_1_GPIO, self.USB_SWITCH_INPUT_2_GPIO])
-                logging.info("USB switch GPIO cleaned up")
+                self.gpio.close()
+                log.info("USB switch GPIO cleaned up")
                 self.gpio_initialized = False
             except Exception as e:
-                logging.error(f"Error cleaning up USB switch GPIO: {e}")
+                log.error(f"Error cleaning up USB switch GPIO: {e}")
 
-    def switch_usb_to_input_1(self):
-        """Switch USB to Input 1 (Computer A)"""
+    def start_usb_switch(self, usb_input):
+        """
+        Start the optocoupler pulse for USB input 1 or 2 without waiting for it
+        Returns a PulseHandle for finish_usb_switch, or None if the switch is disabled.
+        """
+        computer = 'A' if usb_input == 1 else 'B'
         if not self.usb_switch_enabled:
-            logging.warning("USB switch disabled, skipping USB Input 1 switch")
-            return False
+            log.warning(f"USB switch disabled, skipping USB Input {usb_input} switch")
+            return None
 
-        try:
-            logging.info("Switching USB to Input 1 (Computer A)")
-            GPIO.output(self.USB_SWITCH_INPUT_1_GPIO, GPIO.HIGH)  # Activate optocoupler
-            time.sleep(self.SWITCH_PULSE_DURATION)                # Hold for 100ms
-            GPIO.output(self.USB_SWITCH_INPUT_1_GPIO, GPIO.LOW)   # Deactivate optocoupler
-            logging.info("USB switched to Input 1 (Computer A)")
-            return True
-        except Exception as e:
-            logging.error(f"Error switching USB to Input 1: {e}")
+        pin = self.USB_SWITCH_INPUT_1_GPIO if usb_input == 1 else self.USB_SWITCH_INPUT_2_GPIO
+        log.info(f"Switching USB to Input {usb_input} (Computer {computer})")
+        return self.gpio.pulse(pin, self.SWITCH_PULSE_DURATION)
+
+    def finish_usb_switch(self, pulse, timeout=None):
+        """Wait for a pulse from start_usb_switch to end; True if it completed"""
+        if pulse is None:
+            return False
+        if not pulse.wait(self.USB_LEG_TIMEOUT if timeout is None else timeout):
+            log.error(f"Error pulsing USB switch GPIO {pulse.pin}: {pulse.error or 'timed out'}")
             return False
 
+        width_ms = pulse.measured * 1000
+        if self.active_trace:
+            self.active_trace.record('gpio_pulse', width_ms)
+        usb_input = 1 if pulse.pin == self.USB_SWITCH_INPUT_1_GPIO else 2
+        self.usb_input = usb_input
+        log.info(f"USB switched to Input {usb_input} (pulse {width_ms:.1f} ms)")
+        return True
+
+    def switch_usb_to_input_1(self):
+        """Switch USB to Input 1 (Computer A)"""
+        return self.finish_usb_switch(self.start_usb_switch(1))
+
     def switch_usb_to_input_2(self):
         """Switch USB to Input 2 (Computer B)"""
-        if not self.usb_switch_enabled:
-            logging.warning("USB switch disabled, skipping USB Input 2 switch")
-            return False
+        return self.finish_usb_switch(self.start_usb_switch(2))
+
+    def new_leg_executor(self):
+        return ThreadPoolExecutor(max_workers=2, thread_name_prefix='switch-leg')
 
+    def run_timed_leg(self, leg_name, func, *args):
+        """Run one leg of a switch and log its wall-clock time"""
+        start = time.monotonic()
         try:
-            logging.info("Switching USB to Input 2 (Computer B)")
-            GPIO.output(self.USB_SWITCH_INPUT_2_GPIO, GPIO.HIGH)  # Activate optocoupler
-            time.sleep(self.SWITCH_PULSE_DURATION)                # Hold for 100ms
-            GPIO.output(self.USB_SWITCH_INPUT_2_GPIO, GPIO.LOW)   # Deactivate optocoupler
-            logging.info("USB switched to Input 2 (Computer B)")
-            return True
-        except Exception as e:
-            logging.error(f"Error switching USB to Input 2: {e}")
-            return False
+            return func(*args)
+        finally:
+            self.log_leg_time(leg_name, start)
+
+    def log_leg_time(self, leg_name, start):
+        log.info(f"{leg_name} leg took {(time.monotonic() - start) * 1000:.0f} ms")
+
+    def run_switch_legs(self, input_name, usb_input):
+        """
+        Run the monitor and USB legs of a computer switch
+        The optocoupler pulse is scheduled on the GPIO backend and never holds up
+        this thread. In parallel mode it starts together with the DDC leg, which
+        runs on the leg pool with its own timeout; a leg that times out counts
+        as failed and is cancelled, so it can't write to a monitor once a newer
+        action has started. A leg still stuck after that gives up its pool: later
+        switches get a fresh one instead of queueing behind it. Returns
+        (ddc_success, usb_success)
+        """
+        start = time.monotonic()
+
+        if not self.parallel_switching:
+            ddc_success = self.run_timed_leg('DDC', self.wake_and_switch, input_name)
+            self.check_superseded()
+            usb_success = self.run_timed_leg('USB', self.finish_usb_switch, self.start_usb_switch(usb_input))
+        else:
+            pulse = self.start_usb_switch(usb_input)
+            # The leg's own token follows the action's and can also be cancelled alone
+            leg_token = self.active_token.child() if self.active_token else CancelToken()
+            future = self.leg_executor.submit(self.run_as_task, leg_token, self.active_trace,
+                                              self.run_timed_leg, 'DDC', self.wake_and_switch, input_name)
+            superseded = False
+            try:
+                ddc_success = future.result(timeout=self.DDC_LEG_TIMEOUT)
+            except ActionSuperseded:
+                superseded = True
+                ddc_success = False
+            except LegTimeout:
+                log.error(f"DDC leg timed out after {self.DDC_LEG_TIMEOUT:.1f}s, cancelling it")
+                leg_token.cancel()
+                ddc_success = False
+                if not wait_futures([future], timeout=self.LEG_CANCEL_GRACE).done:
+                    log.warning(f"DDC leg still running {self.LEG_CANCEL_GRACE:.1f}s after being cancelled, "
+                                f"moving later switches to a new leg pool")
+                    stuck, self.leg_executor = self.leg_executor, self.new_leg_executor()
+                    stuck.shutdown(wait=False)
+            except Exception as e:
+                log.error(f"DDC leg failed: {e}")
+                ddc_success = False
+            remaining = max(0.0, start + self.USB_LEG_TIMEOUT - time.monotonic())
+            usb_success = self.finish_usb_switch(pulse, remaining)
+            self.log_leg_time('USB', start)
+            if superseded:
+                # The USB pulse has already completed; report the action as abandoned
+                raise ActionSuperseded()
+
+        mode = 'parallel' if self.parallel_switching else 'sequential'
+        log.info(f"Switch to {input_name} took {(time.monotonic() - start) * 1000:.0f} ms ({mode})")
+        return ddc_success, usb_success
 
     def switch_to_computer_a(self):
         """
         Switch both DDC (monitor) and USB to Computer A
         Computer A uses DisplayPort input and USB Input 1
         """
-        logging.info("Switching to Computer A (DisplayPort + USB Input 1)...")
-
-        # Switch monitor to DisplayPort
-        ddc_success = self.wake_and_switch('displayport')
+        log.info("Switching to Computer A (DisplayPort + USB Input 1)...")
 
-        # Switch USB to Input 1
-        usb_success = self.switch_usb_to_input_1()
+        # Switch monitor to DisplayPort and USB to Input 1
+        ddc_success, usb_success = self.run_switch_legs('displayport', 1)
 
         success = ddc_success and (usb_success or not self.usb_switch_enabled)
 
         if success:
-            logging.info("Successfully switched to Computer A")
+            log.info("Successfully switched to Computer A")
         else:
-            logging.error("Failed to completely switch to Computer A")
+            log.error("Failed to completely switch to Computer A")
 
         return success
 
@@ -156,305 +384,870 @@ class DDCMonitorSwitcher:
         Switch both DDC (monitor) and USB to Computer B
         Computer B uses USB-C input and USB Input 2
         """
-        logging.info("Switching to Computer B (USB-C + USB Input 2)...")
+        log.info("Switching to Computer B (USB-C + USB Input 2)...")
 
-        # Switch monitor to USB-C
-        ddc_success = self.wake_and_switch('usbc')
-
-        # Switch USB to Input 2
-        usb_success = self.switch_usb_to_input_2()
+        # Switch monitor to USB-C and USB to Input 2
+        ddc_success, usb_success = self.run_switch_legs('usbc', 2)
 
         success = ddc_success and (usb_success or not self.usb_switch_enabled)
 
         if success:
-            logging.info("Successfully switched to Computer B")
+            log.info("Successfully switched to Computer B")
         else:
-            logging.error("Failed to completely switch to Computer B")
+            log.error("Failed to completely switch to Computer B")
 
         return success
 
     def test_usb_switch(self):
         """Test USB switch functionality"""
         if not self.usb_switch_enabled:
-            logging.warning("USB switch disabled, cannot test")
+            log.warning("USB switch disabled, cannot test")
             return False
 
-        logging.info("Testing USB switch...")
+        log.info("Testing USB switch...")
 
-        logging.info("Testing USB Input 1...")
+        log.info("Testing USB Input 1...")
         if self.switch_usb_to_input_1():
             time.sleep(2)  # Wait 2 seconds
-            logging.info("USB Input 1 test completed")
+            log.info("USB Input 1 test completed")
 
-        logging.info("Testing USB Input 2...")
+        log.info("Testing USB Input 2...")
         if self.switch_usb_to_input_2():
             time.sleep(2)  # Wait 2 seconds
-            logging.info("USB Input 2 test completed")
+            log.info("USB Input 2 test completed")
 
-        logging.info("USB switch test completed")
+        log.info("USB switch test completed")
         return True
 
     def debug_gpio_state(self):
         """Debug function to check GPIO pin states"""
         if not self.gpio_initialized:
-            logging.warning("GPIO not initialized, cannot check states")
+            log.warning("GPIO not initialized, cannot check states")
             return
 
         try:
             # Note: Reading output pin states may not work on all Pi models
-            logging.info(f"USB Switch GPIO Configuration:")
-            logging.info(f"  Input 1 GPIO: {self.USB_SWITCH_INPUT_1_GPIO}")
-            logging.info(f"  Input 2 GPIO: {self.USB_SWITCH_INPUT_2_GPIO}")
-            logging.info(f"  Pulse Duration: {self.SWITCH_PULSE_DURATION}s")
-            logging.info(f"  USB Switch Enabled: {self.usb_switch_enabled}")
+            log.info(f"USB Switch GPIO Configuration:")
+            log.info(f"  Input 1 GPIO: {self.USB_SWITCH_INPUT_1_GPIO}")
+            log.info(f"  Input 2 GPIO: {self.USB_SWITCH_INPUT_2_GPIO}")
+            log.info(f"  Pulse Duration: {self.SWITCH_PULSE_DURATION}s")
+            log.info(f"  Backend: {self.gpio.name}")
+            log.info(f"  USB Switch Enabled: {self.usb_switch_enabled}")
         except Exception as e:
-            logging.error(f"Error reading GPIO debug info: {e}")
-
-    def find_macro_pad(self):
-        """Find and connect to the macro pad device"""
-        devices = [evdev.InputDevice(path) for path in evdev.list_devices()]
-
-        for device in devices:
-            # Look for keyboard-like devices (macro pads usually appear as keyboards)
-            if evdev.ecodes.EV_KEY in device.capabilities():
-                logging.info(f"Found input device: {device.name} at {device.path}")
-                # Look for the specific binepad BNK8 device (not the "Keyboard" variant)
-                if device.name == "binepad BNK8":
-                    return device
+            log.error(f"Error reading GPIO debug info: {e}")
 
-        # If no specific macro pad found, list all keyboard devices for manual selection
-        keyboard_devices = []
-        for device in devices:
-            if evdev.ecodes.EV_KEY in device.capabilities():
-                keyboard_devices.append(device)
+    def find_macro_pad(self, fallback_to_keyboard=True):
+        """Find and connect to the macro pad device, trying the cached path first"""
+        return input_devices.find_device(
+            self.MACRO_PAD_NAME, self.DEVICE_CACHE, fallback_to_keyboard, self.INPUT_DIRS
+        )
 
-        if keyboard_devices:
-            logging.info("Available keyboard-like devices:")
-            for i, dev in enumerate(keyboard_devices):
-                logging.info(f"  {i}: {dev.name} at {dev.path}")
-
-            # For now, return the first one (you can modify this logic)
-            return keyboard_devices[0] if keyboard_devices else None
+    def reattach_macro_pad(self):
+        """Wait for the unplugged macro pad to come back; returns False if stopping"""
+        lost_at = time.monotonic()
+        if self.device:
+            self.device.close()
+            self.device = None
+        log.warning("Macro pad disconnected, waiting for it to be plugged back in")
+
+        # Only the pad itself will do now, not whichever keyboard is left
+        device, attach_ms = input_devices.wait_for_device(
+            lambda: self.find_macro_pad(fallback_to_keyboard=False),
+            self.stop_requested, self.REATTACH_POLL, self.INPUT_DIRS,
+        )
+        if device is None:
+            return False
 
-        return None
+        self.device = device
+        outage_ms = (time.monotonic() - lost_at) * 1000
+        self.device_stats['reattaches'] += 1
+        self.device_stats['last_outage_ms'] = round(outage_ms, 1)
+        self.device_stats['last_reattach_ms'] = None if attach_ms is None else round(attach_ms, 1)
+        attach_note = '' if attach_ms is None else f", ready {attach_ms:.0f} ms after it appeared"
+        log.info(f"Macro pad reattached at {device.path} after {outage_ms / 1000:.1f} s{attach_note}")
+        return True
 
-    def wake_monitor(self):
+    def wake_monitor(self, force=False, display=None):
         """Wake up the monitor from standby/sleep"""
-        cmd = [
-            'ddcutil', 'setvcp', 'D6', '01',  # Set power state to On
-            f'--bus={self.bus_number}', '--noverify'
-        ]
+        display = display or self.displays[0]
+        self.join_speculative_wake(display)
+        if not force and self.state_cache_enabled and display.state.power_mode() == ddc_ci.POWER_ON:
+            display.state.count('wake_skipped')
+            log.info(f"Monitor {display.name} known to be on, skipping wake command")
+            return True
 
         try:
-            logging.info("Sending wake command to monitor")
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-
-            if result.returncode == 0:
-                logging.info("Wake command sent successfully")
-                return True
-            else:
-                logging.warning(f"Wake command failed with code {result.returncode}")
-                return False
-
-        except subprocess.TimeoutExpired:
-            logging.error("Wake command timed out")
-            return False
-        except Exception as e:
-            logging.error(f"Error sending wake command: {e}")
+            log.info(f"Sending wake command to monitor {display.name}")
+            with trace_stage(self.active_trace, 'wake'):
+                # Set power state to On; only a polled read-back is worth waiting for here
+                # A wake is never failed fast but made the breaker's trial: a sleeping monitor may have missed reads
+                self.write_vcp(display, ddc_ci.VCP_POWER_MODE, ddc_ci.POWER_ON,
+                               verify=self.VERIFY_MODE == 'poll', cancel=self.ddc_cancel(), stage='wake', probe=True)
+            display.state.update(ddc_ci.VCP_POWER_MODE, ddc_ci.POWER_ON)
+            log.info("Wake command sent successfully")
+            return True
+        except ddc_ci.DDCError as e:
+            display.state.invalidate(ddc_ci.VCP_POWER_MODE)
+            self.check_superseded()  # A killed command of a superseded action isn't a failure
+            log.warning(f"Wake command to {display.name} failed: {e}")
             return False
 
-    def switch_input(self, input_name):
+    def switch_input(self, input_name, force=False, display=None):
         """Switch monitor input using DDC command"""
-        if input_name not in self.inputs:
-            logging.error(f"Unknown input: {input_name}")
+        display = display or self.displays[0]
+        if input_name not in display.inputs:
+            log.error(f"Unknown input for {display.name}: {input_name}")
             return False
 
-        vcp_code = self.inputs[input_name]
-        cmd = [
-            'ddcutil', 'setvcp', '60', str(vcp_code),
-            f'--bus={self.bus_number}'
-        ]
-
-        try:
-            logging.info(f"Switching to {input_name} (VCP code: {vcp_code})")
+        vcp_code = display.inputs[input_name]
 
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-
-            if result.returncode == 0:
-                logging.info(f"Successfully switched to {input_name}")
+        if not force and self.state_cache_enabled and display.state.input_source() == vcp_code:
+            display.state.count('switch_skipped')
+            log.info(f"Monitor {display.name} already on {input_name}, skipping input switch")
+            if display is self.displays[0]:
                 self.current_input = input_name
-                return True
-            else:
-                logging.error(f"Input switch failed with code {result.returncode}")
-                return False
+            return True
 
-        except subprocess.TimeoutExpired:
-            logging.error("Input switch command timed out")
-            return False
-        except Exception as e:
-            logging.error(f"Error executing input switch: {e}")
+        try:
+            log.info(f"Switching {display.name} to {input_name} (VCP code: {vcp_code})")
+            with trace_stage(self.active_trace, 'input_switch'):
+                self.write_vcp(display, ddc_ci.VCP_INPUT_SOURCE, vcp_code,
+                               verify=True, cancel=self.ddc_cancel(), stage='input_switch')
+            display.state.update(ddc_ci.VCP_INPUT_SOURCE, vcp_code)
+            log.info(f"Successfully switched {display.name} to {input_name}")
+            if display is self.displays[0]:
+                self.current_input = input_name
+            return True
+        except ddc_ci.DDCError as e:
+            display.state.invalidate(ddc_ci.VCP_INPUT_SOURCE)
+            self.check_superseded()
+            log.error(f"Input switch on {display.name} failed: {e}")
             return False
 
-    def get_current_input(self):
-        """Get current monitor input (optional - for status checking)"""
-        cmd = [
-            'ddcutil', 'getvcp', '60',
-            f'--bus={self.bus_number}'
-        ]
+    def write_vcp(self, display, code, value, verify=False, cancel=None, stage=None, probe=False):
+        """
+        Set a VCP feature on one monitor, confirmed as VERIFY_MODE says when verify is True
+        A polled verification logs the time to the confirming read and, given a
+        stage, records it on the action's trace as '<stage>_verified'. A probe
+        write is never failed fast by the monitor's circuit breaker.
+        """
+        if not verify or self.VERIFY_MODE == 'off':
+            display.ddc.set_vcp(code, value, cancel=cancel, probe=probe)
+            return
+        if self.VERIFY_MODE == 'backend':
+            display.ddc.set_vcp(code, value, verify=True, cancel=cancel, probe=probe)
+            return
+        ms, reads, writes = ddc_ci.set_vcp_polled(display.ddc, code, value, display.settle, cancel,
+                                                  self.VERIFY_DEADLINE, probe)
+        log.info(f"{display.name} VCP 0x{code:02X} = {value} verified {ms:.0f} ms after the write "
+                 f"({reads} reads, {writes} writes)")
+        if stage and self.active_trace:
+            self.active_trace.record(f'{stage}_verified', ms)
+
+    def input_name_for(self, vcp_value, display=None):
+        """Map a VCP 60 value to an input name"""
+        display = display or self.displays[0]
+        # Some monitors put vendor data in the high byte; the source is the low byte
+        for input_name, vcp_code in display.inputs.items():
+            if vcp_value & 0xFF == vcp_code:
+                return input_name
+        return 'unknown'
 
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=5)
-            if result.returncode == 0:
-                # Parse the output to determine current input
-                output = result.stdout.lower()
-                if 'x0f' in output or '15' in output:
-                    return 'displayport'
-                elif 'x1b' in output or '27' in output:
-                    return 'usbc'
-                elif 'x11' in output or '17' in output:
-                    return 'hdmi'
-            return 'unknown'
-        except:
+    def get_current_input(self):
+        """Read every monitor's input and power mode into its state cache; returns the primary's input"""
+        for display in self.displays:
+            display.state.refresh(display.ddc)
+        source = self.state.input_source()
+        if source is None:
+            log.warning("Could not read current input")
             return 'unknown'
-
-    def wake_and_switch(self, input_name):
-        """Wake monitor and switch input - simple approach"""
-        logging.info(f"Wake and switch to {input_name} requested")
-
-        # Step 1: Always send wake command (safe even if already awake)
-        self.wake_monitor()
+        return self.input_name_for(source)
+
+    def is_idle(self):
+        """True when no button has been pressed for STATE_IDLE_TIME seconds"""
+        return time.monotonic() - self.last_activity >= self.STATE_IDLE_TIME
+
+    def log_state_cache_stats(self):
+        totals = {}
+        for display in self.displays:
+            for stat, value in display.state.stats.items():
+                totals[stat] = totals.get(stat, 0) + value
+        avoided = totals['wake_skipped'] + totals['switch_skipped'] + totals['standby_skipped']
+        log.info(
+            f"State cache: {avoided} DDC commands avoided "
+            f"(wake {totals['wake_skipped']}, switch {totals['switch_skipped']}, "
+            f"standby {totals['standby_skipped']}), {totals['refreshes']} refreshes"
+        )
+
+    def run_on_displays(self, func, *args):
+        """
+        Run func(display, *args) for every display concurrently
+        Total latency is that of the slowest monitor rather than the sum.
+        Returns True only if every display succeeded.
+        """
+        if len(self.displays) == 1:
+            return func(self.displays[0], *args)
+
+        start = time.monotonic()
+        futures = [self.display_executor.submit(self.run_as_task, self.active_token, self.active_trace, func, display, *args)
+                   for display in self.displays]
+        results = []
+        superseded = False
+        for display, future in zip(self.displays, futures):
+            try:
+                results.append(future.result())
+            except ActionSuperseded:
+                superseded = True
+                results.append(False)
+            except Exception as e:
+                log.error(f"Display {display.name} failed: {e}")
+                results.append(False)
+        log.info(f"{len(self.displays)} displays done in {(time.monotonic() - start) * 1000:.0f} ms "
+                     f"({sum(results)} succeeded)")
+        if superseded:
+            raise ActionSuperseded()
+        return all(results)
+
+    def wake_and_switch_display(self, display, input_name, force=False):
+        """Wake one monitor and switch its input, skipping steps the state cache shows are no-ops"""
+        # Step 1: Send wake command unless the monitor is known to be on
+        self.check_superseded()
+        self.wake_monitor(force=force, display=display)
 
         # Step 2: Switch to requested input
-        return self.switch_input(input_name)
+        self.check_superseded()
+        return self.switch_input(input_name, force=force, display=display)
 
-    def switch_to_hdmi_and_standby(self):
-        """Switch to HDMI input and then activate standby mode (no USB change)"""
-        logging.info("Starting HDMI + Standby sequence")
+    def wake_and_switch(self, input_name, force=False):
+        """Wake every monitor and switch its input"""
+        log.info(f"Wake and switch to {input_name} requested")
+        return self.run_on_displays(self.wake_and_switch_display, input_name, force)
 
+    def hdmi_and_standby_display(self, display, force=False):
+        """Switch one monitor to HDMI, then put it in standby"""
         # Step 1: Switch to HDMI input
-        hdmi_cmd = [
-            'ddcutil', 'setvcp', '60', '17',
-            f'--bus={self.bus_number}'
-        ]
+        self.check_superseded()
+        log.info(f"Step 1: Switching {display.name} to HDMI input")
+        if not self.switch_input('hdmi', force=force, display=display):
+            log.error(f"HDMI switch on {display.name} failed")
+            return False
+        log.info("HDMI switch completed successfully")
+
+        # Step 2: Activate standby mode
+        self.check_superseded()
+        if not force and self.state_cache_enabled and display.state.power_mode() == ddc_ci.POWER_STANDBY:
+            display.state.count('standby_skipped')
+            log.info(f"Monitor {display.name} already in standby, skipping standby command")
+            return True
 
         try:
-            logging.info("Step 1: Switching to HDMI input")
-            hdmi_result = subprocess.run(hdmi_cmd, capture_output=True, text=True, timeout=10)
+            log.info(f"Step 2: Activating standby mode on {display.name}")
+            with trace_stage(self.active_trace, 'standby'):
+                display.ddc.set_vcp(ddc_ci.VCP_POWER_MODE, ddc_ci.POWER_STANDBY, cancel=self.ddc_cancel())
+            display.state.update(ddc_ci.VCP_POWER_MODE, ddc_ci.POWER_STANDBY)
+            return True
+        except ddc_ci.DDCError as e:
+            display.state.invalidate(ddc_ci.VCP_POWER_MODE)
+            self.check_superseded()
+            log.error(f"Standby command on {display.name} failed: {e}")
+            return False
 
-            if hdmi_result.returncode != 0:
-                logging.error(f"HDMI switch failed with code {hdmi_result.returncode}")
-                return False
+    def switch_to_hdmi_and_standby(self, force=False):
+        """Switch to HDMI input and then activate standby mode (no USB change)"""
+        log.info("Starting HDMI + Standby sequence")
+        success = self.run_on_displays(self.hdmi_and_standby_display, force)
+        if success:
+            log.info("HDMI + Standby sequence completed successfully")
+        return success
 
-            logging.info("HDMI switch completed successfully")
-            self.current_input = 'hdmi'
+    def check_superseded(self):
+        """Abandon the running action here if a newer press has replaced it"""
+        if self.active_token:
+            self.active_token.check()
+
+    def ddc_cancel(self):
+        """Event that kills the running action's DDC command when a newer press supersedes it"""
+        return self.active_token.event if self.active_token else None
+
+    def request_action(self, action, event_time=None, recognition_ms=None):
+        """Queue an action on the dispatcher; used by the macro pad and the control socket"""
+        self.last_activity = time.monotonic()
+        name = action[0] if isinstance(action, tuple) else action
+        trace = Trace(name, event_time)
+        if recognition_ms:
+            trace.record('recognition', recognition_ms)
+        # A raw VCP write only replaces one to the same monitor and feature, and never a switch
+        kind = action[:-1] if isinstance(action, tuple) else None
+        self.dispatcher.submit(action, trace, kind)
+
+    def start_gestures(self):
+        """Build the gesture recognizer from button_mapping (taps) and gesture_mapping"""
+        keys = {code: {gestures.TAP} for code in self.button_mapping}
+        for code, gesture in self.gesture_mapping:
+            keys.setdefault(code, set()).add(gesture)
+        call_later = self.gesture_call_later
+        if call_later is None and any(key_gestures != {gestures.TAP} for key_gestures in keys.values()):
+            self.gesture_scheduler = Scheduler('gestures').start()
+            call_later = self.gesture_scheduler.call_later
+        self.gestures = gestures.GestureRecognizer(
+            keys, self.on_gesture, call_later, self.on_speculate,
+            double_tap_window=self.DOUBLE_TAP_WINDOW, long_press_time=self.LONG_PRESS_TIME,
+        )
+
+    def on_gesture(self, code, gesture, event_time, recognition_ms):
+        action = self.button_mapping.get(code) if gesture == gestures.TAP else self.gesture_mapping.get((code, gesture))
+        if action is None:
+            return
+        log.info(f"Button {code} {gesture} -> {action}")
+        self.request_action(action, event_time, recognition_ms)
+
+    def on_speculate(self, code, event_time):
+        """Key-down on a key whose gesture isn't known yet: start the tap action's wake"""
+        # Computer switches begin with a wake, which is idempotent whatever the gesture turns out to be
+        action = self.button_mapping.get(code)
+        if self.speculative_wake and action in ('displayport', 'usbc') and action not in self.pipelines:
+            self.start_speculative_wake()
+
+    def start_speculative_wake(self):
+        """Wake every monitor not known to be on, without waiting"""
+        for display in self.displays:
+            if self.state_cache_enabled and display.state.power_mode() == ddc_ci.POWER_ON:
+                continue
+            with self.speculation_lock:
+                pending = self.speculative_wakes.get(display.name)
+                if pending is not None and not pending.done():
+                    continue
+                self.speculation_stats['wakes'] += 1
+                self.speculative_wakes[display.name] = self.speculation_executor.submit(
+                    self.speculative_wake_display, display
+                )
+
+    def speculative_wake_display(self, display):
+        start = time.monotonic()
+        try:
+            display.ddc.set_vcp(ddc_ci.VCP_POWER_MODE, ddc_ci.POWER_ON, probe=True)
+        except ddc_ci.DDCError as e:
+            display.state.invalidate(ddc_ci.VCP_POWER_MODE)
+            with self.speculation_lock:
+                self.speculation_stats['failed'] += 1
+            log.warning(f"Speculative wake of {display.name} failed: {e}")
+            return False
+        display.state.update(ddc_ci.VCP_POWER_MODE, ddc_ci.POWER_ON)
+        self.latency.record('speculative', 'wake', (time.monotonic() - start) * 1000)
+        return True
 
-            # Step 2: Activate standby mode
-            standby_cmd = [
-                'ddcutil', 'setvcp', 'D6', '02',
-                f'--bus={self.bus_number}', '--noverify'
-            ]
+    def speculation_snapshot(self):
+        with self.speculation_lock:
+            return dict(self.speculation_stats)
+
+    def join_speculative_wake(self, display):
+        """Wait for a wake started on key-down rather than sending a second one alongside it"""
+        with self.speculation_lock:
+            pending = self.speculative_wakes.pop(display.name, None)
+            if pending is None or pending.done():
+                return
+            self.speculation_stats['joined'] += 1
+        with trace_stage(self.active_trace, 'wake_join'):
+            while not pending.done():
+                self.check_superseded()
+                wait_futures([pending], timeout=0.05)
+
+    def handle_key_event(self, key_event):
+        """Feed a key press or release to the gesture recognizer; autorepeat is ignored"""
+        if key_event.keystate == evdev.KeyEvent.key_down:
+            self.handle_button_press(key_event)
+        elif key_event.keystate == evdev.KeyEvent.key_up:
+            self.gestures.key_up(key_event.scancode, key_event.event.timestamp())
 
-            logging.info("Step 2: Activating standby mode")
-            standby_result = subprocess.run(standby_cmd, capture_output=True, text=True, timeout=10)
+    def handle_button_press(self, key_event):
+        """Handle macro pad button press; its action is queued once the gesture is known"""
+        # Get both the numeric scancode and string keycode
+        scancode = key_event.scancode
+        keycode_str = key_event.keycode
+        self.last_activity = time.monotonic()
 
-            if standby_result.returncode == 0:
-                logging.info("HDMI + Standby sequence completed successfully")
-                return True
+        # Check if the scancode matches our mapping
+        if scancode in self.gestures.keys:
+            log.debug(f"Button press - scancode: {scancode}, keycode: {keycode_str}")
+            self.gestures.key_down(scancode, key_event.event.timestamp())
+        else:
+            log.info(f"Scancode {scancode} ({keycode_str}) not found in button mapping")
+            log.debug(f"Available mappings: {self.button_mapping}")
+
+    def execute_action(self, action, token=None, trace=None):
+        """Run a button action on the dispatcher worker"""
+        self.action_token = token
+        self.action_trace = trace
+        if trace:
+            trace.mark('dispatch')
+        success = False
+        try:
+            if isinstance(action, tuple):
+                # e.g. a raw VCP write from the control socket
+                success = self.parameterized_actions[action[0]](*action[1:])
             else:
-                logging.error(f"Standby command failed with code {standby_result.returncode}")
-                return False
-
-        except subprocess.TimeoutExpired:
-            logging.error("HDMI + Standby command timed out")
+                log.info(f"Executing {action}")
+                success = self.actions[action]()
+            self.action_results['succeeded' if success else 'failed'] += 1
+            return success
+        finally:
+            total_ms = None
+            if trace:
+                total_ms = trace.finish(self.latency)
+                log.info(f"Action {action} completed {total_ms:.0f} ms after key press")
+            self.last_action = {
+                'action': list(action) if isinstance(action, tuple) else action,
+                'success': success,
+                'superseded': bool(token and token.cancelled),
+                'ms': None if total_ms is None else round(total_ms, 1),
+                'finished': time.time(),
+            }
+            if self.mqtt:
+                self.mqtt.notify()
+            self.action_token = None
+            self.action_trace = None
+            self.last_activity = time.monotonic()
+            self.log_state_cache_stats()
+            self.log_dispatcher_stats()
+
+    def set_raw_vcp(self, display_name, code, value):
+        """Write any VCP feature on one monitor; cached input/power values follow the write"""
+        display = self.display_named(display_name)
+        if display is None:
+            log.error(f"Unknown display: {display_name}")
             return False
-        except Exception as e:
-            logging.error(f"Error in HDMI + Standby sequence: {e}")
+        try:
+            log.info(f"Setting VCP 0x{code:02X} to {value} on {display.name}")
+            with trace_stage(self.active_trace, 'vcp_set'):
+                display.ddc.set_vcp(code, value, cancel=self.ddc_cancel())
+            display.state.update(code, value)
+            if code == ddc_ci.VCP_INPUT_SOURCE and display is self.displays[0]:
+                self.current_input = self.input_name_for(value)
+            return True
+        except ddc_ci.DDCError as e:
+            display.state.invalidate(code)
+            self.check_superseded()
+            log.error(f"VCP 0x{code:02X} write on {display.name} failed: {e}")
             return False
 
-    def handle_button_press(self, key_event):
-        """Handle macro pad button press"""
-        # Get both the numeric scancode and string keycode
-        scancode = key_event.scancode
-        keycode_str = key_event.keycode
+    def display_named(self, name=None):
+        """Display by name; the primary when no name is given"""
+        if name is None:
+            return self.displays[0]
+        return next((display for display in self.displays if display.name == name), None)
+
+    def status(self):
+        """Everything known about monitors, USB switch and actions, from memory only (no DDC traffic)"""
+        dispatcher = self.dispatcher.snapshot()
+        monitors = {}
+        for display in self.displays:
+            source = display.state.input_source()
+            power = display.state.power_mode()
+            age = display.state.age(ddc_ci.VCP_INPUT_SOURCE)
+            monitors[display.name] = {
+                'bus': display.bus_number,
+                'backend': display.ddc.name,
+                'input': None if source is None else self.input_name_for(source, display),
+                'input_vcp': source,
+                'power': {ddc_ci.POWER_ON: 'on', ddc_ci.POWER_STANDBY: 'standby'}.get(power, power),
+                'state_age_s': None if age == float('inf') else round(age, 1),
+                'breaker': display.ddc.breaker.state,
+            }
+        in_flight = dispatcher['in_flight']
+        return {
+            'current_input': self.current_input,
+            'usb_input': self.usb_input,
+            'displays': monitors,
+            'in_flight': list(in_flight) if isinstance(in_flight, tuple) else in_flight,
+            'queue_depth': dispatcher['queue_depth'],
+            'last_action': self.last_action,
+        }
 
-        logging.info(f"Button press detected - scancode: {scancode}, keycode: {keycode_str}")
+    def control_commands(self):
+        """Handlers for the control socket; each returns quickly and never touches I2C"""
+        return {
+            'ping': lambda request: {'pong': True},
+            'status': lambda request: self.status(),
+            'action': self.control_action,
+            'vcp': self.control_vcp,
+        }
 
-        # Check if the scancode matches our mapping
-        if scancode in self.button_mapping:
-            action = self.button_mapping[scancode]
-            logging.info(f"Button mapped to: {action}")
-
-            # Handle different button actions
-            if action == 'displayport':
-                # F23: Switch to Computer A (DisplayPort + USB Input 1)
-                logging.info("Executing switch to Computer A")
-                self.switch_to_computer_a()
-            elif action == 'usbc':
-                # F24: Switch to Computer B (USB-C + USB Input 2)
-                logging.info("Executing switch to Computer B")
-                self.switch_to_computer_b()
-            elif action == 'hdmi_standby':
-                # F22: HDMI + Standby (no USB change)
-                logging.info("Executing HDMI + Standby sequence")
-                self.switch_to_hdmi_and_standby()
+    def control_action(self, request):
+        """{"cmd": "action", "action": "displayport" | "usbc" | "hdmi_standby" | "computer_a" | "computer_b" | <pipeline>}"""
+        aliases = {'computer_a': 'displayport', 'computer_b': 'usbc'}
+        action = aliases.get(request.get('action'), request.get('action'))
+        if action not in self.actions:
+            raise control_socket.ControlError(f"Unknown action: {request.get('action')}")
+        self.request_action(action)
+        return {'queued': action}
+
+    def control_vcp(self, request):
+        """{"cmd": "vcp", "display": "main", "code": "0x10", "value": 80}; display defaults to the primary"""
+        try:
+            code = int(str(request['code']), 0)
+            value = int(str(request['value']), 0)
+        except (KeyError, ValueError) as e:
+            raise control_socket.ControlError(f"vcp needs integer code and value: {e}")
+        if not 0 <= code <= 0xFF or not 0 <= value <= 0xFFFF:
+            raise control_socket.ControlError("VCP code must be 0-255 and value 0-65535")
+        display = self.display_named(request.get('display'))
+        if display is None:
+            raise control_socket.ControlError(f"Unknown display: {request.get('display')}")
+        self.request_action(('vcp', display.name, code, value))
+        return {'queued': 'vcp', 'display': display.name, 'code': code, 'value': value}
+
+    def start_control_server(self):
+        """Serve the control socket; a failure to bind leaves the macro pad working"""
+        if not self.CONTROL_SOCKET and not self.CONTROL_TCP:
+            return
+        tcp_commands = None if self.CONTROL_TCP_ACTIONS else {'ping', 'status'}
+        try:
+            self.control_server = control_socket.ControlServer(
+                self.control_commands(), self.CONTROL_SOCKET, self.CONTROL_TCP, tcp_commands
+            ).start()
+        except OSError as e:
+            log.error(f"Could not start control socket: {e}")
+            self.control_server = None
+
+    def start_mqtt(self):
+        """
+        Publish state and take commands over MQTT
+        A shared publisher that hasn't been started yet is started here, after the
+        will is registered; one made from MQTT_BROKER is owned and stopped by us.
+        """
+        if not self.mqtt_publisher and not self.MQTT_BROKER:
+            return
+        if not self.mqtt_publisher:
+            self.mqtt_publisher = MQTTPublisher(self.MQTT_BROKER, self.MQTT_PORT, self.MQTT_USER, self.MQTT_PASSWORD)
+            self.owns_mqtt_publisher = True
+        self.mqtt = switcher_mqtt.SwitcherMQTT(
+            self, self.mqtt_publisher, self.MQTT_TOPIC_PREFIX, self.MQTT_DISCOVERY_PREFIX,
+            vcp_commands=self.MQTT_VCP_COMMANDS,
+        )
+        self.mqtt.attach()
+        if self.mqtt_publisher.started_at is None:
+            self.mqtt_publisher.start()
+        self.mqtt.start()
+        log.info(f"Publishing switcher state to {self.mqtt.state_topic}, commands on {self.mqtt.command_topic}")
+
+    def stop_mqtt(self):
+        if self.mqtt:
+            self.mqtt.stop()
+            self.mqtt = None
+        if self.owns_mqtt_publisher:
+            self.mqtt_publisher.stop()
+            self.mqtt_publisher = None
+            self.owns_mqtt_publisher = False
+
+    def load_pipelines(self):
+        """Compile ACTIONS_FILE into the action table and key mappings; a bad file is ignored as a whole"""
+        if not self.ACTIONS_FILE:
+            return
+        try:
+            config = pipelines.load_file(self.ACTIONS_FILE)
+            if config is None:
+                return
+            compiled, keys, key_gestures = pipelines.compile_config(
+                config, self.step_builders(), self.actions, self.key_code
+            )
+        except pipelines.PipelineError as e:
+            log.error(f"Ignoring {self.ACTIONS_FILE}: {e}")
+            return
+        for name, pipeline in compiled.items():
+            if name in self.actions:
+                log.info(f"Pipeline {name} replaces the built-in action")
+            self.actions[name] = functools.partial(self.run_pipeline, pipeline)
+        self.pipelines = compiled
+        self.button_mapping.update(keys)
+        self.gesture_mapping.update(key_gestures)
+        log.info(f"Loaded {len(compiled)} pipeline(s) and {len(keys) + len(key_gestures)} key mapping(s) "
+                 f"from {self.ACTIONS_FILE}")
+
+    def key_code(self, name):
+        """Key code for a name such as 'KEY_F21' (or a number), None if unknown"""
+        if isinstance(name, str) and name.isdigit():
+            return int(name)
+        code = getattr(evdev.ecodes, str(name), None)
+        return code if isinstance(code, int) else None
+
+    def run_pipeline(self, pipeline):
+        """Run a compiled pipeline on the dispatcher worker"""
+        log.info(f"Running pipeline {pipeline.name}: {pipeline.describe()}")
+        start = time.monotonic()
+        success = pipeline.run(self.step_executor, self.active_token, self.active_trace)
+        elapsed_ms = (time.monotonic() - start) * 1000
+        if success:
+            log.info(f"Pipeline {pipeline.name} completed in {elapsed_ms:.0f} ms")
         else:
-            logging.info(f"Scancode {scancode} not found in button mapping")
-            logging.info(f"Available mappings: {self.button_mapping}")
+            log.error(f"Pipeline {pipeline.name} failed after {elapsed_ms:.0f} ms")
+        return success
 
-    def run(self):
-        """Main event loop"""
-        logging.info("Starting DDC Monitor Switcher with USB Switch Control...")
-        logging.info("Mode: Always wake + switch for F23/F24 with USB switching")
+    def step_builders(self):
+        """Compilers for the hardware step types; delay is built into pipelines"""
+        return {
+            'vcp_set': self.build_vcp_step,
+            'gpio_pulse': self.build_gpio_step,
+            'mqtt_publish': self.build_mqtt_step,
+        }
+
+    def build_vcp_step(self, spec, label):
+        """vcp_set: 'code' and 'value', or an 'input' name; one step per display unless 'display' is given"""
+        if 'display' in spec:
+            display = self.display_named(spec['display'])
+            if display is None:
+                raise pipelines.PipelineError(f"unknown display {spec['display']!r}")
+            targets = [display]
+        else:
+            targets = self.displays
+        if 'input' in spec:
+            if 'code' in spec or 'value' in spec:
+                raise pipelines.PipelineError("give either input or code and value")
+            code = ddc_ci.VCP_INPUT_SOURCE
+        else:
+            code = pipelines.parse_int(spec, 'code', 0, 0xFF)
+            value = pipelines.parse_int(spec, 'value', 0, 0xFFFF)
+        verify = spec.get('verify', code == ddc_ci.VCP_INPUT_SOURCE)
+        force = spec.get('force', False)
+        if not isinstance(verify, bool) or not isinstance(force, bool):
+            raise pipelines.PipelineError("verify and force must be true or false")
+        steps = []
+        for display in targets:
+            if 'input' in spec:
+                if spec['input'] not in display.inputs:
+                    raise pipelines.PipelineError(f"unknown input {spec['input']!r} for {display.name}")
+                value = display.inputs[spec['input']]
+            step_label = label if len(targets) == 1 else f'{label}@{display.name}'
+            steps.append((step_label, self.vcp_step(display, code, value, verify, force)))
+        return steps
+
+    def vcp_step(self, display, code, value, verify, force):
+        """Compiled VCP write; skipped when the state cache already holds the value"""
+        # Sources are compared on the low byte, as in switch_input
+        expected = value & 0xFF if code == ddc_ci.VCP_INPUT_SOURCE else value
+        cached = display.state.input_source if code == ddc_ci.VCP_INPUT_SOURCE else functools.partial(display.state.get, code)
+        is_primary = display is self.displays[0]
+        # Powering on goes through an open breaker as its trial, as wake_monitor does
+        probe = code == ddc_ci.VCP_POWER_MODE and value == ddc_ci.POWER_ON
+
+        def run(cancel):
+            if not force and self.state_cache_enabled and cached() == expected:
+                display.state.count('vcp_skipped')
+                log.info(f"{display.name} VCP 0x{code:02X} already {value}, skipping")
+                return True
+            try:
+                self.write_vcp(display, code, value, verify=verify, cancel=cancel, probe=probe)
+            except ddc_ci.DDCError as e:
+                display.state.invalidate(code)
+                log.error(f"VCP 0x{code:02X} write on {display.name} failed: {e}")
+                return False
+            display.state.update(code, value)
+            if code == ddc_ci.VCP_INPUT_SOURCE and is_primary:
+                self.current_input = self.input_name_for(value)
+            return True
+        return run
+
+    def build_gpio_step(self, spec, label):
+        """gpio_pulse: 'usb_input' 1 or 2, or one of the USB switch 'pin's; 'width' in seconds"""
+        pins = {1: self.USB_SWITCH_INPUT_1_GPIO, 2: self.USB_SWITCH_INPUT_2_GPIO}
+        if 'usb_input' in spec:
+            pin = pins.get(spec['usb_input'])
+            if pin is None or 'pin' in spec:
+                raise pipelines.PipelineError("usb_input must be 1 or 2 (and not given with pin)")
+        else:
+            pin = pipelines.parse_int(spec, 'pin', 0, 63)
+            if pin not in pins.values():
+                raise pipelines.PipelineError(f"pin {pin} is not a USB switch pin ({sorted(pins.values())})")
+        width = pipelines.parse_seconds(spec, 'width', self.SWITCH_PULSE_DURATION, high=1.0)
+
+        def run(cancel):
+            if not self.usb_switch_enabled:
+                log.warning(f"USB switch disabled, skipping pulse on GPIO {pin}")
+                return False
+            return self.finish_usb_switch(self.gpio.pulse(pin, width))
+        return [(label, run)]
+
+    def build_mqtt_step(self, spec, label):
+        """mqtt_publish: 'topic' and 'payload' (text, or JSON for anything else), 'retain', 'qos'"""
+        publisher = self.mqtt_publisher
+        if publisher is None:
+            raise pipelines.PipelineError("needs MQTT (MQTT_BROKER or a shared publisher)")
+        topic = spec.get('topic')
+        if not isinstance(topic, str) or not topic or '#' in topic or '+' in topic:
+            raise pipelines.PipelineError(f"topic must be a topic name without wildcards, not {topic!r}")
+        payload = spec.get('payload', '')
+        if not isinstance(payload, str):
+            payload = json.dumps(payload)
+        retain = spec.get('retain', False)
+        qos = spec.get('qos')
+        if not isinstance(retain, bool) or qos not in (None, 0, 1, 2):
+            raise pipelines.PipelineError("retain must be true or false and qos 0, 1 or 2")
+
+        def run(cancel):
+            publisher.publish(topic, payload, qos=qos, retain=retain)  # Sent or queued; never blocks
+            return True
+        return [(label, run)]
+
+    def stats_providers(self):
+        """Named callables whose output makes up the stats dump"""
+        return {
+            'latency': self.latency.snapshot,
+            'dispatcher': self.dispatcher.snapshot,
+            'actions': lambda: dict(self.action_results),
+            'device': lambda: dict(self.device_stats),
+            'gpio': lambda: self.gpio.snapshot() if self.gpio else {},
+            'logging': log_setup.snapshot,
+            'control': lambda: self.control_server.snapshot() if self.control_server else {},
+            'gestures': lambda: (
+                dict(self.gestures.snapshot(), speculative_wakes=self.speculation_snapshot())
+                if self.gestures else {}
+            ),
+            'switcher_mqtt': lambda: self.mqtt.snapshot() if self.mqtt else {},
+            'pipelines': lambda: {name: pipeline.snapshot() for name, pipeline in self.pipelines.items()},
+            'ddc': lambda: {display.name: display.ddc.breaker.snapshot() for display in self.displays},
+            'verify': lambda: {display.name: display.settle.snapshot() for display in self.displays},
+            'state_cache': lambda: {
+                display.name: dict(display.state.stats, commands_avoided=display.state.commands_avoided())
+                for display in self.displays
+            },
+        }
+
+    def log_dispatcher_stats(self):
+        stats = self.dispatcher.snapshot()
+        log.info(
+            f"Dispatcher: queue depth {stats['queue_depth']}, {stats['submitted']} submitted, "
+            f"{stats['executed']} executed, {stats['coalesced']} coalesced, "
+            f"{stats['superseded']} superseded"
+        )
+
+    def start(self):
+        """Find the macro pad and prime the monitor state; returns False if no device was found"""
+        log.info("Starting DDC Monitor Switcher with USB Switch Control...")
+        log.info(f"Mode: Wake + switch for F23/F24 with USB switching "
+                     f"(state cache {'on' if self.state_cache_enabled else 'off'})")
 
         # Log USB switch status
         if self.usb_switch_enabled:
-            logging.info(f"USB switch enabled - GPIO {self.USB_SWITCH_INPUT_1_GPIO} (Input 1), GPIO {self.USB_SWITCH_INPUT_2_GPIO} (Input 2)")
+            log.info(f"USB switch enabled - GPIO {self.USB_SWITCH_INPUT_1_GPIO} (Input 1), GPIO {self.USB_SWITCH_INPUT_2_GPIO} (Input 2)")
             self.debug_gpio_state()
         else:
-            logging.warning("USB switch disabled due to GPIO initialization failure")
+            log.warning("USB switch disabled due to GPIO initialization failure")
 
         # Find macro pad
         self.device = self.find_macro_pad()
         if not self.device:
-            logging.error("No suitable input device found!")
-            return
+            log.error("No suitable input device found!")
+            return False
 
-        logging.info(f"Using device: {self.device.name}")
+        log.info(f"Using device: {self.device.name}")
+        for display in self.displays:
+            log.info(f"Display {display.name}: {display.ddc.name} backend on bus "
+                         f"{display.bus_number} ({display.identity or 'fixed bus'})")
 
         # Get initial input state
         self.current_input = self.get_current_input()
-        logging.info(f"Current monitor input: {self.current_input}")
+        log.info(f"Current monitor input: {self.current_input}")
+
+        # Keep the state cache fresh while the pad is idle
+        if self.state_cache_enabled:
+            for display in self.displays:
+                refresher = StateRefresher(
+                    display.state, display.ddc, self.is_idle, interval=self.STATE_REFRESH_INTERVAL
+                )
+                refresher.start()
+                self.state_refreshers.append(refresher)
+
+        # MQTT first: pipelines compile their mqtt_publish steps against its publisher
+        self.start_mqtt()
+        self.load_pipelines()
+        self.start_gestures()
+        self.dispatcher.start()
+        self.start_control_server()
+
+        if self.stats_file:
+            self.stats_dumper = StatsDumper(self.stats_file, self.stats_providers())
+            self.stats_dumper.start()
 
         # Button mapping summary
-        logging.info("Button mappings:")
-        logging.info("  F23 (Button 1): Computer A (DisplayPort + USB Input 1)")
-        logging.info("  F24 (Button 2): Computer B (USB-C + USB Input 2)")
-        logging.info("  F22 (Button 3): HDMI + Standby (no USB change)")
+        log.info("Button mappings:")
+        log.info("  F23 (Button 1): Computer A (DisplayPort + USB Input 1)")
+        log.info("  F24 (Button 2): Computer B (USB-C + USB Input 2)")
+        log.info("  F22 (Button 3): HDMI + Standby (no USB change)")
+        for name, pipeline in self.pipelines.items():
+            log.info(f"  Pipeline {name}: {pipeline.describe()}")
+
+        ready_ms = (time.monotonic() - self.created_at) * 1000
+        self.device_stats['ready_ms'] = round(ready_ms, 1)
+        log.info(f"Ready {ready_ms:.0f} ms after startup")
+        return True
 
-        try:
-            # Main event loop
-            for event in self.device.read_loop():
-                if event.type == evdev.ecodes.EV_KEY:
-                    key_event = evdev.categorize(event)
+    def stop(self):
+        """Release the input device, DDC bus, worker threads and GPIO"""
+        self.stop_requested.set()
+        if self.control_server:
+            self.control_server.stop()
+            self.control_server = None
+        self.stop_mqtt()
+        if self.gestures:
+            self.gestures.cancel()
+        if self.gesture_scheduler:
+            self.gesture_scheduler.stop()
+            self.gesture_scheduler = None
+        self.dispatcher.stop()
+        if self.stats_dumper:
+            self.stats_dumper.stop()
+            self.stats_dumper = None
+        if self.device:
+            self.device.close()
+            self.device = None
+        for refresher in self.state_refreshers:
+            refresher.stop()
+        self.state_refreshers = []
+        for display in self.displays:
+            display.ddc.close()
+        self.leg_executor.shutdown(wait=False)
+        self.speculation_executor.shutdown(wait=False)
+        self.step_executor.shutdown(wait=False)
+        self.display_executor.shutdown(wait=False)
+        self.cleanup_usb_switch_gpio()
+
+    def run(self):
+        """Main event loop"""
+        if not self.start():
+            self.stop()
+            return
 
-                    # Only handle key press events (not release)
-                    if key_event.keystate == evdev.KeyEvent.key_down:
-                        logging.info(f"Key press: {key_event.keycode}")
-                        self.handle_button_press(key_event)
+        try:
+            # Main event loop; an unplugged pad is re-attached in place
+            while True:
+                try:
+                    for event in self.device.read_loop():
+                        if event.type == evdev.ecodes.EV_KEY:
+                            key_event = evdev.categorize(event)
+
+                            # Presses and releases both feed gesture recognition
+                            if key_event.keystate == evdev.KeyEvent.key_down:
+                                log.info(f"Key press: {key_event.keycode}")
+                            self.handle_key_event(key_event)
+                except OSError as e:
+                    if self.stop_requested.is_set():
+                        break
+                    log.warning(f"Macro pad read failed: {e}")
+                    if not self.reattach_macro_pad():
+                        break
 
         except KeyboardInterrupt:
-            logging.info("Shutting down...")
+            log.info("Shutting down...")
         except Exception as e:
-            logging.error(f"Error in main loop: {e}")
+            log.error(f"Error in main loop: {e}")
         finally:
-            if self.device:
-                self.device.close()
-            self.cleanup_usb_switch_gpio()
+            self.stop()
 
 def main():
+    setup_logging()
+
     # Check if running as root (needed for DDC commands and GPIO)
     if Path('/var/log').exists() and not Path('/var/log').is_dir():
-        logging.error("Cannot access log directory")
+        log.error("Cannot access log directory")
 
     switcher = DDCMonitorSwitcher()
     switcher.run()
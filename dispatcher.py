@@ -0,0 +1,143 @@
+"""
+Latest-Wins Action Dispatcher
+Decouples reading button presses from executing them. Presses are queued in one
+slot per kind of action, so a burst collapses to the newest target, and an
+in-flight action of the same kind for a different target is asked to stop at
+its next safe point.
+"""
+import logging
+import threading
+
+log = logging.getLogger('macropad.dispatcher')
+
+
+class ActionSuperseded(Exception):
+    """Raised at a safe point when a newer action has replaced the running one"""
+
+
+class CancelToken:
+    """Cancellation flag checked by an action between its steps"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.children = []
+
+    def cancel(self):
+        self.event.set()
+        for child in list(self.children):
+            child.cancel()
+
+    def child(self):
+        """A token cancelled along with this one, which can also be cancelled on its own"""
+        child = CancelToken()
+        self.children.append(child)
+        if self.cancelled:
+            child.cancel()
+        return child
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def check(self):
+        if self.event.is_set():
+            raise ActionSuperseded()
+
+
+class ActionDispatcher:
+    """
+    Runs actions one at a time on a worker thread, newest request of a kind wins
+    execute(action, token, context) is called on the worker; it should call
+    token.check() between steps that are safe to abandon. context is passed
+    through unchanged from submit() (e.g. a latency trace). Actions of different
+    kinds never replace each other; they run in the order they were queued.
+    """
+
+    def __init__(self, execute, name='dispatcher'):
+        self.execute = execute
+        self.cond = threading.Condition()
+        self.pending = {}  # kind -> (action, context), oldest first
+        self.current = None
+        self.current_kind = None
+        self.current_token = None
+        self.running = False
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.stats = {
+            'submitted': 0,
+            'executed': 0,
+            'coalesced': 0,   # Queued actions replaced by a newer one, or already in flight
+            'superseded': 0,  # In-flight actions asked to stop for a newer target
+            'failed': 0,
+        }
+
+    def start(self):
+        with self.cond:
+            self.running = True
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        with self.cond:
+            self.running = False
+            self.pending.clear()
+            if self.current_token:
+                self.current_token.cancel()
+            self.cond.notify()
+        if self.thread.is_alive():
+            self.thread.join(timeout=timeout)
+
+    def submit(self, action, context=None, kind=None):
+        """Queue an action, replacing a queued one of the same kind; never blocks on execution"""
+        with self.cond:
+            self.stats['submitted'] += 1
+            if self.pending.pop(kind, None) is not None:
+                self.stats['coalesced'] += 1
+
+            running = self.current_token is not None and not self.current_token.cancelled
+            if running and self.current_kind == kind:
+                if self.current == action:
+                    # The running action already heads for this target
+                    self.stats['coalesced'] += 1
+                    return
+                self.current_token.cancel()
+                self.stats['superseded'] += 1
+
+            self.pending[kind] = (action, context)
+            self.cond.notify()
+
+    def queue_depth(self):
+        with self.cond:
+            return len(self.pending)
+
+    def snapshot(self):
+        """Counters plus queue depth and the action in flight"""
+        with self.cond:
+            return dict(self.stats,
+                        queue_depth=len(self.pending),
+                        in_flight=self.current)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and not self.pending:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                kind = next(iter(self.pending))
+                action, context = self.pending.pop(kind)
+                self.current, self.current_kind = action, kind
+                self.current_token = token = CancelToken()
+
+            try:
+                self.execute(action, token, context)
+            except ActionSuperseded:
+                log.info(f"Action {action} superseded by a newer press")
+            except Exception as e:
+                log.error(f"Action {action} failed: {e}")
+                with self.cond:
+                    self.stats['failed'] += 1
+            finally:
+                with self.cond:
+                    self.stats['executed'] += 1
+                    self.current = None
+                    self.current_kind = None
+                    self.current_token = None
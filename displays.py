@@ -0,0 +1,211 @@
+"""
+Display Discovery
+Maps configured monitors to I2C buses by their EDID identity. A discovery
+pass reads the EDID of every /dev/i2c-N directly (falling back to
+`ddcutil detect`) and its result is cached on disk. Later startups only
+re-read the EDID on each cached bus to confirm the mapping still holds.
+"""
+import fcntl
+import glob
+import json
+import logging
+import os
+import re
+import subprocess
+import time
+
+import ddc_ci
+from monitor_state import MonitorState
+
+log = logging.getLogger('macropad.displays')
+
+EDID_ADDRESS = 0x50
+EDID_LENGTH = 128
+EDID_HEADER = bytes([0x00, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0x00])
+DESCRIPTOR_SERIAL = 0xFF
+DESCRIPTOR_MODEL = 0xFC
+
+DISPLAY_CACHE = '/var/cache/macropad/displays.json'
+
+
+class Display:
+    """One monitor: where it lives, how to talk to it and what we know about it"""
+
+    def __init__(self, name, bus_number, ddc, inputs, identity=None, state_ttl=30.0):
+        self.name = name
+        self.bus_number = bus_number
+        self.ddc = ddc
+        self.inputs = inputs
+        self.identity = identity
+        self.state = MonitorState(ttl=state_ttl)
+        self.settle = ddc_ci.SettleTimes()  # Learned time for a written value to show up
+
+    def __repr__(self):
+        return f"Display({self.name!r}, bus={self.bus_number}, identity={self.identity!r})"
+
+
+def parse_edid(edid):
+    """Return 'MFG:model:serial' from a 128-byte EDID block, or None if it isn't one"""
+    if len(edid) < EDID_LENGTH or edid[:8] != EDID_HEADER:
+        return None
+
+    # Manufacturer ID: three 5-bit letters, big-endian
+    mfg_word = (edid[8] << 8) | edid[9]
+    manufacturer = ''.join(chr(((mfg_word >> shift) & 0x1F) + ord('A') - 1) for shift in (10, 5, 0))
+    model = f"{edid[10] | (edid[11] << 8):04X}"
+    serial = str(int.from_bytes(edid[12:16], 'little'))
+
+    for offset in (54, 72, 90, 108):
+        descriptor = edid[offset:offset + 18]
+        if descriptor[0:3] != b'\x00\x00\x00':
+            continue  # Detailed timing, not a text descriptor
+        text = descriptor[5:18].split(b'\n')[0].decode('ascii', 'replace').strip()
+        if descriptor[3] == DESCRIPTOR_MODEL and text:
+            model = text
+        elif descriptor[3] == DESCRIPTOR_SERIAL and text:
+            serial = text
+    return f"{manufacturer}:{model}:{serial}"
+
+
+def read_edid_identity(bus_number):
+    """Read the EDID on one bus directly; None if nothing answers"""
+    try:
+        fd = os.open(f'/dev/i2c-{bus_number}', os.O_RDWR)
+    except OSError:
+        return None
+    try:
+        fcntl.ioctl(fd, ddc_ci.I2C_SLAVE, EDID_ADDRESS)
+        os.write(fd, b'\x00')
+        return parse_edid(os.read(fd, EDID_LENGTH))
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+
+def list_buses():
+    buses = []
+    for path in glob.glob('/dev/i2c-*'):
+        suffix = path.rsplit('-', 1)[1]
+        if suffix.isdigit():
+            buses.append(int(suffix))
+    return sorted(buses)
+
+
+def detect_with_ddcutil(timeout=30):
+    """Slow fallback: `ddcutil detect --terse` -> {identity: bus}"""
+    try:
+        result = subprocess.run(['ddcutil', 'detect', '--terse'],
+                                capture_output=True, text=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        log.warning(f"ddcutil detect failed: {e}")
+        return {}
+
+    found = {}
+    bus = None
+    for line in result.stdout.splitlines():
+        bus_match = re.search(r'I2C bus:\s+/dev/i2c-(\d+)', line)
+        if bus_match:
+            bus = int(bus_match.group(1))
+        monitor_match = re.search(r'Monitor:\s+(.+)', line)
+        if monitor_match and bus is not None:
+            found[monitor_match.group(1).strip()] = bus
+            bus = None
+    return found
+
+
+def discover(read_identity=read_edid_identity):
+    """Full discovery pass: {identity: bus} for every monitor that answers"""
+    start = time.monotonic()
+    found = {}
+    for bus in list_buses():
+        identity = read_identity(bus)
+        if identity:
+            found[identity] = bus
+    if not found:
+        found = detect_with_ddcutil()
+    log.info(f"Display discovery found {len(found)} monitor(s) in "
+                 f"{(time.monotonic() - start) * 1000:.0f} ms: {found}")
+    return found
+
+
+def load_cache(path):
+    try:
+        with open(path) as f:
+            return {identity: int(bus) for identity, bus in json.load(f).items()}
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+def save_cache(path, mapping):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(mapping, f, indent=2)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        log.warning(f"Could not save display cache {path}: {e}")
+
+
+def matches(identity, pattern):
+    """A config 'match' is a full identity or one piece of it (serial or model)"""
+    return identity == pattern or pattern in identity.split(':')
+
+
+def resolve_buses(config, cache_path=DISPLAY_CACHE, read_identity=read_edid_identity):
+    """
+    Map each configured display to a bus
+    Entries without 'match' use their fixed 'bus'. Cached mappings are
+    confirmed by one EDID read per bus; only a miss triggers full discovery.
+    A bus whose EDID can't be read directly (e.g. the cache came from ddcutil)
+    is trusted as cached.
+    Returns {display name: (bus, identity)}.
+    """
+    wanted = [entry for entry in config if entry.get('match')]
+    resolved = {entry['name']: (entry['bus'], None) for entry in config if not entry.get('match')}
+    if not wanted:
+        return resolved
+
+    cache = load_cache(cache_path)
+    pending = []
+    for entry in wanted:
+        hit = next(((identity, bus) for identity, bus in cache.items()
+                    if matches(identity, entry['match'])), None)
+        if hit and read_identity(hit[1]) in (hit[0], None):
+            resolved[entry['name']] = (hit[1], hit[0])
+        else:
+            pending.append(entry)
+
+    if pending:
+        log.info(f"Display cache miss for {[entry['name'] for entry in pending]}, running discovery")
+        found = discover(read_identity)
+        if found:
+            save_cache(cache_path, found)
+        for entry in pending:
+            hit = next(((identity, bus) for identity, bus in found.items()
+                        if matches(identity, entry['match'])), None)
+            if hit:
+                resolved[entry['name']] = (hit[1], hit[0])
+            elif entry.get('bus') is not None:
+                log.warning(f"Display {entry['name']} ({entry['match']}) not found, "
+                                f"using configured bus {entry['bus']}")
+                resolved[entry['name']] = (entry['bus'], None)
+            else:
+                log.error(f"Display {entry['name']} ({entry['match']}) not found")
+    return resolved
+
+
+def open_displays(config, default_inputs, backend='auto', state_ttl=30.0, cache_path=DISPLAY_CACHE):
+    """Build Display objects, in config order, for every display that could be located"""
+    buses = resolve_buses(config, cache_path)
+    displays = []
+    for entry in config:
+        if entry['name'] not in buses:
+            continue
+        bus, identity = buses[entry['name']]
+        displays.append(Display(
+            entry['name'], bus, ddc_ci.open_backend(bus, backend),
+            entry.get('inputs', default_inputs), identity=identity, state_ttl=state_ttl,
+        ))
+    return displays
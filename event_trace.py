@@ -0,0 +1,84 @@
+"""
+Input Event Traces
+A compact binary format for raw evdev streams, written by
+tools/record_events.py and replayed by bench/replay.py. A trace is:
+
+    b"MPTRACE1"                  magic
+    uint32 (little-endian)       length of the JSON header that follows
+    JSON header                  {"version": 1, "started": <epoch>, "devices": [
+                                   {"role": "buttons", "name": ..., "path": ...}, ...]}
+    17-byte records              <device index B, sec I, usec I, type H, code H, value i>
+
+Timestamps are the kernel's (CLOCK_REALTIME), so gaps between events are
+exactly what the services saw.
+"""
+import json
+import struct
+from collections import namedtuple
+
+MAGIC = b"MPTRACE1"
+VERSION = 1
+RECORD = struct.Struct("<BIIHHi")
+HEADER_LENGTH = struct.Struct("<I")
+ROLES = ("buttons", "encoder")
+
+
+class TraceFormatError(ValueError):
+    pass
+
+
+class TraceEvent(namedtuple("TraceEvent", "device sec usec type code value")):
+    """One recorded event; device indexes the header's device list"""
+
+    __slots__ = ()
+
+    def timestamp(self):
+        return self.sec + self.usec / 1000000.0
+
+
+class TraceWriter:
+    """Appends events to a new trace file; devices is a list of {"role", "name", "path"}"""
+
+    def __init__(self, path, devices, started=None):
+        self.file = open(path, "wb")
+        self.count = 0
+        header = json.dumps({"version": VERSION, "started": started, "devices": devices}).encode()
+        self.file.write(MAGIC + HEADER_LENGTH.pack(len(header)) + header)
+
+    def write(self, device, event):
+        """Record an evdev InputEvent (anything with sec, usec, type, code and value)"""
+        self.file.write(RECORD.pack(device, event.sec, event.usec, event.type, event.code, event.value))
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_trace(path):
+    """Return (header, [TraceEvent]); a record cut short by a crash is dropped"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise TraceFormatError(f"{path} is not an event trace")
+    offset = len(MAGIC)
+    try:
+        (length,) = HEADER_LENGTH.unpack_from(data, offset)
+        offset += HEADER_LENGTH.size
+        header = json.loads(data[offset:offset + length])
+    except (struct.error, ValueError) as e:
+        raise TraceFormatError(f"Bad trace header in {path}: {e}")
+    if header.get("version") != VERSION:
+        raise TraceFormatError(f"Unsupported trace version {header.get('version')} in {path}")
+    offset += length
+    end = offset + (len(data) - offset) // RECORD.size * RECORD.size
+    events = [TraceEvent(*fields) for fields in RECORD.iter_unpack(data[offset:end])]
+    return header, events
@@ -0,0 +1,174 @@
+"""
+Gesture Recognition
+Turns key down/up events into tap, double-tap and long-press gestures per
+key. A key with only a tap mapped still fires on key-down, so the common case
+pays no recognition delay. Keys with more gestures have to wait: a tap is
+known at release (long-press mapped) or when the double-tap window closes.
+For those keys on_speculate() runs on key-down, so the caller can start the
+idempotent part of the likely action (e.g. waking the monitor) while waiting.
+
+Decisions use the events' own timestamps, so a late timer or a slow read
+loop can't turn a tap into a long press. Timers only handle the cases where
+no further event arrives (a key still held, or no second press).
+"""
+import logging
+import threading
+import time
+
+from latency import LatencyHistogram
+
+log = logging.getLogger('macropad.gestures')
+
+TAP = 'tap'
+DOUBLE_TAP = 'double_tap'
+LONG_PRESS = 'long_press'
+GESTURES = (TAP, DOUBLE_TAP, LONG_PRESS)
+
+DOUBLE_TAP_WINDOW = 0.3  # Max seconds from a tap's release to the second press
+LONG_PRESS_TIME = 0.6    # Seconds a key is held before it counts as a long press
+
+
+class _KeyState:
+    __slots__ = ('phase', 'down_at', 'up_at', 'timer')
+
+    def __init__(self):
+        self.phase = 'idle'  # idle -> down -> (released -> down) -> idle; 'consumed' until release
+        self.down_at = None
+        self.up_at = None
+        self.timer = None
+
+
+class GestureRecognizer:
+    """
+    Per-key gesture state machine
+    keys maps each key code to the gestures it has actions for.
+    on_gesture(code, gesture, event_time, recognition_ms) gets the first key-down's
+    timestamp and the time from it to recognition. call_later(delay, callback, *args)
+    must return a handle with cancel(); clock must match the event timestamps
+    (CLOCK_REALTIME for evdev). Callbacks run with the lock held and must not block.
+    """
+
+    def __init__(self, keys, on_gesture, call_later, on_speculate=None,
+                 double_tap_window=DOUBLE_TAP_WINDOW, long_press_time=LONG_PRESS_TIME, clock=time.time):
+        self.keys = {code: frozenset(gestures) for code, gestures in keys.items()}
+        self.on_gesture = on_gesture
+        self.on_speculate = on_speculate
+        self.call_later = call_later
+        self.double_tap_window = double_tap_window
+        self.long_press_time = long_press_time
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.states = {code: _KeyState() for code in self.keys}
+        self.recognition = LatencyHistogram()
+        self.stats = {gesture: 0 for gesture in GESTURES}
+        self.stats.update(speculations=0, ignored=0)
+
+    def key_down(self, code, timestamp):
+        with self.lock:
+            state = self.states.get(code)
+            if state is None:
+                return
+            self._flush_other_keys(code, timestamp)
+            gestures = self.keys[code]
+            if state.phase == 'released':
+                if timestamp - state.up_at <= self.double_tap_window:
+                    self._cancel_timer(state)
+                    state.phase = 'consumed'  # Its release is part of the double tap
+                    self._fire(code, DOUBLE_TAP, state.down_at, timestamp)
+                    return
+                self._fire_pending_tap(code, state)  # The window closed before its timer ran
+            elif state.phase != 'idle':
+                self.stats['ignored'] += 1  # A missed release; start over from this press
+                self._cancel_timer(state)
+
+            state.down_at = timestamp
+            if gestures == {TAP}:
+                state.phase = 'consumed'
+                self._fire(code, TAP, timestamp, timestamp)
+                return
+            state.phase = 'down'
+            if LONG_PRESS in gestures:
+                self._arm(state, timestamp + self.long_press_time, self._long_press_due, code)
+            if TAP in gestures and self.on_speculate:
+                self.stats['speculations'] += 1
+                self.on_speculate(code, timestamp)
+
+    def key_up(self, code, timestamp):
+        with self.lock:
+            state = self.states.get(code)
+            if state is None:
+                return
+            if state.phase != 'down':
+                state.phase = 'idle' if state.phase == 'consumed' else state.phase
+                return
+            self._cancel_timer(state)
+            gestures = self.keys[code]
+            if LONG_PRESS in gestures and timestamp - state.down_at >= self.long_press_time:
+                # The timer was late, but the timestamps show it was a long press
+                state.phase = 'idle'
+                self._fire(code, LONG_PRESS, state.down_at, timestamp)
+            elif DOUBLE_TAP in gestures:
+                state.phase = 'released'
+                state.up_at = timestamp
+                self._arm(state, timestamp + self.double_tap_window, self._tap_due, code)
+            else:
+                state.phase = 'idle'
+                if TAP in gestures:
+                    self._fire(code, TAP, state.down_at, timestamp)
+
+    def cancel(self):
+        """Drop pending timers, e.g. on shutdown"""
+        with self.lock:
+            for state in self.states.values():
+                self._cancel_timer(state)
+                state.phase = 'idle'
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, recognition_ms=self.recognition.summary())
+
+    def _flush_other_keys(self, code, timestamp):
+        """A press on another key ends any double-tap window still open"""
+        for other, state in self.states.items():
+            if other != code and state.phase == 'released':
+                self._cancel_timer(state)
+                self._fire_pending_tap(other, state)
+
+    def _fire_pending_tap(self, code, state):
+        state.phase = 'idle'
+        if TAP in self.keys[code]:
+            self._fire(code, TAP, state.down_at, state.up_at + self.double_tap_window)
+
+    def _fire(self, code, gesture, started, decided):
+        """decided is the event time the gesture became certain"""
+        recognition_ms = max(0.0, decided - started) * 1000
+        self.stats[gesture] += 1
+        self.recognition.record(recognition_ms)
+        log.debug(f"Key {code}: {gesture} (recognized after {recognition_ms:.0f} ms)")
+        self.on_gesture(code, gesture, started, recognition_ms)
+
+    def _arm(self, state, deadline, callback, code):
+        handle = self.call_later(max(0.0, deadline - self.clock()), callback, code, state.down_at)
+        state.timer = handle
+
+    def _cancel_timer(self, state):
+        if state.timer is not None:
+            state.timer.cancel()
+            state.timer = None
+
+    def _long_press_due(self, code, down_at):
+        with self.lock:
+            state = self.states[code]
+            if state.phase != 'down' or state.down_at != down_at:
+                return  # Released or pressed again since the timer was set
+            state.timer = None
+            state.phase = 'consumed'
+            self._fire(code, LONG_PRESS, down_at, down_at + self.long_press_time)
+
+    def _tap_due(self, code, down_at):
+        with self.lock:
+            state = self.states[code]
+            if state.phase != 'released' or state.down_at != down_at:
+                return
+            state.timer = None
+            self._fire_pending_tap(code, state)
@@ -0,0 +1,288 @@
+"""
+GPIO Backends
+Drives the USB switch optocouplers through RPi.GPIO, the kernel GPIO character
+device (libgpiod) or an in-memory fake. pulse() never blocks the caller: it
+raises the line and hands the falling edge to one pulse thread, which sleeps
+until just before the deadline and spins the rest, at real-time priority where
+allowed. Every backend measures the pulse widths it actually produced.
+"""
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+from latency import LatencyHistogram
+
+try:
+    import RPi.GPIO as GPIO
+except ImportError:  # Not a Pi, or only libgpiod is installed
+    GPIO = None
+
+try:
+    import gpiod
+except ImportError:
+    gpiod = None
+
+log = logging.getLogger('macropad.gpio')
+
+GPIO_CHIP = '/dev/gpiochip0'
+CONSUMER = 'macropad-usb-switch'
+SPIN_MARGIN = 0.001  # Seconds before a falling edge to stop sleeping and spin
+PULSE_PRIORITY = 10  # SCHED_FIFO priority of the pulse thread (needs root)
+
+
+class GPIOError(Exception):
+    pass
+
+
+class PulseHandle:
+    """A scheduled pulse; wait() returns once the line is low again"""
+
+    def __init__(self, pin, width):
+        self.pin = pin
+        self.width = width
+        self.started = None
+        self.ended = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        """True if the pulse completed without error within timeout"""
+        return self.done.wait(timeout) and self.error is None
+
+    @property
+    def measured(self):
+        """Width actually produced in seconds, or None while the pulse is incomplete"""
+        if self.started is None or self.ended is None:
+            return None
+        return self.ended - self.started
+
+
+class GPIOBackend:
+    """Pulse scheduling and measurement; subclasses implement setup_pins, write and release"""
+    name = 'base'
+
+    def __init__(self):
+        self.pins = []
+        self.write_lock = threading.Lock()
+        self.cond = threading.Condition()
+        self.queue = []  # (falling edge deadline, sequence, PulseHandle)
+        self.sequence = itertools.count()
+        self.running = False
+        self.thread = None
+        self.widths = {}  # pin -> LatencyHistogram of measured widths (ms)
+        self.stats = {'pulses': 0, 'failed': 0, 'max_error_ms': 0.0}
+
+    def setup(self, pins):
+        """Claim pins as outputs driven low and start the pulse thread"""
+        self.pins = list(pins)
+        self.setup_pins(self.pins)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='gpio-pulse', daemon=True)
+        self.thread.start()
+
+    def output(self, pin, high):
+        with self.write_lock:
+            self.write(pin, high)
+
+    def pulse(self, pin, width):
+        """Raise pin now and schedule it low after width seconds; returns a PulseHandle"""
+        handle = PulseHandle(pin, width)
+        try:
+            self.output(pin, True)
+        except Exception as e:
+            handle.error = e
+            self.stats['failed'] += 1
+            handle.done.set()
+            return handle
+        handle.started = time.monotonic()
+        with self.cond:
+            heapq.heappush(self.queue, (handle.started + width, next(self.sequence), handle))
+            self.cond.notify()
+        return handle
+
+    def snapshot(self):
+        """Counters plus measured pulse widths per pin"""
+        return dict(
+            self.stats,
+            backend=self.name,
+            widths_ms={pin: histogram.summary() for pin, histogram in self.widths.items()},
+        )
+
+    def close(self):
+        """Finish pulses already started, drive every pin low and release them"""
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=5)
+        with self.write_lock:
+            for pin in self.pins:
+                self.write(pin, False)
+            self.release()
+
+    def raise_priority(self):
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(PULSE_PRIORITY))
+            log.info(f"GPIO pulse thread running at SCHED_FIFO priority {PULSE_PRIORITY}")
+        except (AttributeError, OSError) as e:
+            log.info(f"GPIO pulse thread at normal priority: {e}")
+
+    def _run(self):
+        self.raise_priority()
+        while True:
+            with self.cond:
+                while self.running and not self.queue:
+                    self.cond.wait()
+                if not self.queue:
+                    return
+                deadline, _, handle = self.queue[0]
+                remaining = deadline - time.monotonic()
+                if remaining > SPIN_MARGIN:
+                    self.cond.wait(remaining - SPIN_MARGIN)
+                    continue  # An earlier pulse may have been queued meanwhile
+                heapq.heappop(self.queue)
+            while time.monotonic() < deadline:
+                pass  # Spin the last SPIN_MARGIN; sleep wake-ups jitter by more than that
+            self._end_pulse(handle)
+
+    def _end_pulse(self, handle):
+        try:
+            self.output(handle.pin, False)
+        except Exception as e:
+            handle.error = e
+            self.stats['failed'] += 1
+        handle.ended = time.monotonic()
+
+        width_ms = handle.measured * 1000
+        histogram = self.widths.setdefault(handle.pin, LatencyHistogram())
+        histogram.record(width_ms)
+        error_ms = abs(width_ms - handle.width * 1000)
+        self.stats['pulses'] += 1
+        self.stats['max_error_ms'] = round(max(self.stats['max_error_ms'], error_ms), 3)
+        handle.done.set()
+
+    def setup_pins(self, pins):
+        raise NotImplementedError
+
+    def write(self, pin, high):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+
+class RPiGPIOBackend(GPIOBackend):
+    """RPi.GPIO with BCM numbering"""
+    name = 'rpi'
+
+    def setup_pins(self, pins):
+        if GPIO is None:
+            raise GPIOError('RPi.GPIO is not installed')
+        GPIO.setmode(GPIO.BCM)
+        for pin in pins:
+            GPIO.setup(pin, GPIO.OUT, initial=GPIO.LOW)
+
+    def write(self, pin, high):
+        GPIO.output(pin, GPIO.HIGH if high else GPIO.LOW)
+
+    def release(self):
+        GPIO.cleanup(self.pins)
+
+
+class GpiodBackend(GPIOBackend):
+    """
+    Kernel GPIO character device through the libgpiod bindings (2.x or 1.x)
+    Works against a gpio-sim chip as well as the Pi's own gpiochip.
+    """
+    name = 'gpiod'
+
+    def __init__(self, chip=GPIO_CHIP):
+        super().__init__()
+        self.chip_path = chip
+        self.request = None
+        self.chip = None
+        self.lines = {}
+
+    def setup_pins(self, pins):
+        if gpiod is None:
+            raise GPIOError('gpiod is not installed')
+        if hasattr(gpiod, 'request_lines'):
+            from gpiod.line import Direction, Value
+            self.values = {True: Value.ACTIVE, False: Value.INACTIVE}
+            settings = gpiod.LineSettings(direction=Direction.OUTPUT, output_value=Value.INACTIVE)
+            self.request = gpiod.request_lines(
+                self.chip_path, consumer=CONSUMER, config={tuple(pins): settings}
+            )
+        else:
+            self.chip = gpiod.Chip(self.chip_path)
+            for pin in pins:
+                line = self.chip.get_line(pin)
+                line.request(consumer=CONSUMER, type=gpiod.LINE_REQ_DIR_OUT, default_vals=[0])
+                self.lines[pin] = line
+
+    def write(self, pin, high):
+        if self.request:
+            self.request.set_value(pin, self.values[high])
+        else:
+            self.lines[pin].set_value(1 if high else 0)
+
+    def release(self):
+        if self.request:
+            self.request.release()
+            self.request = None
+        for line in self.lines.values():
+            line.release()
+        self.lines = {}
+        if self.chip:
+            self.chip.close()
+            self.chip = None
+
+
+class FakeGPIOBackend(GPIOBackend):
+    """In-memory lines; history holds (pin, high, monotonic time) for every write"""
+    name = 'fake'
+
+    def __init__(self, write_latency=0.0):
+        super().__init__()
+        self.write_latency = write_latency
+        self.levels = {}
+        self.history = []
+
+    def setup_pins(self, pins):
+        for pin in pins:
+            self.levels[pin] = False
+
+    def write(self, pin, high):
+        if pin not in self.levels:
+            raise GPIOError(f'GPIO {pin} has not been set up as an output')
+        if self.write_latency:
+            time.sleep(self.write_latency)
+        self.levels[pin] = high
+        self.history.append((pin, high, time.monotonic()))
+
+    def release(self):
+        self.levels.clear()
+
+
+def open_backend(pins, prefer='auto', chip=GPIO_CHIP):
+    """Set up pins on a backend: 'rpi', 'gpiod', 'fake', or 'auto' (RPi.GPIO, then gpiod)"""
+    names = ['rpi', 'gpiod'] if prefer == 'auto' else [prefer]
+    errors = []
+    for name in names:
+        if name == 'rpi':
+            backend = RPiGPIOBackend()
+        elif name == 'gpiod':
+            backend = GpiodBackend(chip)
+        elif name == 'fake':
+            backend = FakeGPIOBackend()
+        else:
+            raise GPIOError(f'Unknown GPIO backend: {name}')
+        try:
+            backend.setup(pins)
+            return backend
+        except Exception as e:
+            errors.append(f'{name}: {e}')
+    raise GPIOError('; '.join(errors))
@@ -5,23 +5,21 @@ Listens for rotary encoder events and publishes to MQTT for Home Assistant
 """
 
 import evdev
+import json
 import logging
-from logging.handlers import RotatingFileHandler
-import paho.mqtt.client as mqtt
 import signal
 import sys
 import threading
+import time
+from collections import deque
 
-# Configure logging
-log_handler = RotatingFileHandler(
-    "/var/log/hue_lightstrip_encoder.log", maxBytes=1024 * 1024, backupCount=3
-)
-console_handler = logging.StreamHandler()
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[log_handler, console_handler],
-)
+import input_devices
+import log_setup
+from latency import STATS_DIR, LatencyHistogram, LatencyStats, StatsDumper, Trace
+from mqtt_publisher import MQTTPublisher
+from scheduler import Scheduler
+
+log = logging.getLogger("macropad.encoder")
 
 # MQTT Configuration
 MQTT_BROKER = "YOUR_MQTT_BROKER_IP"  # e.g., "192.168.1.100"
@@ -29,6 +27,22 @@ MQTT_PORT = 1883
 MQTT_USER = "your-mqtt-username"
 MQTT_PASSWORD = "your-mqtt-password"
 MQTT_TOPIC = "office/desk-lightstrip/brightness"
+MQTT_QOS = 0  # 1 survives a dropped connection, but a resent delta is applied twice
+
+# Brightness mode: "relative" publishes each batch as a +/- percentage to
+# MQTT_TOPIC. "absolute" keeps a local 0-100 model, synced from the light's
+# state topic, and publishes target percentages to MQTT_SET_TOPIC.
+BRIGHTNESS_MODE = "relative"
+MQTT_STATE_TOPIC = "office/desk-lightstrip/state"
+MQTT_SET_TOPIC = "office/desk-lightstrip/brightness/set"
+ECHO_TIMEOUT = 2.0  # seconds a sent target may take to come back on the state topic
+
+# Round-trip probe: times each brightness message to the broker's ack and to the
+# light's next state change on MQTT_STATE_TOPIC ("probe" in the stats file)
+LATENCY_PROBE = False
+PROBE_QOS = 1  # absolute targets go out at QoS 1 while probing, so the broker acks them;
+               # relative deltas keep MQTT_QOS, since a resent delta would be applied twice
+PROBE_TIMEOUT = 5.0  # seconds before an unanswered message counts as a timeout
 
 # Encoder device path
 ENCODER_DEVICE = (
@@ -36,85 +50,498 @@ ENCODER_DEVICE = (
 )
 
 # Batching configuration
-BATCH_DELAY = 0.3  # seconds to wait before sending accumulated value
+MAX_SEND_RATE = 2.5  # max messages per second while spinning (Hue fades over 400 ms anyway)
 STEP_SIZE = 5  # brightness percentage per encoder click
+# Acceleration: (max seconds between clicks, step multiplier), fastest first
+ACCELERATION = ((0.05, 3), (0.1, 2))
+VELOCITY_WINDOW = 0.3  # a longer gap between clicks starts a new turn at normal speed
+QUIET_TIME = 0.05  # seconds the encoder must be still before a turn's clicks are sent
 
 
-def main():
-    mqtt_client = None
-    device = None
-    accumulated_steps = 0
-    batch_timer = None
-    lock = threading.Lock()
-
-    def send_accumulated():
-        nonlocal accumulated_steps
-        with lock:
-            if accumulated_steps != 0:
-                total_change = accumulated_steps * STEP_SIZE
-                logging.info(f"Sending batched brightness change: {total_change}%")
-                mqtt_client.publish(MQTT_TOPIC, str(total_change))
-                accumulated_steps = 0
-
-    def handle_encoder_event(direction):
-        nonlocal accumulated_steps, batch_timer
-        with lock:
-            accumulated_steps += direction
-            logging.info(
-                f"Encoder {'CW' if direction > 0 else 'CCW'} (accumulated: {accumulated_steps})"
+# Log file (rotated at 1MB, 3 backups)
+LOG_FILE = "/var/log/hue_lightstrip_encoder.log"
+# Per-subsystem verbosity, e.g. {"encoder": "WARNING", "mqtt": "DEBUG"}
+LOG_LEVELS = {}
+
+
+def setup_logging(log_file=LOG_FILE, levels=LOG_LEVELS):
+    """Log through the queued pipeline: rotated at 1MB with 3 backups, written in batches"""
+    return log_setup.setup(log_file, levels)
+
+
+def encoder_direction(event):
+    """Map an evdev event to +1 (CW) / -1 (CCW), or None if it isn't an encoder click"""
+    if event.type == evdev.ecodes.EV_KEY and event.value == 1:
+        if event.code == evdev.ecodes.KEY_BRIGHTNESSUP:
+            return 1
+        elif event.code == evdev.ecodes.KEY_BRIGHTNESSDOWN:
+            return -1
+    return None
+
+
+def connect_mqtt(start=True):
+    """
+    Start the MQTT publisher; it connects, and reconnects, in the background
+    With start=False the caller starts it, e.g. after another user sets a will.
+    """
+    publisher = MQTTPublisher(MQTT_BROKER, MQTT_PORT, MQTT_USER, MQTT_PASSWORD, qos=MQTT_QOS)
+    return publisher.start() if start else publisher
+
+
+def clamp_brightness(level):
+    return max(0, min(100, level))
+
+
+def parse_brightness(payload):
+    """
+    Brightness percentage from a state message, or None if it carries none
+    Accepts a bare number (0-100) or JSON with brightness_pct, Home Assistant's
+    0-255 brightness, or state OFF.
+    """
+    try:
+        state = json.loads(payload)
+    except ValueError:
+        return None
+    if isinstance(state, dict):
+        if state.get("state") == "OFF":
+            return 0
+        if state.get("brightness_pct") is not None:
+            state = state["brightness_pct"]
+        elif state.get("brightness") is not None:
+            state = state["brightness"] * 100 / 255
+    if isinstance(state, bool) or not isinstance(state, (int, float)):
+        return None
+    return clamp_brightness(round(state))
+
+
+class BrightnessModel:
+    """
+    Local copy of the light's brightness for absolute mode
+    Each batch moves the model and publishes the resulting target, so a lost or
+    reordered message can't make the light drift, and a target still waiting in
+    the outbox is replaced by a newer one. State messages that echo a target we
+    sent are ignored; anything else is an external change and resyncs the model.
+    qos applies to the targets only: a delta sent before the first state message
+    keeps the publisher's QoS, as a resent delta would be applied twice.
+    """
+
+    def __init__(self, publisher, set_topic=MQTT_SET_TOPIC, state_topic=MQTT_STATE_TOPIC,
+                 echo_timeout=ECHO_TIMEOUT, qos=None):
+        self.publisher = publisher
+        self.set_topic = set_topic
+        self.state_topic = state_topic
+        self.echo_timeout = echo_timeout
+        self.qos = qos
+        self.level = None  # Unknown until the first state message
+        self.pending = deque()  # (target, monotonic send time) awaiting their echo
+        self.lock = threading.Lock()
+        self.stats = {"targets": 0, "unchanged": 0, "echoes": 0, "resyncs": 0, "relative_fallback": 0}
+
+    def start(self):
+        self.publisher.subscribe(self.state_topic, self.on_state)
+        return self
+
+    def publish_change(self, change):
+        """Apply a batched change to the model and publish the new target"""
+        with self.lock:
+            if self.level is None:
+                # No state seen yet, so there is nothing to add the change to
+                self.stats["relative_fallback"] += 1
+                self.publisher.publish_delta(MQTT_TOPIC, change)
+                return
+            target = clamp_brightness(self.level + change)
+            if target == self.level:
+                self.stats["unchanged"] += 1  # Already at 0 or 100
+                return
+            self.level = target
+            self.pending.append((target, time.monotonic()))
+            self.stats["targets"] += 1
+            self.publisher.publish(self.set_topic, str(target), self.qos)
+
+    def on_state(self, message):
+        """State topic handler: drop our own echoes, resync on anything else"""
+        level = parse_brightness(message.payload)
+        if level is None:
+            return
+        now = time.monotonic()
+        with self.lock:
+            while self.pending and now - self.pending[0][1] > self.echo_timeout:
+                self.pending.popleft()
+            for i, (target, _) in enumerate(self.pending):
+                if abs(target - level) <= 1:  # 0-255 round trips can be off by one
+                    for _ in range(i + 1):
+                        self.pending.popleft()
+                    self.stats["echoes"] += 1
+                    return
+            self.pending.clear()
+            if level != self.level:
+                if self.level is None:
+                    log.info(f"Brightness synced from {self.state_topic}: {level}%")
+                else:
+                    log.info(f"Brightness changed outside the encoder: {self.level}% -> {level}%")
+                self.level = level
+                self.stats["resyncs"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, level=self.level, pending=len(self.pending))
+
+
+class RoundTripProbe:
+    """
+    Times each brightness message past our own batching
+    Every message that goes out on a brightness topic gets a sequence number
+    and its send time, kept here by MQTT message id so the payloads stay the
+    bare numbers the automation expects. The broker's PUBACK completes its
+    publish-to-ack time; the light's next brightness change on the state topic
+    its publish-to-state-change time. A change to the level a message asked
+    for also completes older messages still waiting, as it carries them too.
+    """
+
+    def __init__(self, publisher, relative_topic=MQTT_TOPIC, set_topic=MQTT_SET_TOPIC,
+                 state_topic=MQTT_STATE_TOPIC, timeout=PROBE_TIMEOUT):
+        self.publisher = publisher
+        self.relative_topic = relative_topic
+        self.set_topic = set_topic
+        self.state_topic = state_topic
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.unacked = {}  # mid -> (sequence, sent_at)
+        self.early_acks = {}  # mid -> acked_at, for acks that beat their sent() call
+        self.awaiting_state = deque()  # (sequence, sent_at, expected level or None), oldest first
+        self.level = None  # Last brightness seen on the state topic
+        self.ack_ms = LatencyHistogram()
+        self.state_ms = LatencyHistogram()
+        self.stats = {"sent": 0, "acked": 0, "ack_timeouts": 0, "state_changes": 0,
+                      "state_timeouts": 0, "no_change_expected": 0}
+
+    def start(self):
+        self.publisher.watch_publishes(self.on_sent, self.on_acked)
+        self.publisher.subscribe(self.state_topic, self.on_state)
+        return self
+
+    def on_sent(self, topic, payload, mid, qos, sent_at):
+        with self.lock:
+            acked_at = self.early_acks.pop(mid, None)
+            if topic not in (self.relative_topic, self.set_topic):
+                return
+            self.sequence += 1
+            self.stats["sent"] += 1
+            if qos > 0:
+                if acked_at is None:
+                    self.unacked[mid] = (self.sequence, sent_at)
+                else:
+                    self._record_ack(self.sequence, (acked_at - sent_at) * 1000)
+            # Messages still in flight come first: the light starts from where they leave it
+            base = self.awaiting_state[-1][2] if self.awaiting_state else self.level
+            expected = self._expected(topic, payload, base)
+            if expected is not None and expected == base:
+                self.stats["no_change_expected"] += 1  # e.g. a step up at 100%
+            else:
+                self.awaiting_state.append((self.sequence, sent_at, expected))
+            self._expire(sent_at)
+
+    def on_acked(self, mid, acked_at):
+        with self.lock:
+            entry = self.unacked.pop(mid, None)
+            if entry is None:
+                self.early_acks[mid] = acked_at
+                return
+            self._record_ack(entry[0], (acked_at - entry[1]) * 1000)
+
+    def on_state(self, message):
+        level = parse_brightness(message.payload)
+        if level is None:
+            return
+        now = time.monotonic()
+        with self.lock:
+            self._expire(now)
+            if level == self.level:
+                return
+            self.level = level
+            if not self.awaiting_state:
+                return
+            # The newest message asking for this level, or else the oldest waiting one
+            matched = 0
+            for i, (_, _, expected) in enumerate(self.awaiting_state):
+                if expected is not None and abs(expected - level) <= 1:
+                    matched = i
+            for _ in range(matched + 1):
+                sequence, sent_at, _ = self.awaiting_state.popleft()
+                ms = (now - sent_at) * 1000
+                self.state_ms.record(ms)
+                self.stats["state_changes"] += 1
+                log.debug(f"Probe #{sequence}: light at {level}% {ms:.0f} ms after the publish")
+
+    def _expected(self, topic, payload, base):
+        """Brightness the light should end up at, when it can be told"""
+        try:
+            value = int(payload)
+        except ValueError:
+            return None
+        if topic == self.set_topic:
+            return clamp_brightness(value)
+        return None if base is None else clamp_brightness(base + value)
+
+    def _record_ack(self, sequence, ms):
+        self.ack_ms.record(ms)
+        self.stats["acked"] += 1
+        log.debug(f"Probe #{sequence}: acked {ms:.1f} ms after the publish")
+
+    def _expire(self, now):
+        """Count messages unanswered for timeout seconds as timed out; the caller holds the lock"""
+        cutoff = now - self.timeout
+        for mid, (_, sent_at) in list(self.unacked.items()):
+            if sent_at < cutoff:
+                del self.unacked[mid]
+                self.stats["ack_timeouts"] += 1
+        for mid, acked_at in list(self.early_acks.items()):
+            if acked_at < cutoff:
+                del self.early_acks[mid]  # Acks for messages on other topics
+        while self.awaiting_state and self.awaiting_state[0][1] < cutoff:
+            self.awaiting_state.popleft()
+            self.stats["state_timeouts"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            self._expire(time.monotonic())
+            return dict(
+                self.stats,
+                last_sequence=self.sequence,
+                unacked=len(self.unacked),
+                awaiting_state=len(self.awaiting_state),
+                ack_ms=self.ack_ms.summary(),
+                state_ms=self.state_ms.summary(),
+            )
+
+
+def brightness_publisher(publisher):
+    """The batcher's publish callback for BRIGHTNESS_MODE, and the BrightnessModel if absolute"""
+    if BRIGHTNESS_MODE == "absolute":
+        # Repeating a target is harmless, so the probe can have it acked
+        model = BrightnessModel(publisher, qos=PROBE_QOS if LATENCY_PROBE else None).start()
+        return model.publish_change, model
+    return (lambda change: publisher.publish_delta(MQTT_TOPIC, change)), None
+
+
+def latency_probe(publisher):
+    """A started RoundTripProbe when LATENCY_PROBE is on, otherwise None"""
+    return RoundTripProbe(publisher).start() if LATENCY_PROBE else None
+
+
+class EncoderBatcher:
+    """
+    Turns encoder clicks into brightness changes that feel instant without flooding MQTT.
+    A turn's clicks go out once the encoder has been still for quiet_time, so
+    a single click or a short spin is one message, sent just after it ends.
+    A longer spin is flushed at most max_send_rate times a second as it goes,
+    and fast rotation multiplies the step size. Velocity and the send rate are
+    measured on the evdev event timestamps (clock must match them), so a late
+    read or a late timer can't add messages. call_later(delay, callback) must
+    return a handle with cancel(), so the deadline can run on a Scheduler or
+    an asyncio event loop.
+    """
+
+    def __init__(
+        self,
+        publish,
+        call_later,
+        max_send_rate=MAX_SEND_RATE,
+        step_size=STEP_SIZE,
+        acceleration=ACCELERATION,
+        latency=None,
+        quiet_time=QUIET_TIME,
+        clock=time.time,
+    ):
+        self.publish = publish
+        self.call_later = call_later
+        self.min_interval = 1.0 / max_send_rate
+        self.step_size = step_size
+        self.acceleration = acceleration
+        self.latency = latency
+        self.quiet_time = quiet_time
+        self.clock = clock
+        self.accumulated_change = 0
+        self.batch_start = None  # Event time of the first click not sent yet
+        self.last_send = None
+        self.last_click_time = None
+        self.last_direction = 0
+        self.click_interval = None  # Smoothed seconds between clicks of the current turn
+        self.flush_timer = None
+        self.trace = None
+        self.lock = threading.Lock()
+        self.stats = {"clicks": 0, "messages": 0, "after_pause": 0, "while_turning": 0}
+
+    def step_for(self, direction, event_time, gap):
+        """Step size for one click, scaled by how fast the encoder is turning"""
+        if direction == self.last_direction and gap is not None and 0 <= gap < VELOCITY_WINDOW:
+            self.click_interval = gap if self.click_interval is None else (self.click_interval + gap) / 2
+        else:
+            self.click_interval = None
+        self.last_click_time = event_time
+        self.last_direction = direction
+
+        if self.click_interval is not None:
+            for max_interval, multiplier in self.acceleration:
+                if self.click_interval <= max_interval:
+                    return self.step_size * multiplier
+        return self.step_size
+
+    def _due(self):
+        """Event time the pending batch goes out; the caller holds the lock"""
+        due = min(self.last_click_time + self.quiet_time, self.batch_start + self.min_interval)
+        if self.last_send is not None:
+            due = max(due, self.last_send + self.min_interval)
+        return due
+
+    def _schedule(self):
+        self.flush_timer = self.call_later(max(0.0, self._due() - self.clock()), self.send_accumulated)
+
+    def _send(self):
+        """Publish the accumulated change; the caller holds the lock"""
+        total_change, self.accumulated_change = self.accumulated_change, 0
+        self.batch_start = None
+        self.last_send = self.clock()
+        self.stats["messages"] += 1
+        log.info(f"Sending batched brightness change: {total_change}%")
+        trace, self.trace = self.trace, None
+        if trace:
+            trace.mark("batch_wait")
+            with trace.stage("mqtt_publish"):
+                self.publish(total_change)
+            trace.finish(self.latency)
+        else:
+            self.publish(total_change)
+
+    def send_accumulated(self):
+        """Flush deadline: publish the batch, or wait on if clicks came in since it was set"""
+        with self.lock:
+            self.flush_timer = None
+            if self.batch_start is None:
+                return
+            if self._due() - self.clock() > 0.001:
+                self._schedule()
+                return
+            if self.accumulated_change == 0:
+                self.batch_start = self.trace = None  # Clicks that cancelled out
+                return
+            paused = self.clock() - self.last_click_time >= self.quiet_time
+            self.stats["after_pause" if paused else "while_turning"] += 1
+            self._send()
+
+    def handle_encoder_event(self, direction, event_time=None):
+        """Count one click; event_time is the evdev timestamp, used for velocity, the send rate and latency"""
+        if event_time is None:
+            event_time = self.clock()
+        with self.lock:
+            self.stats["clicks"] += 1
+            if self.latency and self.trace is None:
+                # The batch's latency is measured from its first click
+                self.trace = Trace("brightness", event_time)
+            gap = None if self.last_click_time is None else event_time - self.last_click_time
+            self.accumulated_change += direction * self.step_for(direction, event_time, gap)
+            log.info(
+                f"Encoder {'CW' if direction > 0 else 'CCW'} (accumulated: {self.accumulated_change}%)"
             )
+            if self.batch_start is None:
+                self.batch_start = event_time
+            if self.flush_timer is None:
+                self._schedule()  # A later click only moves the deadline, checked when it fires
+
+    def snapshot(self):
+        """Counters, including MQTT messages sent per click"""
+        with self.lock:
+            stats = dict(self.stats)
+        stats["messages_per_click"] = round(stats["messages"] / stats["clicks"], 3) if stats["clicks"] else 0.0
+        return stats
+
+    def cancel(self):
+        with self.lock:
+            if self.flush_timer:
+                self.flush_timer.cancel()
+                self.flush_timer = None
 
-            # Cancel existing timer and start a new one
-            if batch_timer:
-                batch_timer.cancel()
-            batch_timer = threading.Timer(BATCH_DELAY, send_accumulated)
-            batch_timer.start()
+
+def main():
+    setup_logging()
+    publisher = None
+    device = None
+    batcher = None
+    model = None
+    probe = None
+    latency = LatencyStats()
+    # One thread owns every flush deadline, instead of a threading.Timer per batch
+    scheduler = Scheduler("encoder-flush").start()
+    stats_dumper = StatsDumper(
+        f"{STATS_DIR}/hue_lightstrip_encoder.json",
+        {
+            "latency": latency.snapshot,
+            "encoder": lambda: batcher.snapshot() if batcher else {},
+            "scheduler": lambda: dict(scheduler.stats),
+            "mqtt": lambda: publisher.snapshot() if publisher else {},
+            "brightness": lambda: model.snapshot() if model else {},
+            "probe": lambda: probe.snapshot() if probe else {},
+            "logging": log_setup.snapshot,
+        },
+    )
 
     def cleanup(sig=None, frame=None):
-        nonlocal batch_timer
-        logging.info("Shutting down...")
-        if batch_timer:
-            batch_timer.cancel()
+        log.info("Shutting down...")
+        # Stopping the scheduler first means no flush can race the MQTT disconnect
+        scheduler.stop()
+        stats_dumper.stop()
+        if batcher:
+            batcher.cancel()
         if device:
             device.close()
-        if mqtt_client:
-            mqtt_client.loop_stop()
-            mqtt_client.disconnect()
+        if publisher:
+            publisher.stop()
         sys.exit(0)
 
     signal.signal(signal.SIGINT, cleanup)
     signal.signal(signal.SIGTERM, cleanup)
 
-    # Connect to MQTT
-    try:
-        mqtt_client = mqtt.Client()
-        mqtt_client.username_pw_set(MQTT_USER, MQTT_PASSWORD)
-        mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        mqtt_client.loop_start()
-        logging.info(f"Connected to MQTT broker at {MQTT_BROKER}")
-    except Exception as e:
-        logging.error(f"Failed to connect to MQTT: {e}")
-        return
+    # Connect to MQTT; an unreachable broker is retried while clicks queue up
+    publisher = connect_mqtt()
+    publish, model = brightness_publisher(publisher)
+    probe = latency_probe(publisher)
+
+    batcher = EncoderBatcher(
+        publish,
+        scheduler.call_later,
+        latency=latency,
+    )
 
     # Open encoder device
     try:
         device = evdev.InputDevice(ENCODER_DEVICE)
-        logging.info(f"Listening to encoder: {device.name}")
+        log.info(f"Listening to encoder: {device.name}")
     except Exception as e:
-        logging.error(f"Failed to open encoder device: {e}")
+        log.error(f"Failed to open encoder device: {e}")
         return
 
     # Main event loop
-    logging.info("Hue desk lightstrip brightness controller started (with batching)")
+    log.info(f"Hue desk lightstrip brightness controller started ({BRIGHTNESS_MODE} mode, adaptive batching)")
+    stats_dumper.start()
     try:
-        for event in device.read_loop():
-            if event.type == evdev.ecodes.EV_KEY and event.value == 1:
-                if event.code == evdev.ecodes.KEY_BRIGHTNESSUP:
-                    handle_encoder_event(1)
-                elif event.code == evdev.ecodes.KEY_BRIGHTNESSDOWN:
-                    handle_encoder_event(-1)
+        while True:
+            try:
+                for event in device.read_loop():
+                    direction = encoder_direction(event)
+                    if direction:
+                        batcher.handle_encoder_event(direction, event.timestamp())
+            except OSError as e:
+                # Unplugged: wait for the node to come back instead of exiting
+                log.warning(f"Encoder read failed: {e}, waiting for it to be plugged back in")
+                device.close()
+                device, attach_ms = input_devices.wait_for_device(
+                    lambda: input_devices.open_path(ENCODER_DEVICE), threading.Event()
+                )
+                attach_note = "" if attach_ms is None else f" {attach_ms:.0f} ms after it appeared"
+                log.info(f"Encoder reattached{attach_note}: {device.name}")
     except Exception as e:
-        logging.error(f"Error in event loop: {e}")
+        log.error(f"Error in event loop: {e}")
     finally:
         cleanup()
 
@@ -0,0 +1,204 @@
+"""
+Input Device Attachment
+Finds the macro pad quickly and follows it across unplug/replug. The stable
+/dev/input/by-id path of a found device is cached on disk, so later starts open
+it directly instead of probing every input node. While a device is missing,
+wait_for_device sleeps on inotify events in /dev/input and retries as soon as
+udev creates a node.
+"""
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import time
+
+import evdev
+
+log = logging.getLogger("macropad.devices")
+
+INPUT_DIRS = ("/dev/input", "/dev/input/by-id")
+DEVICE_CACHE = "/var/cache/macropad/input_devices.json"
+REATTACH_POLL = 1.0  # Seconds between retries when no inotify event arrives
+
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+def stable_path(device_path, input_dirs=INPUT_DIRS):
+    """The by-id symlink pointing at a device node, or the node itself"""
+    target = os.path.realpath(device_path)
+    for directory in input_dirs:
+        if not directory.endswith("by-id"):
+            continue
+        try:
+            entries = os.listdir(directory)
+        except OSError:
+            continue
+        for entry in entries:
+            link = os.path.join(directory, entry)
+            if os.path.realpath(link) == target:
+                return link
+    return device_path
+
+
+def load_cache(path):
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(path, cache):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(cache, f, indent=2)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        log.warning(f"Could not save input device cache {path}: {e}")
+
+
+def open_path(path, name=None):
+    """Open path, and keep it only if it is the named device; None otherwise"""
+    try:
+        device = evdev.InputDevice(path)
+    except OSError:
+        return None
+    if name is None or device.name == name:
+        return device
+    device.close()
+    return None
+
+
+def scan(name, fallback_to_keyboard=False):
+    """
+    Probe every input node for the named device
+    Every other node is closed again. With fallback_to_keyboard, the first
+    keyboard-like device is used when the named one isn't present.
+    """
+    found = None
+    keyboards = []
+    for path in evdev.list_devices():
+        device = open_path(path)
+        if device is None:
+            continue
+        if found is None and device.name == name and evdev.ecodes.EV_KEY in device.capabilities():
+            found = device
+            continue
+        if fallback_to_keyboard and evdev.ecodes.EV_KEY in device.capabilities():
+            keyboards.append((device.path, device.name))
+        device.close()
+
+    if found or not keyboards:
+        return found
+
+    log.info("Available keyboard-like devices:")
+    for i, (path, device_name) in enumerate(keyboards):
+        log.info(f"  {i}: {device_name} at {path}")
+    return open_path(keyboards[0][0])
+
+
+def find_device(name, cache_path=DEVICE_CACHE, fallback_to_keyboard=False, input_dirs=INPUT_DIRS):
+    """Open the named device, trying its cached path before scanning every node"""
+    start = time.monotonic()
+    cache = load_cache(cache_path)
+    cached = cache.get(name)
+    if cached:
+        device = open_path(cached, name)
+        if device:
+            log.info(f"Opened {name} from cached path {cached} in "
+                         f"{(time.monotonic() - start) * 1000:.1f} ms")
+            return device
+        log.debug(f"Cached path {cached} for {name} is stale, scanning")
+
+    device = scan(name, fallback_to_keyboard)
+    if device is None:
+        return None
+    log.info(f"Found {device.name} at {device.path} by scanning in "
+                 f"{(time.monotonic() - start) * 1000:.1f} ms")
+    if device.name == name:
+        path = stable_path(device.path, input_dirs)
+        # Right after a replug the by-id link may not exist yet; keep the better path
+        if path != cached and (cached is None or path != device.path):
+            cache[name] = path
+            save_cache(cache_path, cache)
+    return device
+
+
+class DeviceWatcher:
+    """
+    Wakes up when input device nodes appear or change permissions
+    Uses inotify through libc. Where that isn't available wait() just sleeps
+    for the timeout, so callers degrade to polling.
+    """
+
+    def __init__(self, input_dirs=INPUT_DIRS):
+        self.fd = None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            log.warning(f"inotify unavailable, polling for input devices: {e}")
+            return
+        if fd < 0:
+            log.warning(f"inotify_init1 failed ({os.strerror(ctypes.get_errno())}), polling")
+            return
+
+        watched = 0
+        for directory in input_dirs:
+            mask = IN_CREATE | IN_ATTRIB | IN_MOVED_TO
+            if libc.inotify_add_watch(fd, os.fsencode(directory), mask) >= 0:
+                watched += 1
+        if not watched:
+            os.close(fd)
+            return
+        self.fd = fd
+
+    def wait(self, timeout):
+        """Block until a node changes or timeout passes; True if an event arrived"""
+        if self.fd is None:
+            time.sleep(timeout)
+            return False
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            os.read(self.fd, 4096)  # Drain; which node changed doesn't matter
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def wait_for_device(open_device, stop_event, poll=REATTACH_POLL, input_dirs=INPUT_DIRS):
+    """
+    Call open_device() until it returns a device or stop_event is set
+    Returns (device, ms from the first node event to the device being open);
+    the latency is None if the device was opened without waiting for an event.
+    """
+    watcher = DeviceWatcher(input_dirs)  # Before the first try, so no event is missed
+    first_event = None
+    try:
+        while not stop_event.is_set():
+            device = open_device()
+            if device:
+                if first_event is None:
+                    return device, None
+                return device, (time.monotonic() - first_event) * 1000
+            if watcher.wait(poll) and first_event is None:
+                first_event = time.monotonic()
+        return None, None
+    finally:
+        watcher.close()
@@ -0,0 +1,162 @@
+"""
+Latency Instrumentation
+Per-action traces from the kernel's evdev timestamp to completion, rolling
+per-stage histograms, and a periodic JSON dump of the resulting percentiles.
+Recording a sample is a deque append; percentiles are only computed when the
+stats are dumped, so the hot path stays cheap.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+log = logging.getLogger("macropad.stats")
+
+STATS_DIR = "/run/macropad"  # tmpfs: dumps don't wear the SD card
+STATS_INTERVAL = 30.0
+HISTOGRAM_WINDOW = 500  # Most recent samples kept per action/stage
+
+
+def percentile(sorted_samples, fraction):
+    index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+class LatencyHistogram:
+    """Rolling window of latency samples in milliseconds"""
+
+    def __init__(self, window=HISTOGRAM_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+
+    def record(self, ms):
+        self.samples.append(ms)
+        self.count += 1
+
+    def summary(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "p50": round(percentile(samples, 0.50), 2),
+            "p95": round(percentile(samples, 0.95), 2),
+            "p99": round(percentile(samples, 0.99), 2),
+            "max": round(samples[-1], 2),
+        }
+
+
+class LatencyStats:
+    """Histograms keyed by action and stage"""
+
+    def __init__(self, window=HISTOGRAM_WINDOW):
+        self.window = window
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def record(self, action, stage, ms):
+        histogram = self.histograms.get((action, stage))
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(
+                    (action, stage), LatencyHistogram(self.window)
+                )
+        histogram.record(ms)
+
+    def snapshot(self):
+        with self.lock:
+            items = list(self.histograms.items())
+        result = {}
+        for (action, stage), histogram in items:
+            result.setdefault(action, {})[stage] = histogram.summary()
+        return result
+
+
+class Trace:
+    """
+    Stage timings of one action
+    The origin is the kernel event time when known (evdev timestamps are
+    CLOCK_REALTIME, so they are mapped onto the monotonic clock once here).
+    """
+
+    def __init__(self, action, event_time=None):
+        now = time.monotonic()
+        self.action = action
+        self.origin = now if event_time is None else now - max(0.0, time.time() - event_time)
+        self.stages = []
+
+    def mark(self, stage):
+        """Record the time from the origin to now as a stage (e.g. dispatch)"""
+        self.stages.append((stage, (time.monotonic() - self.origin) * 1000))
+
+    def record(self, stage, ms):
+        """Record a stage measured elsewhere (e.g. a hardware pulse width)"""
+        self.stages.append((stage, ms))
+
+    @contextmanager
+    def stage(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.stages.append((name, (time.monotonic() - start) * 1000))
+
+    def finish(self, stats):
+        """Record every stage plus the total from the origin into stats"""
+        total_ms = (time.monotonic() - self.origin) * 1000
+        for name, ms in self.stages:
+            stats.record(self.action, name, ms)
+        stats.record(self.action, "total", total_ms)
+        return total_ms
+
+
+def trace_stage(trace, name):
+    """Time a stage on trace, or do nothing when there's no trace"""
+    return trace.stage(name) if trace else nullcontext()
+
+
+class StatsDumper:
+    """Periodically writes the output of named stats providers to a JSON file"""
+
+    def __init__(self, path, providers, interval=STATS_INTERVAL):
+        self.path = path
+        self.providers = providers
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="stats-dump", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout=5)
+            self.dump()
+
+    def collect(self):
+        stats = {"time": time.time()}
+        for name, provider in self.providers.items():
+            try:
+                stats[name] = provider()
+            except Exception as e:
+                stats[name] = {"error": str(e)}
+        return stats
+
+    def dump(self):
+        """Write the stats atomically so readers never see a partial file"""
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.collect(), f, indent=2, default=str)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warning(f"Could not write stats to {self.path}: {e}")
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.dump()
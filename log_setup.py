@@ -0,0 +1,266 @@
+"""
+Logging Pipeline
+Keeps log writes off the hot path. Loggers only put records on a bounded
+queue; one writer thread formats them, keeps the most recent events in an
+in-memory ring buffer and appends to the log file in batches, so a key press
+never waits on the SD card or on log rotation. Each subsystem logs to its own
+"macropad.<subsystem>" logger whose level can be changed while running.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from logging.handlers import QueueHandler
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+LOG_QUEUE_SIZE = 10000  # Records beyond this are dropped and counted, never waited on
+LOG_RING_SIZE = 200  # Recent structured events kept in memory for the stats file
+LOG_FLUSH_INTERVAL = 5.0  # Seconds between batched writes; WARNING and above are written at once
+LOG_MAX_BYTES = 1024 * 1024  # Rotate at 1MB...
+LOG_BACKUPS = 3  # ...keeping 3 old files
+# {"ddc": "DEBUG", "encoder": "WARNING"}; re-read while running when it changes
+LOG_LEVELS_FILE = "/etc/macropad/log_levels.json"
+
+_STOP = object()
+pipeline = None  # The running LogPipeline, once setup() has been called
+
+
+def logger_name(subsystem):
+    return "macropad" if subsystem in ("", "macropad") else f"macropad.{subsystem}"
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Hands records to the writer thread as they are; a full queue drops instead of blocking"""
+
+    def __init__(self, record_queue):
+        super().__init__(record_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record  # Formatting happens on the writer thread
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchFileHandler(logging.Handler):
+    """
+    Appends formatted records to a file, one write per flush()
+    Rotates by size with the same file names as RotatingFileHandler.
+    """
+
+    def __init__(self, path, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUPS):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.pending = []
+        self.stream = open(path, "a", encoding="utf-8")  # Fails at setup, not on the first flush
+        self.stats = {"writes": 0, "bytes": 0, "rotations": 0}
+
+    def emit(self, record):
+        try:
+            self.pending.append(self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        """Write every pending line in a single write"""
+        with self.lock:
+            if not self.pending or self.stream is None:
+                return
+            data = "".join(self.pending)
+            self.pending = []
+            try:
+                size = self.stream.tell()
+                if self.max_bytes and size and size + len(data) > self.max_bytes:
+                    self.rotate()
+                self.stream.write(data)
+                self.stream.flush()
+                self.stats["writes"] += 1
+                self.stats["bytes"] += len(data)
+            except OSError as e:
+                sys.stderr.write(f"Could not write log file {self.path}: {e}\n")
+
+    def rotate(self):
+        self.stream.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backup_count:
+            os.replace(self.path, f"{self.path}.1")
+        self.stream = open(self.path, "w", encoding="utf-8")
+        self.stats["rotations"] += 1
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self.stream:
+                self.stream.close()
+                self.stream = None
+        super().close()
+
+
+class LogPipeline:
+    """
+    Writer thread between the queue and the real handlers
+    Handlers are flushed every flush_interval, or straight away for WARNING and
+    above so problems reach the file even if the process dies shortly after.
+    """
+
+    def __init__(
+        self,
+        handlers,
+        flush_interval=LOG_FLUSH_INTERVAL,
+        ring_size=LOG_RING_SIZE,
+        queue_size=LOG_QUEUE_SIZE,
+        levels_file=LOG_LEVELS_FILE,
+    ):
+        self.queue = queue.Queue(queue_size)
+        self.handler = DroppingQueueHandler(self.queue)
+        self.handlers = handlers
+        self.flush_interval = flush_interval
+        self.recent = deque(maxlen=ring_size)
+        self.recent_lock = threading.Lock()  # Stats dumps copy the ring while the writer appends
+        self.levels_file = levels_file
+        self.levels_mtime = None
+        self.unflushed = 0
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.stats = {"records": 0, "batches": 0, "urgent_flushes": 0}
+
+    def start(self):
+        self.reload_levels()
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        """Write out everything queued, then close the handlers"""
+        if self.thread.is_alive():
+            try:
+                self.queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            self.thread.join(timeout=timeout)
+        for handler in self.handlers:
+            handler.close()
+
+    def set_level(self, subsystem, level):
+        """Change one subsystem's verbosity, e.g. set_level("ddc", "DEBUG")"""
+        logger = logging.getLogger(logger_name(subsystem))
+        logger.setLevel(level.upper() if isinstance(level, str) else level)
+        logging.getLogger("macropad.log").info(
+            f"Log level of {logger.name} set to {logging.getLevelName(logger.level)}"
+        )
+
+    def levels(self):
+        """Explicitly set subsystem levels; the rest inherit the root level"""
+        levels = {"root": logging.getLevelName(logging.getLogger().level)}
+        for name, logger in list(logging.Logger.manager.loggerDict.items()):
+            if name.startswith("macropad") and isinstance(logger, logging.Logger) and logger.level:
+                levels[name] = logging.getLevelName(logger.level)
+        return levels
+
+    def reload_levels(self):
+        """Apply levels_file if it changed since it was last read"""
+        try:
+            mtime = os.stat(self.levels_file).st_mtime
+        except OSError:
+            return
+        if mtime == self.levels_mtime:
+            return
+        self.levels_mtime = mtime
+        try:
+            with open(self.levels_file) as f:
+                levels = json.load(f)
+            for subsystem, level in levels.items():
+                self.set_level(subsystem, level)
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logging.getLogger("macropad.log").warning(f"Ignoring log levels in {self.levels_file}: {e}")
+
+    def snapshot(self):
+        """Counters, current levels and the recent events in the ring buffer"""
+        stats = dict(self.stats, queued=self.queue.qsize(), dropped=self.handler.dropped, levels=self.levels())
+        for handler in self.handlers:
+            if isinstance(handler, BatchFileHandler):
+                stats["file"] = dict(handler.stats)
+        with self.recent_lock:
+            stats["recent"] = list(self.recent)
+        return stats
+
+    def _handle(self, record):
+        self.stats["records"] += 1
+        self.unflushed += 1
+        event = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "subsystem": record.name,
+            "message": record.getMessage(),
+        }
+        with self.recent_lock:
+            self.recent.append(event)
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _flush(self):
+        if not self.unflushed:
+            return
+        self.unflushed = 0
+        self.stats["batches"] += 1
+        for handler in self.handlers:
+            handler.flush()
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                record = self.queue.get(timeout=max(0, next_flush - time.monotonic()))
+            except queue.Empty:
+                record = None
+            if record is _STOP:
+                self._flush()
+                return
+            if record is not None:
+                self._handle(record)
+                if record.levelno >= logging.WARNING:
+                    self.stats["urgent_flushes"] += 1
+                    self._flush()
+            if time.monotonic() >= next_flush:
+                self._flush()
+                self.reload_levels()
+                next_flush = time.monotonic() + self.flush_interval
+
+
+def setup(log_file, levels=None, level=logging.INFO, console=True, levels_file=LOG_LEVELS_FILE):
+    """Route all logging through a LogPipeline writing to log_file; returns the pipeline"""
+    global pipeline
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [BatchFileHandler(log_file)]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    pipeline = LogPipeline(handlers, levels_file=levels_file)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(pipeline.handler)
+    root.setLevel(level)
+    for subsystem, subsystem_level in (levels or {}).items():
+        logging.getLogger(logger_name(subsystem)).setLevel(subsystem_level)
+    atexit.register(pipeline.stop)
+    return pipeline.start()
+
+
+def snapshot():
+    """Stats of the running pipeline, for StatsDumper"""
+    return pipeline.snapshot() if pipeline else {}
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+BNK8 Macro Pad Daemon
+Serves the buttons (monitor + USB switching) and the rotary encoder (Hue
+lightstrip brightness over MQTT) from a single asyncio event loop, replacing
+the separate ddc_switcher and hue_lightstrip_encoder services.
+Button actions go to the switcher's dispatcher thread so a slow monitor switch
+never delays encoder handling, and encoder batching runs on the event loop itself.
+"""
+import asyncio
+import logging
+import signal
+
+import evdev
+
+import hue_lightstrip_encoder as encoder
+import input_devices
+from ddc_switcher import DDCMonitorSwitcher, setup_logging
+from latency import STATS_DIR, LatencyStats, StatsDumper
+
+log = logging.getLogger("macropad.daemon")
+
+LOG_FILE = "/var/log/macropad.log"
+
+
+class MacroPadDaemon:
+    def __init__(self, loop):
+        self.loop = loop
+        self.switcher = DDCMonitorSwitcher(install_signal_handlers=False)
+        # One stats file covers both sides, so the switcher doesn't dump its own
+        self.switcher.stats_file = None
+        # Gesture timers run on the event loop that reads the keys, not a thread of their own
+        self.switcher.gesture_call_later = loop.call_later
+        self.encoder_latency = LatencyStats()
+        providers = self.switcher.stats_providers()
+        providers["encoder_latency"] = self.encoder_latency.snapshot
+        providers["encoder"] = lambda: self.batcher.snapshot() if self.batcher else {}
+        providers["mqtt"] = lambda: self.publisher.snapshot() if self.publisher else {}
+        providers["brightness"] = lambda: self.brightness.snapshot() if self.brightness else {}
+        providers["probe"] = lambda: self.probe.snapshot() if self.probe else {}
+        self.stats_dumper = StatsDumper(f"{STATS_DIR}/macropad.json", providers)
+        self.publisher = None
+        self.brightness = None
+        self.probe = None
+        self.batcher = None
+        self.encoder_device = None
+        self.stopping = asyncio.Event()
+
+    async def serve_buttons(self):
+        """Read macro pad keys and queue them on the switcher's dispatcher"""
+        while True:
+            try:
+                async for event in self.switcher.device.async_read_loop():
+                    if event.type == evdev.ecodes.EV_KEY:
+                        key_event = evdev.categorize(event)
+                        if key_event.keystate == evdev.KeyEvent.key_down:
+                            log.debug(f"Key press: {key_event.keycode}")
+                        self.switcher.handle_key_event(key_event)
+            except OSError as e:
+                log.warning(f"Macro pad read failed: {e}")
+                # The wait blocks on inotify, so it runs off the event loop
+                if not await self.loop.run_in_executor(None, self.switcher.reattach_macro_pad):
+                    return
+
+    async def serve_encoder(self):
+        """Read encoder clicks and batch them on the event loop"""
+        while True:
+            try:
+                async for event in self.encoder_device.async_read_loop():
+                    direction = encoder.encoder_direction(event)
+                    if direction:
+                        self.batcher.handle_encoder_event(direction, event.timestamp())
+            except OSError as e:
+                log.warning(f"Encoder read failed: {e}, waiting for it to be plugged back in")
+                self.encoder_device.close()
+                self.encoder_device, attach_ms = await self.loop.run_in_executor(
+                    None, input_devices.wait_for_device,
+                    lambda: input_devices.open_path(encoder.ENCODER_DEVICE),
+                    self.switcher.stop_requested, self.switcher.REATTACH_POLL, self.switcher.INPUT_DIRS,
+                )
+                if self.encoder_device is None:
+                    return
+                attach_note = "" if attach_ms is None else f" {attach_ms:.0f} ms after it appeared"
+                log.info(f"Encoder reattached{attach_note}: {self.encoder_device.name}")
+
+    def start_encoder(self):
+        """Start MQTT and open the encoder; returns False if the encoder can't run"""
+        if self.publisher.started_at is None:  # The switcher didn't start
+            self.publisher.start()
+        publish, self.brightness = encoder.brightness_publisher(self.publisher)
+        self.probe = encoder.latency_probe(self.publisher)
+
+        self.batcher = encoder.EncoderBatcher(
+            publish,
+            self.loop.call_later,
+            latency=self.encoder_latency,
+        )
+
+        try:
+            self.encoder_device = evdev.InputDevice(encoder.ENCODER_DEVICE)
+            log.info(f"Listening to encoder: {self.encoder_device.name}")
+        except Exception as e:
+            log.error(f"Failed to open encoder device: {e}")
+            return False
+        return True
+
+    async def supervise(self, name, coro):
+        """Run one input reader; a failure in one side leaves the other running"""
+        try:
+            await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.error(f"Error in {name} loop: {e}")
+
+    async def run(self):
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(sig, self.stopping.set)
+
+        # One broker connection for both sides; the switcher registers its will, then starts it
+        self.publisher = encoder.connect_mqtt(start=False)
+        self.switcher.mqtt_publisher = self.publisher
+
+        tasks = []
+        if self.switcher.start():
+            tasks.append(asyncio.create_task(self.supervise("button", self.serve_buttons())))
+        if self.start_encoder():
+            tasks.append(asyncio.create_task(self.supervise("encoder", self.serve_encoder())))
+
+        if not tasks:
+            log.error("Neither the buttons nor the encoder could be started")
+        else:
+            log.info(f"Macro pad daemon running ({len(tasks)} input loops on one event loop)")
+            self.stats_dumper.start()
+            await self.stopping.wait()
+            log.info("Shutting down...")
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.stop()
+
+    def stop(self):
+        self.stats_dumper.stop()
+        if self.batcher:
+            self.batcher.cancel()
+        if self.encoder_device:
+            self.encoder_device.close()
+        self.switcher.stop_mqtt()  # Announces 'offline' while the connection is still up
+        if self.publisher:
+            self.publisher.stop()
+        self.switcher.stop()
+
+
+async def async_main():
+    daemon = MacroPadDaemon(asyncio.get_running_loop())
+    await daemon.run()
+
+
+def main():
+    setup_logging(LOG_FILE)
+    asyncio.run(async_main())
+
+
+if __name__ == "__main__":
+    main()
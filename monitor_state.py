@@ -0,0 +1,131 @@
+"""
+Monitor State Cache
+Tracks the monitor's power mode (VCP D6) and input source (VCP 60) so the
+switcher can drop commands that would not change anything. Cached values
+expire after a TTL and are refreshed in the background while the pad is idle.
+"""
+import logging
+import threading
+import time
+
+import ddc_ci
+
+log = logging.getLogger('macropad.state')
+
+
+class MonitorState:
+    """Cached VCP values of one monitor, each with the time it was last confirmed"""
+
+    def __init__(self, ttl=30.0, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.values = {}  # VCP code -> (value, monotonic time confirmed)
+        self.stats = {
+            'wake_skipped': 0,
+            'switch_skipped': 0,
+            'standby_skipped': 0,
+            'vcp_skipped': 0,
+            'refreshes': 0,
+            'refresh_failures': 0,
+            'invalidations': 0,
+        }
+
+    def get(self, code):
+        """Return the cached value for a VCP code, or None if unknown or expired"""
+        with self.lock:
+            entry = self.values.get(code)
+        if entry is None:
+            return None
+        value, confirmed_at = entry
+        if self.clock() - confirmed_at > self.ttl:
+            return None
+        return value
+
+    def last_known(self, code):
+        """The last value read or written for a VCP code however old, or None after an invalidation"""
+        with self.lock:
+            entry = self.values.get(code)
+        return None if entry is None else entry[0]
+
+    def age(self, code):
+        """Seconds since a VCP code was last confirmed (infinite if never)"""
+        with self.lock:
+            entry = self.values.get(code)
+        return float('inf') if entry is None else self.clock() - entry[1]
+
+    def update(self, code, value):
+        with self.lock:
+            self.values[code] = (value, self.clock())
+
+    def invalidate(self, code=None):
+        """Forget one VCP code, or everything when no code is given"""
+        with self.lock:
+            if code is None:
+                self.values.clear()
+            else:
+                self.values.pop(code, None)
+            self.stats['invalidations'] += 1
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def commands_avoided(self):
+        with self.lock:
+            return sum(self.stats[stat] for stat in ('wake_skipped', 'switch_skipped', 'standby_skipped', 'vcp_skipped'))
+
+    def power_mode(self):
+        return self.get(ddc_ci.VCP_POWER_MODE)
+
+    def input_source(self):
+        """Cached input source; the source lives in the low byte of VCP 60"""
+        value = self.get(ddc_ci.VCP_INPUT_SOURCE)
+        return None if value is None else value & 0xFF
+
+    def refresh(self, ddc, neutral=False):
+        """Re-read power mode and input source; neutral reads leave the bus's circuit breaker alone"""
+        ok = True
+        for code in (ddc_ci.VCP_POWER_MODE, ddc_ci.VCP_INPUT_SOURCE):
+            try:
+                current, _ = ddc.get_vcp(code, neutral=neutral)
+                self.update(code, current)
+            except ddc_ci.DDCError as e:
+                log.debug(f"State refresh of VCP 0x{code:02X} failed: {e}")
+                self.invalidate(code)
+                ok = False
+        self.count('refreshes' if ok else 'refresh_failures')
+        return ok
+
+
+class StateRefresher:
+    """
+    Background thread that keeps a MonitorState fresh while the switcher is idle
+    A monitor known to be asleep is left alone: it may not answer, and its
+    failed reads must not open the breaker the next wake has to get through.
+    """
+
+    def __init__(self, state, ddc, is_idle, interval=10.0):
+        self.state = state
+        self.ddc = ddc
+        self.is_idle = is_idle
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='state-refresh', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout=5)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            stale = max(self.state.age(ddc_ci.VCP_POWER_MODE),
+                        self.state.age(ddc_ci.VCP_INPUT_SOURCE)) >= self.interval
+            # Not power_mode(): a monitor left in standby stays asleep after its cached value expires
+            asleep = self.state.last_known(ddc_ci.VCP_POWER_MODE) not in (None, ddc_ci.POWER_ON)
+            if stale and not asleep and self.is_idle():
+                self.state.refresh(self.ddc, neutral=True)
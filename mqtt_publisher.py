@@ -0,0 +1,300 @@
+"""
+Offline-Tolerant MQTT Publisher
+Owns the broker connection for the encoder: connects in the background,
+reconnects with jittered exponential backoff, and keeps publishes made while
+offline in a bounded outbox that is flushed the moment the broker is back.
+Pending brightness deltas for a topic merge into one message, so an outage
+costs one catch-up publish rather than a replay of every click.
+"""
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+import paho.mqtt.client as mqtt
+
+from latency import LatencyHistogram
+
+log = logging.getLogger("macropad.mqtt")
+
+MQTT_QOS = 0
+OUTBOX_LIMIT = 100  # Oldest pending message is dropped beyond this
+RECONNECT_MIN = 0.5  # Seconds; backoff doubles from here...
+RECONNECT_MAX = 30.0  # ...up to here, with full jitter
+LOOP_TIMEOUT = 0.5  # Seconds the network loop blocks waiting for traffic
+
+
+def backoff_delay(attempt, minimum=RECONNECT_MIN, maximum=RECONNECT_MAX):
+    """Full-jitter exponential backoff: uniform in [0, min(max, min * 2**attempt)]"""
+    return random.uniform(0, min(maximum, minimum * 2 ** attempt))
+
+
+class MQTTPublisher:
+    """
+    Publishes through one paho client driven by its own network thread
+    publish() and publish_delta() never block on the network and never raise
+    for a missing connection; while offline the message waits in the outbox.
+    """
+
+    def __init__(
+        self,
+        host,
+        port=1883,
+        username=None,
+        password=None,
+        qos=MQTT_QOS,
+        keepalive=60,
+        outbox_limit=OUTBOX_LIMIT,
+        reconnect_min=RECONNECT_MIN,
+        reconnect_max=RECONNECT_MAX,
+    ):
+        self.host = host
+        self.port = port
+        self.qos = qos
+        self.keepalive = keepalive
+        self.reconnect_min = reconnect_min
+        self.reconnect_max = reconnect_max
+        self.client = mqtt.Client()
+        if username:
+            self.client.username_pw_set(username, password)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+        self.client.on_publish = self._on_publish
+
+        self.lock = threading.RLock()
+        self.state = "disconnected"  # disconnected -> connecting -> connected
+        self.outbox = deque()  # [topic, payload, delta or None, qos, retain]
+        self.outbox_limit = outbox_limit
+        self.subscriptions = {}  # topic filter -> ([callback(message)], qos)
+        self.connect_callbacks = []  # Called on every (re)connect, e.g. to announce availability
+        self.publish_watchers = []  # (sent, acked) pairs from watch_publishes()
+        self.lost_at = None
+        self.started_at = None
+        self.reconnect_latency = LatencyHistogram()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="mqtt-publisher", daemon=True)
+        self.stats = {
+            "sent": 0,
+            "queued": 0,
+            "merged": 0,
+            "dropped": 0,
+            "flushed": 0,
+            "connect_failures": 0,
+            "reconnects": 0,
+            "connect_ms": None,
+            "last_reconnect_ms": None,
+        }
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        self.client.disconnect()
+        if self.thread.is_alive():
+            self.thread.join(timeout=timeout)
+        with self.lock:
+            if self.outbox:
+                log.warning(f"MQTT publisher stopped with {len(self.outbox)} unsent message(s)")
+            self.state = "stopped"
+
+    def connected(self):
+        return self.state == "connected"
+
+    def publish(self, topic, payload, qos=None, retain=False):
+        """Send now if connected, otherwise queue; a topic's queued payload is replaced by a newer one"""
+        with self.lock:
+            if self._send_in_order(topic, payload, qos, retain):
+                return
+            for entry in self.outbox:
+                if entry[0] == topic and entry[2] is None:
+                    entry[1], entry[3], entry[4] = payload, qos, retain
+                    self.stats["merged"] += 1
+                    return
+            self._queue([topic, payload, None, qos, retain])
+
+    def publish_delta(self, topic, delta, qos=None):
+        """Send a relative change; while offline it is summed with the topic's queued delta"""
+        with self.lock:
+            if self._send_in_order(topic, str(delta), qos, False):
+                return
+            for entry in self.outbox:
+                if entry[0] == topic and entry[2] is not None:
+                    entry[2] += delta
+                    entry[1] = str(entry[2])
+                    self.stats["merged"] += 1
+                    return
+            self._queue([topic, str(delta), delta, qos, False])
+
+    def subscribe(self, topic, callback, qos=None):
+        """Call callback(message) for messages on topic, after any earlier callbacks; renewed on every reconnect"""
+        with self.lock:
+            callbacks = self.subscriptions.get(topic, ([], None))[0]
+            self.subscriptions[topic] = (callbacks + [callback], self.qos if qos is None else qos)
+            if self.state == "connected":
+                self.client.subscribe(topic, self.subscriptions[topic][1])
+
+    def set_will(self, topic, payload, retain=True):
+        """Message the broker publishes if the connection dies uncleanly; set before start()"""
+        self.client.will_set(topic, payload, qos=self.qos, retain=retain)
+
+    def on_connected(self, callback):
+        """Call callback() after every successful (re)connect, once subscriptions are renewed"""
+        with self.lock:
+            self.connect_callbacks.append(callback)
+
+    def watch_publishes(self, sent, acked):
+        """
+        Call sent(topic, payload, mid, qos, sent_at) as each message goes out, and
+        acked(mid, acked_at) when paho reports it delivered (the broker's PUBACK at
+        QoS 1). acked runs on the network thread and may come before sent.
+        """
+        with self.lock:
+            self.publish_watchers.append((sent, acked))
+
+    def snapshot(self):
+        """Connection state, outbox depth, reconnect latency and counters"""
+        with self.lock:
+            return dict(
+                self.stats,
+                state=self.state,
+                outbox_depth=len(self.outbox),
+                reconnect_ms=self.reconnect_latency.summary(),
+            )
+
+    def _send(self, topic, payload, qos, retain):
+        """Publish if connected; the caller holds the lock. False means queue it"""
+        if self.state != "connected":
+            return False
+        qos = self.qos if qos is None else qos
+        sent_at = time.monotonic()
+        info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            return False
+        self.stats["sent"] += 1
+        for sent, _ in self.publish_watchers:
+            try:
+                sent(topic, payload, info.mid, qos, sent_at)
+            except Exception as e:
+                log.error(f"MQTT publish watcher failed: {e}")
+        return True
+
+    def _send_in_order(self, topic, payload, qos, retain):
+        """
+        Like _send, but only once everything queued earlier has gone out
+        A publish that failed while connected waits in the outbox; flushing it
+        first keeps a newer message from overtaking it. The caller holds the lock.
+        """
+        self._flush()
+        return not self.outbox and self._send(topic, payload, qos, retain)
+
+    def _queue(self, entry):
+        if len(self.outbox) >= self.outbox_limit:
+            self.outbox.popleft()
+            self.stats["dropped"] += 1
+        self.outbox.append(entry)
+        self.stats["queued"] += 1
+
+    def _flush(self):
+        """Send everything queued while offline or after a failed send, oldest first; the caller holds the lock"""
+        while self.outbox:
+            topic, payload, _, qos, retain = self.outbox[0]
+            if not self._send(topic, payload, qos, retain):
+                return
+            self.outbox.popleft()
+            self.stats["flushed"] += 1
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            log.error(f"MQTT broker refused the connection (rc={rc})")
+            return
+        now = time.monotonic()
+        with self.lock:
+            self.state = "connected"
+            if self.lost_at is None:
+                self.stats["connect_ms"] = round((now - self.started_at) * 1000, 1)
+                log.info(f"Connected to MQTT broker at {self.host}")
+            else:
+                ms = (now - self.lost_at) * 1000
+                self.reconnect_latency.record(ms)
+                self.stats["reconnects"] += 1
+                self.stats["last_reconnect_ms"] = round(ms, 1)
+                log.info(f"Reconnected to MQTT broker after {ms:.0f} ms, "
+                             f"flushing {len(self.outbox)} queued message(s)")
+            # A clean session forgets subscriptions, so they are made again each time
+            for topic, (_, qos) in self.subscriptions.items():
+                self.client.subscribe(topic, qos)
+            self._flush()
+            callbacks = list(self.connect_callbacks)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                log.error(f"MQTT connect callback failed: {e}")
+
+    def _on_disconnect(self, client, userdata, rc):
+        with self.lock:
+            if self.state == "connected" and not self.stop_event.is_set():
+                self.lost_at = time.monotonic()
+                log.warning(f"Lost connection to MQTT broker (rc={rc})")
+            self.state = "disconnected"
+
+    def _on_message(self, client, userdata, message):
+        with self.lock:
+            callbacks = [callback for topic, (topic_callbacks, _) in self.subscriptions.items()
+                         if mqtt.topic_matches_sub(topic, message.topic) for callback in topic_callbacks]
+        for callback in callbacks:
+            try:
+                callback(message)
+            except Exception as e:
+                log.error(f"MQTT handler for {message.topic} failed: {e}")
+
+    def _on_publish(self, client, userdata, mid):
+        # paho holds its message lock here, and publish() holds self.lock while calling
+        # into paho, so taking self.lock would deadlock; the watcher list is only appended to
+        acked_at = time.monotonic()
+        for _, acked in list(self.publish_watchers):
+            try:
+                acked(mid, acked_at)
+            except Exception as e:
+                log.error(f"MQTT publish watcher failed: {e}")
+
+    def _backoff(self, attempt, reason):
+        self.stats["connect_failures"] += 1
+        delay = backoff_delay(attempt, self.reconnect_min, self.reconnect_max)
+        log.warning(f"MQTT connect to {self.host} failed: {reason}; retrying in {delay:.1f}s")
+        self.stop_event.wait(delay)
+
+    def _run(self):
+        attempt = 0
+        while not self.stop_event.is_set():
+            if self.state == "disconnected":
+                self.state = "connecting"
+                try:
+                    self.client.connect(self.host, self.port, self.keepalive)
+                except OSError as e:
+                    self.state = "disconnected"
+                    self._backoff(attempt, e)
+                    attempt += 1
+                    continue
+
+            was_connected = self.state == "connected"
+            rc = self.client.loop(timeout=LOOP_TIMEOUT)
+            if rc == mqtt.MQTT_ERR_SUCCESS:
+                if self.state == "connected":
+                    attempt = 0
+                continue
+
+            with self.lock:
+                if self.state == "connected":  # Dropped without an on_disconnect callback
+                    self.lost_at = time.monotonic()
+                self.state = "disconnected"
+            if not was_connected:
+                # Dropped before CONNACK (e.g. refused): back off like a failed connect
+                self._backoff(attempt, f"rc={rc}")
+                attempt += 1
+            # An established connection that drops is retried at once
@@ -0,0 +1,315 @@
+"""
+Action Pipelines
+Actions defined in a JSON file as pipelines of typed steps. The file is
+validated and compiled once at startup: displays, pins, VCP codes and
+payloads are resolved into closures, so a press costs one dict lookup
+whatever the file contains.
+
+    {
+      "actions": {
+        "desk_a": {"steps": [
+          {"type": "vcp_set", "code": "0xD6", "value": 1, "timeout": 3},
+          {"parallel": [
+            {"type": "vcp_set", "input": "displayport"},
+            {"type": "gpio_pulse", "usb_input": 1}
+          ]},
+          {"type": "mqtt_publish", "topic": "office/desk", "payload": "a", "retain": true},
+          {"type": "delay", "seconds": 0.5},
+          {"type": "vcp_set", "display": "main", "code": "0x10", "value": 80, "optional": true}
+        ]}
+      },
+      "keys": {"KEY_F21": "desk_a"},
+      "gestures": {"KEY_F23": {"long_press": "desk_a"}}
+    }
+
+Steps run in order; the steps of a "parallel" group start together. Every
+step has a timeout (seconds, from its own start) after which it is cancelled
+and counts as failed. A failed step ends the pipeline unless it is optional.
+A vcp_set without "display" targets every display, concurrently.
+"""
+import json
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait as wait_futures
+
+import gestures
+from dispatcher import ActionSuperseded
+from latency import LatencyHistogram
+
+log = logging.getLogger('macropad.pipelines')
+
+ACTIONS_FILE = '/etc/macropad/actions.json'
+STEP_WORKERS = 8  # Step threads; also the most steps one parallel group may run
+STEP_POLL = 0.05  # Seconds between checks for a newer press while steps run
+STEP_TIMEOUTS = {'vcp_set': 5.0, 'gpio_pulse': 1.0, 'mqtt_publish': 1.0}
+DELAY_MARGIN = 1.0  # A delay's default timeout is its length plus this
+COMMON_FIELDS = {'type', 'name', 'timeout', 'optional'}
+STEP_FIELDS = {
+    'vcp_set': {'display', 'code', 'value', 'input', 'verify', 'force'},
+    'gpio_pulse': {'usb_input', 'pin', 'width'},
+    'mqtt_publish': {'topic', 'payload', 'retain', 'qos'},
+    'delay': {'seconds'},
+}
+
+
+class PipelineError(ValueError):
+    """Invalid actions file; raised at startup, never on a press"""
+
+
+class Step:
+    """
+    One compiled step; run(cancel) returns True on success
+    cancel is a threading.Event set when the step times out or the action is
+    superseded, to be passed on to blocking calls (e.g. set_vcp).
+    """
+    __slots__ = ('label', 'kind', 'run', 'timeout', 'optional')
+
+    def __init__(self, label, kind, run, timeout, optional):
+        self.label = label
+        self.kind = kind
+        self.run = run
+        self.timeout = timeout
+        self.optional = optional
+
+
+class Pipeline:
+    """Stages of steps; the steps of a stage run concurrently, stages one after another"""
+
+    def __init__(self, name, stages):
+        self.name = name
+        self.stages = stages
+        self.step_ms = {step.label: LatencyHistogram() for stage in stages for step in stage}
+        self.stats = {'runs': 0, 'failed': 0, 'step_failures': 0, 'timeouts': 0, 'superseded': 0}
+
+    def describe(self):
+        return ' -> '.join(
+            stage[0].label if len(stage) == 1 else '[' + ' | '.join(step.label for step in stage) + ']'
+            for stage in self.stages
+        )
+
+    def run(self, executor, token=None, trace=None):
+        """Run every stage on executor; False at the first failed step that isn't optional"""
+        self.stats['runs'] += 1
+        try:
+            for stage in self.stages:
+                if token is not None:
+                    token.check()
+                if not self._run_stage(stage, executor, token, trace):
+                    self.stats['failed'] += 1
+                    return False
+            return True
+        except ActionSuperseded:
+            self.stats['superseded'] += 1
+            raise
+
+    def snapshot(self):
+        return dict(self.stats, step_ms={label: ms.summary() for label, ms in self.step_ms.items()})
+
+    def _run_stage(self, stage, executor, token, trace):
+        start = time.monotonic()
+        running = {}
+        for step in stage:
+            cancel = threading.Event()
+            began = []  # Filled in by the worker: a step waiting for a thread isn't timed yet
+            running[executor.submit(_timed, step.run, cancel, began)] = (step, cancel, began)
+
+        def deadline(future):
+            step, _, began = running[future]
+            return began[0] + step.timeout if began else float('inf')
+
+        pending = set(running)
+        failed = []
+        try:
+            while pending:
+                next_deadline = min(deadline(future) for future in pending)
+                timeout = min(STEP_POLL, max(0.0, next_deadline - time.monotonic()))
+                done, pending = wait_futures(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running[future][0]
+                    try:
+                        ok, ms = future.result()
+                    except Exception as e:
+                        log.error(f"Step {step.label} of {self.name} raised: {e}")
+                        ok, ms = False, (time.monotonic() - start) * 1000
+                    self.step_ms[step.label].record(ms)
+                    if trace:
+                        trace.record(step.label, ms)
+                    if not ok:
+                        failed.append(step)
+                now = time.monotonic()
+                for future in [future for future in pending if deadline(future) <= now]:
+                    step, cancel, _ = running[future]
+                    cancel.set()
+                    pending.discard(future)
+                    failed.append(step)
+                    self.stats['timeouts'] += 1
+                    log.error(f"Step {step.label} of {self.name} timed out after {step.timeout:.2f}s")
+                if token is not None and token.cancelled:
+                    raise ActionSuperseded()
+        finally:
+            if pending:
+                for future in pending:
+                    running[future][1].set()  # Superseded: stop whatever is still running
+        self.stats['step_failures'] += len(failed)
+        required = [step.label for step in failed if not step.optional]
+        if required:
+            log.error(f"Pipeline {self.name} stopped: step {', '.join(required)} failed")
+            return False
+        for step in failed:
+            log.warning(f"Optional step {step.label} of {self.name} failed, continuing")
+        return True
+
+
+def _timed(run, cancel, began):
+    start = time.monotonic()
+    began.append(start)
+    if cancel.is_set():
+        return False, 0.0  # Superseded while it waited for a thread
+    ok = run(cancel)
+    return bool(ok), (time.monotonic() - start) * 1000
+
+
+def parse_int(spec, field, low, high, default=None):
+    """An integer field given as a number or a string such as "0x60" """
+    value = spec.get(field, default)
+    if value is None:
+        raise PipelineError(f"missing {field}")
+    try:
+        number = value if isinstance(value, int) and not isinstance(value, bool) else int(str(value), 0)
+    except ValueError:
+        raise PipelineError(f"{field} must be an integer, not {value!r}")
+    if not low <= number <= high:
+        raise PipelineError(f"{field} must be {low}-{high}, not {number}")
+    return number
+
+
+def parse_seconds(spec, field, default=None, high=3600.0):
+    value = spec.get(field, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 < value <= high:
+        raise PipelineError(f"{field} must be a number of seconds (0-{high:g}], not {value!r}")
+    return float(value)
+
+
+def build_delay(spec, label):
+    seconds = parse_seconds(spec, 'seconds')
+    # Waiting on cancel lets a newer press or the timeout cut the delay short
+    return [(label, lambda cancel: not cancel.wait(seconds))]
+
+
+def compile_step(spec, label, builders):
+    """A step spec -> Steps; builders(spec, label) return [(label, run)], more than one to fan out"""
+    if not isinstance(spec, dict):
+        raise PipelineError(f"{label}: a step must be an object, not {spec!r}")
+    kind = spec.get('type')
+    builder = build_delay if kind == 'delay' else builders.get(kind)
+    if builder is None:
+        raise PipelineError(f"{label}: unknown step type {kind!r}")
+    label = str(spec.get('name') or label)
+    unknown = set(spec) - COMMON_FIELDS - STEP_FIELDS.get(kind, set())
+    if unknown:
+        raise PipelineError(f"{label}: unknown field(s) {', '.join(sorted(unknown))} for {kind}")
+    try:
+        if kind == 'delay':
+            default_timeout = parse_seconds(spec, 'seconds') + DELAY_MARGIN
+        else:
+            default_timeout = STEP_TIMEOUTS[kind]
+        timeout = parse_seconds(spec, 'timeout', default_timeout)
+        optional = spec.get('optional', False)
+        if not isinstance(optional, bool):
+            raise PipelineError("optional must be true or false")
+        runs = builder(spec, label)
+    except PipelineError as e:
+        raise PipelineError(f"{label}: {e}")
+    return [Step(step_label, kind, run, timeout, optional) for step_label, run in runs]
+
+
+def compile_pipeline(name, spec, builders):
+    """Validate one action's spec and compile it into a Pipeline"""
+    steps = spec.get('steps') if isinstance(spec, dict) else None
+    if not isinstance(steps, list) or not steps:
+        raise PipelineError(f"action {name}: needs a non-empty list of steps")
+    stages = []
+    labels = set()
+    for index, item in enumerate(steps, 1):
+        if isinstance(item, dict) and 'parallel' in item:
+            group = item['parallel']
+            if not isinstance(group, list) or not group or set(item) != {'parallel'}:
+                raise PipelineError(f"action {name}: parallel must be the only key and a non-empty list")
+            stage = []
+            for sub, step_spec in enumerate(group, 1):
+                stage += compile_step(step_spec, f'{index}.{sub}_{_kind(step_spec)}', builders)
+        else:
+            stage = compile_step(item, f'{index}_{_kind(item)}', builders)
+        if len(stage) > STEP_WORKERS:
+            raise PipelineError(f"action {name}: step {index} runs {len(stage)} steps at once (max {STEP_WORKERS})")
+        for step in stage:
+            if step.label in labels:
+                raise PipelineError(f"action {name}: duplicate step name {step.label}")
+            labels.add(step.label)
+        stages.append(stage)
+    return Pipeline(name, stages)
+
+
+def _kind(spec):
+    return spec.get('type', 'step') if isinstance(spec, dict) else 'step'
+
+
+def compile_config(config, builders, builtin_actions, key_code):
+    """
+    Compile a loaded actions file
+    key_code(name) maps a key name such as "KEY_F21" to its code, or None.
+    Returns (pipelines by name, {code: action} taps, {(code, gesture): action}).
+    """
+    if not isinstance(config, dict):
+        raise PipelineError("the file must contain a JSON object")
+    unknown = set(config) - {'actions', 'keys', 'gestures'}
+    if unknown:
+        raise PipelineError(f"unknown sections: {', '.join(sorted(unknown))}")
+    actions = config.get('actions', {})
+    if not isinstance(actions, dict):
+        raise PipelineError("actions must map names to pipelines")
+    pipelines = {str(name): compile_pipeline(str(name), spec, builders) for name, spec in actions.items()}
+    known = set(builtin_actions) | set(pipelines)
+
+    def resolve(key, action):
+        code = key_code(key)
+        if code is None:
+            raise PipelineError(f"unknown key {key!r}")
+        if action not in known:
+            raise PipelineError(f"key {key} maps to unknown action {action!r}")
+        return code
+
+    keys = {}
+    for key, action in _section(config, 'keys').items():
+        keys[resolve(key, action)] = action
+    key_gestures = {}
+    for key, mapping in _section(config, 'gestures').items():
+        if not isinstance(mapping, dict):
+            raise PipelineError(f"gestures for {key} must map gestures to actions")
+        for gesture, action in mapping.items():
+            if gesture not in gestures.GESTURES:
+                raise PipelineError(f"unknown gesture {gesture!r} for {key}")
+            if gesture == gestures.TAP:
+                keys[resolve(key, action)] = action
+            else:
+                key_gestures[(resolve(key, action), gesture)] = action
+    return pipelines, keys, key_gestures
+
+
+def _section(config, name):
+    section = config.get(name, {})
+    if not isinstance(section, dict):
+        raise PipelineError(f"{name} must be an object")
+    return section
+
+
+def load_file(path):
+    """The parsed actions file, or None if there is none"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        raise PipelineError(f"could not read {path}: {e}")
@@ -0,0 +1,101 @@
+"""
+Single-Thread Scheduler
+One long-lived thread runs delayed callbacks from a heap, instead of a
+threading.Timer (and so an OS thread) per deadline. call_later() has the same
+shape as asyncio's and returns a handle with cancel(), so code written against
+it runs unchanged on an event loop.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+log = logging.getLogger("macropad.scheduler")
+
+
+class ScheduledCall:
+    """Handle for one pending callback"""
+
+    __slots__ = ("when", "callback", "args", "cancelled")
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler:
+    """
+    Runs callbacks at monotonic deadlines on one worker thread
+    Rescheduling is a heap push, with no thread creation. stop() drops pending
+    calls and waits for a running callback, so nothing fires after it returns.
+    """
+
+    def __init__(self, name="scheduler"):
+        self.cond = threading.Condition()
+        self.queue = []  # (deadline, sequence, ScheduledCall)
+        self.sequence = itertools.count()
+        self.running = False
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.stats = {"scheduled": 0, "cancelled": 0, "run": 0, "failed": 0}
+
+    def start(self):
+        with self.cond:
+            self.running = True
+        self.thread.start()
+        return self
+
+    def call_later(self, delay, callback, *args):
+        """Run callback(*args) after delay seconds; returns a handle with cancel()"""
+        call = ScheduledCall(time.monotonic() + delay, callback, args)
+        with self.cond:
+            if not self.running:
+                raise RuntimeError("Scheduler is not running")
+            heapq.heappush(self.queue, (call.when, next(self.sequence), call))
+            self.stats["scheduled"] += 1
+            if self.queue[0][2] is call:
+                self.cond.notify()  # New earliest deadline
+        return call
+
+    def pending(self):
+        with self.cond:
+            return sum(1 for _, _, call in self.queue if not call.cancelled)
+
+    def stop(self, timeout=5):
+        """Drop pending calls and wait for a callback in progress to return"""
+        with self.cond:
+            self.running = False
+            self.queue.clear()
+            self.cond.notify()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout=timeout)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running:
+                    if not self.queue:
+                        self.cond.wait()
+                        continue
+                    remaining = self.queue[0][0] - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                if not self.running:
+                    return
+                _, _, call = heapq.heappop(self.queue)
+                if call.cancelled:
+                    self.stats["cancelled"] += 1
+                    continue
+                self.stats["run"] += 1
+
+            try:
+                call.callback(*call.args)
+            except Exception as e:
+                self.stats["failed"] += 1
+                log.error(f"Scheduled callback {call.callback!r} failed: {e}")
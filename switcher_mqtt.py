@@ -0,0 +1,206 @@
+"""
+Switcher MQTT Bridge
+Publishes the switcher's state as one retained JSON message whenever it
+changes, takes commands from a topic into the same dispatcher as the buttons,
+and announces Home Assistant MQTT discovery configs, so dashboards update on
+push instead of polling. Uses an MQTTPublisher, either its own or one shared
+with the encoder in macropad_daemon.py.
+
+Topics (prefix 'macropad/switcher'):
+    <prefix>/state         retained state JSON
+    <prefix>/set           commands: 'computer_a', 'computer_b', 'hdmi_standby',
+                           or JSON {"action": ...}; {"code": "0x10", "value": 80} only
+                           with vcp_commands (MQTT_VCP_COMMANDS) on
+    <prefix>/availability  retained 'online' / 'offline' (the broker sends 'offline'
+                           if the connection dies)
+"""
+import json
+import logging
+import threading
+
+import control_socket
+
+log = logging.getLogger('macropad.mqtt')
+
+TOPIC_PREFIX = 'macropad/switcher'
+DISCOVERY_PREFIX = 'homeassistant'  # None disables Home Assistant discovery
+NODE_ID = 'macropad_switcher'
+STATE_CHECK_INTERVAL = 5.0  # Seconds between checks for changes made outside an action (e.g. a refresh)
+
+# Input the primary monitor is on -> what Home Assistant shows as the active computer
+COMPUTERS = {'displayport': 'computer_a', 'usbc': 'computer_b', 'hdmi': 'hdmi_standby'}
+
+
+def state_payload(status):
+    """The parts of switcher.status() worth pushing: no ages or timestamps, so unchanged state is skipped"""
+    primary = next(iter(status['displays'].values()), {})
+    last = status['last_action'] or {}
+    return {
+        'computer': COMPUTERS.get(status['current_input']),
+        'current_input': status['current_input'],
+        'usb_input': status['usb_input'],
+        'power': primary.get('power'),
+        'displays': {
+            name: {'input': display['input'], 'power': display['power']}
+            for name, display in status['displays'].items()
+        },
+        'last_action': last.get('action'),
+        'last_action_success': last.get('success'),
+        'last_action_ms': last.get('ms'),
+    }
+
+
+class SwitcherMQTT:
+    """
+    Owns the switcher's topics on a publisher
+    State is published from one thread, woken by notify() after each action,
+    so messages go out in order and never from the dispatcher worker. Raw VCP
+    writes from the command topic are rejected unless vcp_commands is True:
+    anyone on the broker could otherwise power off or reset the monitors.
+    """
+
+    def __init__(self, switcher, publisher, prefix=TOPIC_PREFIX, discovery_prefix=DISCOVERY_PREFIX,
+                 node_id=NODE_ID, interval=STATE_CHECK_INTERVAL, vcp_commands=False):
+        self.switcher = switcher
+        self.publisher = publisher
+        self.vcp_commands = vcp_commands
+        self.discovery_prefix = discovery_prefix
+        self.node_id = node_id
+        self.interval = interval
+        self.state_topic = f'{prefix}/state'
+        self.command_topic = f'{prefix}/set'
+        self.availability_topic = f'{prefix}/availability'
+        self.last_payload = None
+        self.announce = True  # Availability, discovery and state are (re)sent on the next wake
+        self.wake = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='switcher-mqtt', daemon=True)
+        self.stats = {'state_published': 0, 'announcements': 0, 'commands': 0, 'rejected': 0}
+
+    def attach(self):
+        """Register the will, subscriptions and reconnect hook; call before the publisher starts"""
+        self.publisher.set_will(self.availability_topic, 'offline')
+        self.publisher.subscribe(self.command_topic, self.on_command)
+        if self.discovery_prefix:
+            # Home Assistant publishes 'online' here when it restarts and needs the configs again
+            self.publisher.subscribe(f'{self.discovery_prefix}/status', self.on_ha_status)
+        self.publisher.on_connected(self.request_announce)
+
+    def start(self):
+        self.thread.start()
+        self.wake.set()  # First announcement
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout=5)
+        self.publisher.publish(self.availability_topic, 'offline', retain=True)
+
+    def notify(self):
+        """Something may have changed; publish the state if it did"""
+        self.wake.set()
+
+    def request_announce(self):
+        self.announce = True
+        self.wake.set()
+
+    def on_ha_status(self, message):
+        if message.payload == b'online':
+            self.request_announce()
+
+    def on_command(self, message):
+        """Queue a command from the command topic on the switcher's dispatcher"""
+        self.stats['commands'] += 1
+        text = message.payload.decode(errors='replace').strip()
+        try:
+            try:
+                request = json.loads(text)
+            except ValueError:
+                request = text
+            if isinstance(request, str):
+                request = {'action': request}
+            if not isinstance(request, dict):
+                raise control_socket.ControlError("Command must be an action name or a JSON object")
+            if 'code' in request:
+                if not self.vcp_commands:
+                    raise control_socket.ControlError("Raw VCP writes over MQTT are disabled")
+                self.switcher.control_vcp(request)
+            else:
+                self.switcher.control_action(request)
+            log.info(f"MQTT command queued: {text}")
+        except control_socket.ControlError as e:
+            self.stats['rejected'] += 1
+            log.warning(f"Ignoring MQTT command {text!r}: {e}")
+
+    def discovery_configs(self):
+        """(topic, config) for each Home Assistant entity"""
+        device = {
+            'identifiers': [self.node_id],
+            'name': 'Macro Pad Switcher',
+            'manufacturer': 'DIY',
+            'model': 'BNK8 DDC/CI + USB switch',
+        }
+
+        def entity(component, object_id, name, **config):
+            topic = f'{self.discovery_prefix}/{component}/{self.node_id}/{object_id}/config'
+            return topic, dict(
+                name=name,
+                unique_id=f'{self.node_id}_{object_id}',
+                availability_topic=self.availability_topic,
+                device=device,
+                **config,
+            )
+
+        return [
+            entity('select', 'computer', 'Active computer', state_topic=self.state_topic,
+                   value_template='{{ value_json.computer }}', command_topic=self.command_topic,
+                   options=sorted(set(COMPUTERS.values())), icon='mdi:monitor-multiple'),
+            entity('sensor', 'input', 'Monitor input', state_topic=self.state_topic,
+                   value_template='{{ value_json.current_input }}', icon='mdi:video-input-hdmi'),
+            entity('sensor', 'power', 'Monitor power', state_topic=self.state_topic,
+                   value_template='{{ value_json.power }}', icon='mdi:monitor'),
+            entity('sensor', 'usb_input', 'USB switch input', state_topic=self.state_topic,
+                   value_template='{{ value_json.usb_input }}', icon='mdi:usb'),
+            entity('sensor', 'last_action_ms', 'Last switch latency', state_topic=self.state_topic,
+                   value_template='{{ value_json.last_action_ms }}', unit_of_measurement='ms',
+                   state_class='measurement', icon='mdi:timer-outline'),
+        ]
+
+    def publish_state(self, force=False):
+        """Publish the retained state if it differs from the last one sent"""
+        payload = json.dumps(state_payload(self.switcher.status()), sort_keys=True)
+        if payload == self.last_payload and not force:
+            return False
+        self.last_payload = payload
+        self.publisher.publish(self.state_topic, payload, retain=True)
+        self.stats['state_published'] += 1
+        return True
+
+    def snapshot(self):
+        return dict(self.stats, publisher=self.publisher.snapshot())
+
+    def _announce(self):
+        self.announce = False
+        self.stats['announcements'] += 1
+        self.publisher.publish(self.availability_topic, 'online', retain=True)
+        if self.discovery_prefix:
+            for topic, config in self.discovery_configs():
+                self.publisher.publish(topic, json.dumps(config), retain=True)
+        self.publish_state(force=True)  # A restarted broker may have lost the retained state
+
+    def _run(self):
+        while True:
+            # Cleared before publishing, so a notify() during a publish isn't lost
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            if self.stop_event.is_set():
+                return
+            try:
+                if self.announce:
+                    self._announce()
+                else:
+                    self.publish_state()
+            except Exception as e:
+                log.error(f"Publishing switcher state failed: {e}")
@@ -0,0 +1,42 @@
+"""Tests run against the bench stand-ins for evdev, RPi.GPIO and paho, like bench/run_bench.py"""
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(REPO_DIR, "bench", "stubs"), REPO_DIR]
+
+from scheduler import ScheduledCall  # noqa: E402
+
+
+class ManualTimers:
+    """call_later on a fake clock that only moves when advance() is called"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.calls = []
+
+    def clock(self):
+        return self.now
+
+    def call_later(self, delay, callback, *args):
+        call = ScheduledCall(self.now + delay, callback, args)
+        self.calls.append(call)
+        return call
+
+    def advance(self, to):
+        while True:
+            due = [call for call in self.calls if not call.cancelled and call.when <= to]
+            if not due:
+                break
+            call = min(due, key=lambda c: c.when)
+            self.calls.remove(call)
+            self.now = call.when
+            call.callback(*call.args)
+        self.now = to
+
+
+@pytest.fixture
+def timers():
+    return ManualTimers()
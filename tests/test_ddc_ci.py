@@ -0,0 +1,144 @@
+"""CircuitBreaker admission (probe commands for wakes, neutral background reads) and polled verification"""
+import os
+import threading
+import time
+
+import pytest
+
+import ddc_ci
+from ddc_ci import BreakerOpen, CircuitBreaker, DDCCancelled, DDCError, DdcutilBackend, FakeI2CDevice, I2CBackend
+
+
+def fail(breaker, times=1, **kwargs):
+    for _ in range(times):
+        with pytest.raises(DDCError):
+            with breaker.guard(**kwargs):
+                raise DDCError("no answer")
+
+
+def open_breaker(cooldown=30.0):
+    breaker = CircuitBreaker("test", threshold=3, cooldown=cooldown)
+    fail(breaker, 3)
+    assert breaker.state == "open"
+    return breaker
+
+
+def test_open_breaker_fails_fast():
+    breaker = open_breaker()
+    with pytest.raises(BreakerOpen):
+        with breaker.guard():
+            pass
+    assert breaker.stats["fast_failures"] == 1
+
+
+def test_probe_is_the_trial_during_the_cooldown():
+    breaker = open_breaker()
+    with breaker.guard(probe=True):
+        pass
+    assert breaker.state == "closed"
+    assert breaker.consecutive_failures == 0
+
+
+def test_failed_probe_opens_the_breaker_again():
+    breaker = open_breaker()
+    fail(breaker, probe=True)
+    assert breaker.state == "open"
+    assert breaker.stats["opened"] == 2
+
+
+def test_neutral_failures_do_not_open_the_breaker():
+    breaker = CircuitBreaker("test", threshold=3)
+    fail(breaker, 5, neutral=True)
+    assert breaker.state == "closed"
+    assert breaker.stats["failures"] == 0
+
+
+def test_neutral_commands_neither_close_nor_take_the_trial():
+    breaker = open_breaker(cooldown=0.0)
+    with breaker.guard(neutral=True):
+        pass
+    assert breaker.state == "open"
+    with breaker.guard():
+        pass
+    assert breaker.state == "closed"
+
+
+def test_neutral_commands_fail_fast_while_open():
+    breaker = open_breaker()
+    with pytest.raises(BreakerOpen):
+        with breaker.guard(neutral=True):
+            pass
+
+
+def test_wake_gets_through_an_open_breaker():
+    device = FakeI2CDevice(vcp={ddc_ci.VCP_POWER_MODE: ddc_ci.POWER_STANDBY})
+    backend = I2CBackend(7, device=device)
+    fail(backend.breaker, 3)
+    with pytest.raises(BreakerOpen):
+        backend.get_vcp(ddc_ci.VCP_POWER_MODE)
+    backend.set_vcp(ddc_ci.VCP_POWER_MODE, ddc_ci.POWER_ON, probe=True)
+    assert device.vcp[ddc_ci.VCP_POWER_MODE] == ddc_ci.POWER_ON
+    assert backend.breaker.state == "closed"
+
+
+def test_polled_wake_waits_out_a_monitor_that_ignores_reads():
+    device = FakeI2CDevice(vcp={ddc_ci.VCP_POWER_MODE: ddc_ci.POWER_STANDBY}, silent={ddc_ci.VCP_POWER_MODE: 1.5})
+    backend = I2CBackend(7, device=device)
+    settle = ddc_ci.SettleTimes()
+    ms, reads, writes = ddc_ci.set_vcp_polled(backend, ddc_ci.VCP_POWER_MODE, ddc_ci.POWER_ON, settle, probe=True)
+    assert ms >= 1500
+    assert reads > 1
+    assert settle.stats["verified"] == 1
+    snapshot = backend.breaker.snapshot()
+    assert snapshot["state"] == "closed"
+    assert (snapshot["successes"], snapshot["failures"]) == (1, 0)
+
+
+def test_polled_write_through_an_open_breaker_is_its_trial():
+    backend = I2CBackend(7, device=FakeI2CDevice())
+    fail(backend.breaker, 3)
+    ddc_ci.set_vcp_polled(backend, ddc_ci.VCP_POWER_MODE, ddc_ci.POWER_ON, ddc_ci.SettleTimes(), probe=True)
+    assert backend.breaker.state == "closed"
+
+
+def test_unverified_write_counts_as_one_failure():
+    device = FakeI2CDevice(silent={ddc_ci.VCP_INPUT_SOURCE: 10.0})
+    backend = I2CBackend(7, device=device)
+    with pytest.raises(DDCError):
+        ddc_ci.set_vcp_polled(backend, ddc_ci.VCP_INPUT_SOURCE, 0x11, ddc_ci.SettleTimes(), deadline=0.5)
+    snapshot = backend.breaker.snapshot()
+    assert (snapshot["failures"], snapshot["consecutive_failures"], snapshot["state"]) == (1, 1, "closed")
+
+
+@pytest.fixture
+def slow_ddcutil(tmp_path, monkeypatch):
+    """A ddcutil on PATH that takes 0.1 s and logs when each run starts and ends"""
+    log_file = tmp_path / "runs"
+    script = tmp_path / "ddcutil"
+    script.write_text(f"#!/bin/sh\necho start >> {log_file}\nsleep 0.1\necho end >> {log_file}\n")
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    return log_file
+
+
+def test_ddcutil_runs_on_one_bus_never_overlap(slow_ddcutil):
+    backend = DdcutilBackend(7)
+    threads = [threading.Thread(target=backend.set_vcp, args=(ddc_ci.VCP_INPUT_SOURCE, 0x0F)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert slow_ddcutil.read_text().split() == ["start", "end"] * 3
+
+
+def test_cancelled_command_stops_waiting_for_the_bus(slow_ddcutil):
+    backend = DdcutilBackend(7)
+    busy = threading.Thread(target=backend.set_vcp, args=(ddc_ci.VCP_INPUT_SOURCE, 0x0F))
+    busy.start()
+    time.sleep(0.02)
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(DDCCancelled):
+        backend.get_vcp(ddc_ci.VCP_INPUT_SOURCE, cancel)
+    busy.join()
+    assert slow_ddcutil.read_text().split() == ["start", "end"]
@@ -0,0 +1,54 @@
+"""DDCMonitorSwitcher's switch legs and pipeline VCP steps, on the bench stand-ins"""
+import threading
+
+import pytest
+
+import ddc_ci
+import ddc_switcher
+
+
+@pytest.fixture
+def switcher():
+    switcher = ddc_switcher.DDCMonitorSwitcher(install_signal_handlers=False)
+    switcher.usb_switch_enabled = False
+    yield switcher
+    switcher.stop()
+
+
+def test_stuck_ddc_legs_do_not_block_later_switches(switcher):
+    switcher.DDC_LEG_TIMEOUT = 0.05
+    switcher.LEG_CANCEL_GRACE = 0.05
+    release = threading.Event()
+    switcher.wake_and_switch = lambda input_name: release.wait(5)  # Ignores cancellation
+    try:
+        for _ in range(3):  # More than the leg pool's workers
+            assert switcher.run_switch_legs("usbc", 2) == (False, False)
+
+        switcher.wake_and_switch = lambda input_name: True
+        assert switcher.run_switch_legs("usbc", 2) == (True, False)
+    finally:
+        release.set()
+
+
+def test_both_legs_are_timed(switcher, caplog):
+    switcher.wake_and_switch = lambda input_name: True
+    for parallel in (True, False):
+        switcher.parallel_switching = parallel
+        caplog.clear()
+        with caplog.at_level("INFO", logger="macropad.switcher"):
+            switcher.run_switch_legs("usbc", 2)
+        legs = [record.getMessage().split()[0] for record in caplog.records if " leg took " in record.getMessage()]
+        assert sorted(legs) == ["DDC", "USB"]
+
+
+def test_pipeline_power_on_gets_through_an_open_breaker(switcher):
+    display = switcher.displays[0]
+    display.ddc = ddc_ci.I2CBackend(7, device=ddc_ci.FakeI2CDevice(vcp={ddc_ci.VCP_POWER_MODE: ddc_ci.POWER_STANDBY}))
+    for _ in range(display.ddc.breaker.threshold):
+        with pytest.raises(ddc_ci.DDCError):
+            with display.ddc.breaker.guard():
+                raise ddc_ci.DDCError("no answer")
+    [(label, run)] = switcher.build_vcp_step({"code": "0xD6", "value": 1}, "power_on")
+    assert run(threading.Event())
+    assert display.ddc.device.vcp[ddc_ci.VCP_POWER_MODE] == ddc_ci.POWER_ON
+    assert display.ddc.breaker.state == "closed"
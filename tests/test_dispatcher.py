@@ -0,0 +1,73 @@
+"""ActionDispatcher: latest wins within a kind of action, never across kinds"""
+import threading
+import time
+
+import pytest
+
+from dispatcher import ActionDispatcher
+
+
+class BlockingActions:
+    """execute() that holds each action until released and records how it ended"""
+
+    def __init__(self):
+        self.started = []
+        self.finished = []
+        self.release = threading.Event()
+
+    def execute(self, action, token, context):
+        self.started.append(action)
+        self.release.wait(5)
+        self.finished.append((action, token.cancelled))
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def dispatcher():
+    actions = BlockingActions()
+    dispatcher = ActionDispatcher(actions.execute, name="test-dispatcher")
+    dispatcher.start()
+    yield dispatcher, actions
+    actions.release.set()
+    dispatcher.stop()
+
+
+def test_vcp_write_during_a_switch_waits_for_it(dispatcher):
+    dispatcher, actions = dispatcher
+    dispatcher.submit("usbc")
+    wait_until(lambda: actions.started == ["usbc"])
+    dispatcher.submit(("vcp", "main", 0x10, 80), kind=("vcp", "main", 0x10))
+    assert dispatcher.snapshot()["superseded"] == 0
+    actions.release.set()
+    wait_until(lambda: len(actions.finished) == 2)
+    assert actions.finished == [("usbc", False), (("vcp", "main", 0x10, 80), False)]
+
+
+def test_vcp_write_keeps_a_queued_switch(dispatcher):
+    dispatcher, actions = dispatcher
+    dispatcher.submit("usbc")
+    wait_until(lambda: actions.started == ["usbc"])
+    dispatcher.submit("displayport")
+    dispatcher.submit(("vcp", "main", 0x10, 80), kind=("vcp", "main", 0x10))
+    dispatcher.submit(("vcp", "main", 0x10, 90), kind=("vcp", "main", 0x10))
+    assert dispatcher.queue_depth() == 2
+    actions.release.set()
+    wait_until(lambda: len(actions.finished) == 3)
+    assert actions.started == ["usbc", "displayport", ("vcp", "main", 0x10, 90)]
+    assert actions.finished[0] == ("usbc", True)  # Superseded by the newer switch only
+
+
+def test_newer_switch_supersedes_the_running_one(dispatcher):
+    dispatcher, actions = dispatcher
+    dispatcher.submit("usbc")
+    wait_until(lambda: actions.started == ["usbc"])
+    dispatcher.submit("usbc")
+    dispatcher.submit("displayport")
+    snapshot = dispatcher.snapshot()
+    assert (snapshot["coalesced"], snapshot["superseded"]) == (1, 1)
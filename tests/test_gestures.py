@@ -0,0 +1,74 @@
+"""GestureRecognizer on synthetic timestamps and a fake clock"""
+import pytest
+
+import gestures
+
+
+# Keys: 1 tap only, 2 tap + double + long, 3 tap + long, 4 tap + double
+KEYS = {
+    1: {gestures.TAP},
+    2: {gestures.TAP, gestures.DOUBLE_TAP, gestures.LONG_PRESS},
+    3: {gestures.TAP, gestures.LONG_PRESS},
+    4: {gestures.TAP, gestures.DOUBLE_TAP},
+}
+# (name, [(time, kind, key)], [(key, gesture, time it fires)]); window 0.3 s, long press 0.6 s.
+# Kinds are "down", "up" and "advance"; "down!"/"up!" arrive before due timers have run, like a late timer.
+CASES = [
+    ("tap-only key fires on key-down", [(0.0, "down", 1), (0.08, "up", 1)], [(1, "tap", 0.0)]),
+    ("tap waits for the double-tap window", [(0.0, "down", 2), (0.08, "up", 2), (1.0, "advance", 0)],
+     [(2, "tap", 0.38)]),
+    ("double tap fires on the second press", [(0.0, "down", 2), (0.08, "up", 2), (0.2, "down", 2), (0.28, "up", 2),
+                                               (1.0, "advance", 0)], [(2, "double_tap", 0.2)]),
+    ("long press fires while held", [(0.0, "down", 2), (1.0, "advance", 0), (1.2, "up", 2)],
+     [(2, "long_press", 0.6)]),
+    ("tap without double tap fires on release", [(0.0, "down", 3), (0.1, "up", 3)], [(3, "tap", 0.1)]),
+    ("late timer: timestamps still make it a long press", [(0.0, "down", 3), (0.65, "up!", 3)],
+     [(3, "long_press", 0.65)]),
+    ("press after the window is a new tap", [(0.0, "down", 4), (0.08, "up", 4), (0.5, "down!", 4), (0.58, "up", 4),
+                                              (2.0, "advance", 0)], [(4, "tap", 0.5), (4, "tap", 0.88)]),
+    ("another key closes the window", [(0.0, "down", 4), (0.08, "up", 4), (0.1, "down", 1)],
+     [(4, "tap", 0.1), (1, "tap", 0.1)]),
+    ("triple press is a double tap then a tap", [(0.0, "down", 4), (0.05, "up", 4), (0.1, "down", 4), (0.15, "up", 4),
+                                                  (0.2, "down", 4), (0.25, "up", 4), (1.0, "advance", 0)],
+     [(4, "double_tap", 0.1), (4, "tap", 0.55)]),
+]
+
+
+def run_events(timers, events):
+    """Feed timestamped events to a recognizer; returns what fired and its stats"""
+    fired = []
+    recognizer = gestures.GestureRecognizer(
+        KEYS,
+        lambda code, gesture, started, ms: fired.append((code, gesture, round(timers.now, 3))),
+        timers.call_later,
+        lambda code, started: None,
+        double_tap_window=0.3,
+        long_press_time=0.6,
+        clock=timers.clock,
+    )
+    for t, kind, code in events:
+        if kind.endswith("!"):
+            timers.now = t
+        else:
+            timers.advance(t)
+        if kind.startswith("down"):
+            recognizer.key_down(code, t)
+        elif kind.startswith("up"):
+            recognizer.key_up(code, t)
+    return fired, recognizer.snapshot()
+
+
+@pytest.mark.parametrize("events, expected", [case[1:] for case in CASES], ids=[case[0] for case in CASES])
+def test_gesture(timers, events, expected):
+    fired, _ = run_events(timers, events)
+    assert fired == expected
+
+
+def test_speculates_only_on_multi_gesture_keys(timers):
+    _, stats = run_events(timers, [(0.0, "down", 1), (0.1, "down", 2), (0.2, "down", 3)])
+    assert stats["speculations"] == 2
+
+
+def test_unmapped_key_is_ignored(timers):
+    fired, _ = run_events(timers, [(0.0, "down", 9), (0.1, "up", 9), (1.0, "advance", 0)])
+    assert fired == []
@@ -0,0 +1,202 @@
+"""Encoder-side pieces of hue_lightstrip_encoder: the click batcher, the round-trip probe and its QoS"""
+import json
+import threading
+import time
+
+import pytest
+from paho.mqtt import client as mqtt_stub
+
+import hue_lightstrip_encoder as encoder
+from mqtt_publisher import MQTTPublisher
+
+broker = mqtt_stub.broker
+
+
+def state(level):
+    return mqtt_stub.MQTTMessage(encoder.MQTT_STATE_TOPIC, json.dumps({"brightness_pct": level}).encode())
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def batcher_on(timers, **kwargs):
+    sent = []
+    batcher = encoder.EncoderBatcher(lambda change: sent.append((change, timers.now)), timers.call_later,
+                                     clock=timers.clock, **kwargs)
+    return batcher, sent
+
+
+def spin(timers, batcher, start, clicks, interval=0.03, direction=1):
+    """Clicks interval apart from start, each read as it happens"""
+    for i in range(clicks):
+        timers.advance(start + i * interval)
+        batcher.handle_encoder_event(direction, timers.now)
+
+
+def test_single_click_is_one_message_once_still(timers):
+    batcher, sent = batcher_on(timers)
+    batcher.handle_encoder_event(1, 0.0)
+    timers.advance(encoder.QUIET_TIME - 0.01)
+    assert sent == []
+    timers.advance(1.0)
+    assert sent == [(encoder.STEP_SIZE, encoder.QUIET_TIME)]
+
+
+def test_short_spin_is_one_message_just_after_it_stops(timers):
+    batcher, sent = batcher_on(timers)
+    spin(timers, batcher, 0.0, 12)
+    timers.advance(2.0)
+    assert len(sent) == 1
+    assert sent[0][1] == pytest.approx(0.33 + encoder.QUIET_TIME)
+
+
+def test_long_spin_is_flushed_at_the_send_rate(timers):
+    batcher, sent = batcher_on(timers, max_send_rate=2.5, step_size=5, acceleration=())
+    spin(timers, batcher, 0.0, 60)  # 1.8 s of clicks
+    timers.advance(5.0)
+    gaps = [later - earlier for (_, earlier), (_, later) in zip(sent, sent[1:])]
+    assert len(sent) == 5
+    assert min(gaps) >= 0.4 - 1e-9
+    assert sum(change for change, _ in sent) == 60 * 5
+    assert batcher.snapshot()["while_turning"] == 4
+
+
+def test_spins_are_never_more_messages_than_the_old_trailing_timer(timers):
+    batcher, sent = batcher_on(timers)
+    for i in range(10):
+        spin(timers, batcher, i * 1.0, 12, direction=1 if i % 2 == 0 else -1)
+    timers.advance(20.0)
+    assert len(sent) <= 10
+
+
+def test_late_reads_use_event_time(timers):
+    batcher, sent = batcher_on(timers)
+    timers.advance(5.0)  # The reader fell behind: a whole spin is read at once
+    for i in range(12):
+        batcher.handle_encoder_event(1, 1.0 + i * 0.03)
+    timers.advance(10.0)
+    assert len(sent) == 1
+
+
+def test_clicks_that_cancel_out_send_nothing(timers):
+    batcher, sent = batcher_on(timers, step_size=5, acceleration=())
+    batcher.handle_encoder_event(1, 0.0)
+    batcher.handle_encoder_event(-1, 0.01)
+    timers.advance(1.0)
+    assert sent == []
+
+
+@pytest.fixture
+def probe():
+    probe = encoder.RoundTripProbe(None)
+    probe.on_state(state(50))
+    return probe
+
+
+def test_probe_times_acks_including_early_ones(probe):
+    now = time.monotonic()
+    probe.on_sent(encoder.MQTT_SET_TOPIC, "60", 1, 1, now)
+    probe.on_acked(1, now + 0.02)
+    probe.on_acked(2, now + 0.05)  # paho's ack can beat the sent() call
+    probe.on_sent(encoder.MQTT_SET_TOPIC, "70", 2, 1, now + 0.01)
+    snapshot = probe.snapshot()
+    assert snapshot["acked"] == 2
+    assert snapshot["ack_ms"]["max"] == pytest.approx(40, abs=1)
+
+
+def test_probe_ignores_acks_at_qos_0_and_other_topics(probe):
+    now = time.monotonic()
+    probe.on_sent(encoder.MQTT_TOPIC, "5", 1, 0, now)
+    probe.on_sent("office/other", "1", 2, 1, now)
+    probe.on_acked(1, now)
+    snapshot = probe.snapshot()
+    assert (snapshot["sent"], snapshot["acked"], snapshot["unacked"]) == (1, 0, 0)
+
+
+def test_state_change_completes_older_messages_too(probe):
+    sent_at = time.monotonic() - 0.2
+    probe.on_sent(encoder.MQTT_TOPIC, "5", 1, 0, sent_at)
+    probe.on_sent(encoder.MQTT_TOPIC, "5", 2, 0, sent_at)
+    probe.on_state(state(60))  # Both steps arrived together
+    snapshot = probe.snapshot()
+    assert (snapshot["state_changes"], snapshot["awaiting_state"]) == (2, 0)
+    assert snapshot["state_ms"]["p50"] >= 200
+
+
+def test_step_past_the_limit_expects_no_change(probe):
+    probe.on_state(state(100))
+    probe.on_sent(encoder.MQTT_TOPIC, "5", 1, 0, time.monotonic())
+    snapshot = probe.snapshot()
+    assert (snapshot["no_change_expected"], snapshot["awaiting_state"]) == (1, 0)
+
+
+def test_unanswered_messages_time_out():
+    probe = encoder.RoundTripProbe(None, timeout=0.1)
+    long_ago = time.monotonic() - 1
+    probe.on_sent(encoder.MQTT_SET_TOPIC, "60", 1, 1, long_ago)
+    snapshot = probe.snapshot()
+    assert (snapshot["ack_timeouts"], snapshot["state_timeouts"]) == (1, 1)
+
+
+def test_probe_measures_the_broker_and_the_light():
+    broker.reset()
+    broker.ack_latency = 0.05
+
+    def light(message):
+        if message.topic == encoder.MQTT_SET_TOPIC:
+            level = int(message.payload)
+            threading.Timer(0.15, broker.route, (state(level),)).start()
+
+    broker.hooks.append(light)
+    publisher = MQTTPublisher("test-broker").start()
+    try:
+        probe = encoder.RoundTripProbe(publisher).start()
+        wait_until(publisher.connected)
+        for level in (20, 40, 60):
+            publisher.publish(encoder.MQTT_SET_TOPIC, str(level), qos=1)
+            time.sleep(0.3)
+        wait_until(lambda: probe.snapshot()["state_changes"] == 3)
+        snapshot = probe.snapshot()
+    finally:
+        publisher.stop()
+        broker.reset()
+    assert snapshot["acked"] == 3
+    assert 50 <= snapshot["ack_ms"]["p50"] < 150
+    assert 150 <= snapshot["state_ms"]["p50"] < 300
+
+
+class RecordingPublisher:
+    def __init__(self):
+        self.sent = []
+
+    def subscribe(self, topic, callback):
+        self.callback = callback
+
+    def publish(self, topic, payload, qos=None):
+        self.sent.append((topic, qos))
+
+    def publish_delta(self, topic, delta, qos=None):
+        self.sent.append((topic, qos))
+
+
+def test_probe_raises_qos_for_absolute_targets_only(monkeypatch):
+    monkeypatch.setattr(encoder, "LATENCY_PROBE", True)
+    monkeypatch.setattr(encoder, "BRIGHTNESS_MODE", "relative")
+    relative = RecordingPublisher()
+    publish, _ = encoder.brightness_publisher(relative)
+    publish(5)
+
+    monkeypatch.setattr(encoder, "BRIGHTNESS_MODE", "absolute")
+    absolute = RecordingPublisher()
+    publish, _ = encoder.brightness_publisher(absolute)
+    publish(5)  # No state seen yet: falls back to a relative delta
+    absolute.callback(state(50))
+    publish(5)
+
+    # A resent delta would be applied twice, so deltas keep the publisher's QoS
+    assert relative.sent == [(encoder.MQTT_TOPIC, None)]
+    assert absolute.sent == [(encoder.MQTT_TOPIC, None), (encoder.MQTT_SET_TOPIC, encoder.PROBE_QOS)]
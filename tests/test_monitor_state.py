@@ -0,0 +1,67 @@
+"""StateRefresher: background reads stay away from sleeping monitors and the circuit breaker"""
+import time
+
+import ddc_ci
+from monitor_state import MonitorState, StateRefresher
+
+
+class RecordingDDC:
+    def __init__(self):
+        self.reads = []
+
+    def get_vcp(self, code, cancel=None, neutral=False):
+        self.reads.append((code, neutral))
+        return {ddc_ci.VCP_POWER_MODE: ddc_ci.POWER_ON, ddc_ci.VCP_INPUT_SOURCE: 0x0F}[code], 0xFF
+
+
+class SilentDevice(ddc_ci.FakeI2CDevice):
+    """A monitor in standby: takes requests, never replies"""
+
+    def read(self, length):
+        raise OSError("no answer")
+
+
+def run_refresher(state, ddc, seconds=0.1):
+    refresher = StateRefresher(state, ddc, is_idle=lambda: True, interval=0.01)
+    refresher.start()
+    time.sleep(seconds)
+    refresher.stop()
+
+
+def test_refresh_reads_are_neutral():
+    state, ddc = MonitorState(), RecordingDDC()
+    run_refresher(state, ddc)
+    assert ddc.reads
+    assert all(neutral for _, neutral in ddc.reads)
+    assert state.input_source() == 0x0F
+
+
+def test_monitor_in_standby_is_not_refreshed():
+    now = [0.0]
+    state, ddc = MonitorState(ttl=30.0, clock=lambda: now[0]), RecordingDDC()
+    state.update(ddc_ci.VCP_POWER_MODE, ddc_ci.POWER_STANDBY)
+    run_refresher(state, ddc)
+    now[0] = 100.0  # Long past the TTL: the cache no longer vouches for standby
+    assert state.power_mode() is None
+    run_refresher(state, ddc)
+    assert ddc.reads == []
+    assert state.last_known(ddc_ci.VCP_POWER_MODE) == ddc_ci.POWER_STANDBY
+
+
+def test_monitor_is_refreshed_again_once_woken():
+    now = [0.0]
+    state, ddc = MonitorState(ttl=30.0, clock=lambda: now[0]), RecordingDDC()
+    state.update(ddc_ci.VCP_POWER_MODE, ddc_ci.POWER_STANDBY)
+    state.update(ddc_ci.VCP_POWER_MODE, ddc_ci.POWER_ON)
+    now[0] = 100.0
+    run_refresher(state, ddc)
+    assert ddc.reads
+
+
+def test_refresh_failures_leave_the_breaker_closed():
+    backend = ddc_ci.I2CBackend(7, device=SilentDevice())
+    state = MonitorState()
+    for _ in range(5):
+        assert not state.refresh(backend, neutral=True)
+    assert backend.breaker.state == "closed"
+    assert state.stats["refresh_failures"] == 5
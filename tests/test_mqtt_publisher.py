@@ -0,0 +1,120 @@
+"""MQTTPublisher against the stand-in broker: outbox merging, flushing on reconnect, backoff"""
+import random
+import time
+
+import pytest
+from paho.mqtt import client as mqtt_stub
+
+import mqtt_publisher
+from mqtt_publisher import MQTTPublisher
+
+broker = mqtt_stub.broker
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def delivered(topic):
+    return [message.payload.decode() for message in broker.messages if message.topic == topic]
+
+
+@pytest.fixture
+def publishers():
+    broker.reset()
+    started = []
+
+    def start(**kwargs):
+        publisher = MQTTPublisher("test-broker", reconnect_min=0.01, reconnect_max=0.05, **kwargs).start()
+        started.append(publisher)
+        return publisher
+
+    yield start
+    for publisher in started:
+        publisher.stop()
+    broker.reset()
+
+
+def test_offline_publishes_merge_and_flush_on_connect(publishers):
+    broker.set_online(False)
+    publisher = publishers()
+    publisher.publish_delta("light/brightness", 3)
+    publisher.publish_delta("light/brightness", -1)
+    publisher.publish("light/set", "40")
+    publisher.publish("light/set", "55")
+    stats = publisher.snapshot()
+    assert (stats["outbox_depth"], stats["merged"]) == (2, 2)
+
+    broker.set_online(True)
+    wait_until(lambda: publisher.connected() and not publisher.snapshot()["outbox_depth"])
+    assert delivered("light/brightness") == ["2"]
+    assert delivered("light/set") == ["55"]
+    assert publisher.snapshot()["flushed"] == 2
+
+
+def test_net_change_survives_an_outage(publishers):
+    publisher = publishers()
+    wait_until(publisher.connected)
+    publisher.publish_delta("light/brightness", 1)
+    broker.set_online(False)
+    wait_until(lambda: not publisher.connected())
+    for delta in (2, 3, -4, 5):
+        publisher.publish_delta("light/brightness", delta)
+    broker.set_online(True)
+    wait_until(lambda: publisher.connected() and not publisher.snapshot()["outbox_depth"])
+    assert delivered("light/brightness") == ["1", "6"]
+    assert publisher.snapshot()["reconnects"] == 1
+
+
+def test_failed_send_while_connected_goes_out_before_newer_messages(publishers, monkeypatch):
+    publisher = publishers()
+    wait_until(publisher.connected)
+    monkeypatch.setattr(publisher.client, "publish",
+                        lambda *args, **kwargs: mqtt_stub.MQTTMessageInfo(0, mqtt_stub.MQTT_ERR_NO_CONN))
+    publisher.publish_delta("light/brightness", 5)
+    assert publisher.snapshot()["outbox_depth"] == 1
+    monkeypatch.undo()
+
+    publisher.publish_delta("light/brightness", -2)
+    assert delivered("light/brightness") == ["5", "-2"]
+    stats = publisher.snapshot()
+    assert (stats["outbox_depth"], stats["flushed"], stats["reconnects"]) == (0, 1, 0)
+
+
+def test_full_outbox_drops_the_oldest(publishers):
+    broker.set_online(False)
+    publisher = publishers(outbox_limit=2)
+    for topic in ("a", "b", "c"):
+        publisher.publish(topic, topic)
+    broker.set_online(True)
+    wait_until(lambda: publisher.connected() and not publisher.snapshot()["outbox_depth"])
+    assert [message.topic for message in broker.messages] == ["b", "c"]
+    assert publisher.snapshot()["dropped"] == 1
+
+
+def test_subscription_callbacks_run_in_order_and_are_renewed(publishers):
+    publisher = publishers()
+    received = []
+    publisher.subscribe("light/state", lambda message: received.append(("first", message.payload)))
+    publisher.subscribe("light/state", lambda message: received.append(("second", message.payload)))
+    wait_until(publisher.connected)
+    broker.route(mqtt_stub.MQTTMessage("light/state", b"1"))
+    wait_until(lambda: len(received) == 2)
+
+    broker.set_online(False)
+    wait_until(lambda: not publisher.connected())
+    broker.set_online(True)
+    wait_until(publisher.connected)
+    broker.route(mqtt_stub.MQTTMessage("light/state", b"2"))
+    wait_until(lambda: len(received) == 4)
+    assert received == [("first", b"1"), ("second", b"1"), ("first", b"2"), ("second", b"2")]
+
+
+def test_backoff_delay_is_capped():
+    random.seed(1)
+    for attempt in range(12):
+        delay = mqtt_publisher.backoff_delay(attempt, 0.5, 30.0)
+        assert 0 <= delay <= min(30.0, 0.5 * 2 ** attempt)
@@ -0,0 +1,50 @@
+"""Pipeline stages: step timeouts count from when a step starts running"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import pipelines
+from dispatcher import ActionSuperseded, CancelToken
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=1)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+def sleeping_step(label, seconds, timeout):
+    return pipelines.Step(label, "delay", lambda cancel: not cancel.wait(seconds), timeout, optional=False)
+
+
+def test_queued_step_is_not_timed_until_it_runs(executor):
+    # One thread for two steps: the second waits 0.2 s, then runs within its own 0.3 s
+    pipeline = pipelines.Pipeline("queued", [[sleeping_step("a", 0.2, 0.3), sleeping_step("b", 0.2, 0.3)]])
+    assert pipeline.run(executor)
+    assert pipeline.stats["timeouts"] == 0
+
+
+def test_running_step_still_times_out(executor):
+    pipeline = pipelines.Pipeline("slow", [[sleeping_step("a", 1.0, 0.05)]])
+    start = time.monotonic()
+    assert not pipeline.run(executor)
+    assert time.monotonic() - start < 0.5
+    assert pipeline.stats["timeouts"] == 1
+
+
+def test_step_superseded_while_queued_never_runs(executor):
+    ran = []
+    blocker = threading.Event()
+    first = pipelines.Step("a", "delay", lambda cancel: blocker.wait(1) or True, 5.0, optional=False)
+    second = pipelines.Step("b", "delay", lambda cancel: ran.append("b") or True, 5.0, optional=False)
+    pipeline = pipelines.Pipeline("superseded", [[first, second]])
+    token = CancelToken()
+    threading.Timer(0.05, token.cancel).start()
+    with pytest.raises(ActionSuperseded):
+        pipeline.run(executor, token)
+    blocker.set()
+    executor.shutdown(wait=True)
+    assert ran == []
@@ -0,0 +1,44 @@
+"""SwitcherMQTT's command topic: actions always, raw VCP writes only when enabled"""
+import json
+
+from paho.mqtt import client as mqtt_stub
+
+import switcher_mqtt
+
+
+class RecordingSwitcher:
+    def __init__(self):
+        self.actions = []
+        self.vcp_writes = []
+
+    def control_action(self, request):
+        self.actions.append(request["action"])
+
+    def control_vcp(self, request):
+        self.vcp_writes.append(request)
+
+
+def command(bridge, payload):
+    bridge.on_command(mqtt_stub.MQTTMessage(bridge.command_topic, payload.encode()))
+
+
+def bridge_for(switcher, **kwargs):
+    return switcher_mqtt.SwitcherMQTT(switcher, publisher=None, **kwargs)
+
+
+def test_raw_vcp_is_rejected_by_default():
+    switcher = RecordingSwitcher()
+    bridge = bridge_for(switcher)
+    command(bridge, json.dumps({"code": "0x04", "value": 1}))
+    command(bridge, "computer_a")
+    assert switcher.vcp_writes == []
+    assert switcher.actions == ["computer_a"]
+    assert (bridge.stats["commands"], bridge.stats["rejected"]) == (2, 1)
+
+
+def test_raw_vcp_when_enabled():
+    switcher = RecordingSwitcher()
+    bridge = bridge_for(switcher, vcp_commands=True)
+    command(bridge, json.dumps({"code": "0x10", "value": 80}))
+    assert switcher.vcp_writes == [{"code": "0x10", "value": 80}]
+    assert bridge.stats["rejected"] == 0
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Command-line client for the switcher's control socket
+
+    python3 tools/macropadctl.py status
+    python3 tools/macropadctl.py switch computer_a      # or computer_b, hdmi_standby
+    python3 tools/macropadctl.py vcp 0x10 80 --display main
+
+Prints the JSON reply and exits non-zero if the switcher reported an error.
+"""
+import argparse
+import json
+import socket
+import sys
+
+CONTROL_SOCKET = "/run/macropad/control.sock"
+
+
+def request(path, message, timeout=5.0):
+    """Send one request and return the decoded reply"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(json.dumps(message).encode() + b"\n")
+        with sock.makefile("rb") as reader:
+            line = reader.readline()
+    if not line:
+        raise SystemExit("Control socket closed without a reply")
+    return json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--socket", default=CONTROL_SOCKET)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status")
+    commands.add_parser("ping")
+    switch = commands.add_parser("switch")
+    switch.add_argument("action")
+    vcp = commands.add_parser("vcp")
+    vcp.add_argument("code", help="VCP feature code, e.g. 0x10")
+    vcp.add_argument("value")
+    vcp.add_argument("--display", help="display name (default: the primary)")
+    args = parser.parse_args()
+
+    if args.command == "switch":
+        message = {"cmd": "action", "action": args.action}
+    elif args.command == "vcp":
+        message = {"cmd": "vcp", "code": args.code, "value": args.value}
+        if args.display:
+            message["display"] = args.display
+    else:
+        message = {"cmd": args.command}
+
+    try:
+        reply = request(args.socket, message)
+    except OSError as e:
+        raise SystemExit(f"Could not reach {args.socket}: {e}")
+    print(json.dumps(reply, indent=2))
+    sys.exit(0 if reply.get("ok") else 1)
+
+
+if __name__ == "__main__":
+    main()
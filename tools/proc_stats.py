@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Report resident memory and thread count of the macro pad services
+Used to compare the two-service setup against macropad_daemon.py:
+
+    sudo python3 tools/proc_stats.py ddc-switcher hue-lightstrip-encoder
+    sudo python3 tools/proc_stats.py macropad
+
+Arguments are systemd unit names (without .service) or PIDs.
+"""
+import subprocess
+import sys
+
+
+def main_pid(target):
+    """Resolve a PID or systemd unit name to a PID"""
+    if target.isdigit():
+        return int(target)
+    result = subprocess.run(
+        ["systemctl", "show", "--property=MainPID", "--value", f"{target}.service"],
+        capture_output=True,
+        text=True,
+    )
+    pid = int(result.stdout.strip() or 0)
+    if pid == 0:
+        raise SystemExit(f"{target}.service is not running")
+    return pid
+
+
+def proc_status(pid):
+    """Return (rss_kb, threads) from /proc/<pid>/status"""
+    rss_kb = threads = 0
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss_kb = int(line.split()[1])
+            elif line.startswith("Threads:"):
+                threads = int(line.split()[1])
+    return rss_kb, threads
+
+
+def main():
+    targets = sys.argv[1:]
+    if not targets:
+        raise SystemExit(__doc__)
+
+    total_rss = total_threads = 0
+    for target in targets:
+        pid = main_pid(target)
+        rss_kb, threads = proc_status(pid)
+        total_rss += rss_kb
+        total_threads += threads
+        print(f"{target:<28} pid {pid:<7} RSS {rss_kb / 1024:7.1f} MiB  threads {threads}")
+
+    if len(targets) > 1:
+        print(f"{'total':<28} {'':<11} RSS {total_rss / 1024:7.1f} MiB  threads {total_threads}")
+
+
+if __name__ == "__main__":
+    main()
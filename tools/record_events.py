@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Record the macro pad's raw input events to a trace for bench/replay.py
+
+    sudo python3 tools/record_events.py desk.trace                  # until Ctrl-C
+    sudo python3 tools/record_events.py desk.trace --duration 600
+    sudo python3 tools/record_events.py desk.trace --device encoder=/dev/input/event4
+
+By default it opens the button device (found like the switcher finds it) and
+ENCODER_DEVICE. The devices aren't grabbed, so the services keep running and
+the trace holds exactly the events they read, with kernel timestamps.
+EV_SYN and EV_MSC events are left out unless --all is given.
+"""
+import argparse
+import os
+import selectors
+import signal
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import evdev  # noqa: E402
+
+import event_trace  # noqa: E402
+import hue_lightstrip_encoder as encoder  # noqa: E402
+import input_devices  # noqa: E402
+
+BUTTONS_NAME = "binepad BNK8"
+FLUSH_INTERVAL = 1.0  # Seconds between writes to disk, so a crash loses little
+SKIPPED_TYPES = {evdev.ecodes.EV_SYN, evdev.ecodes.EV_MSC}
+
+
+def open_devices(specs):
+    """role -> open InputDevice, from role=path specs or the services' defaults"""
+    devices = {}
+    for spec in specs or []:
+        role, _, path = spec.partition("=")
+        if role not in event_trace.ROLES or not path:
+            raise SystemExit(f"--device must be ROLE=PATH with ROLE one of {', '.join(event_trace.ROLES)}, not {spec!r}")
+        devices[role] = evdev.InputDevice(path)
+    if not specs:
+        buttons = input_devices.find_device(BUTTONS_NAME)
+        if buttons:
+            devices["buttons"] = buttons
+        encoder_device = input_devices.open_path(encoder.ENCODER_DEVICE)
+        if encoder_device:
+            devices["encoder"] = encoder_device
+    if not devices:
+        raise SystemExit("No input devices found; pass --device ROLE=PATH")
+    return devices
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("output", help="trace file to write")
+    parser.add_argument("--device", action="append", metavar="ROLE=PATH",
+                        help=f"record this node as {' or '.join(event_trace.ROLES)} (repeatable)")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds")
+    parser.add_argument("--all", action="store_true", help="also record EV_SYN and EV_MSC events")
+    args = parser.parse_args()
+
+    devices = open_devices(args.device)
+    roles = list(devices)
+    selector = selectors.DefaultSelector()
+    for index, role in enumerate(roles):
+        selector.register(devices[role], selectors.EVENT_READ, index)
+        print(f"Recording {role}: {devices[role].name} ({devices[role].path})")
+
+    stopping = []
+    signal.signal(signal.SIGINT, lambda sig, frame: stopping.append(sig))
+    signal.signal(signal.SIGTERM, lambda sig, frame: stopping.append(sig))
+    header_devices = [{"role": role, "name": devices[role].name, "path": devices[role].path} for role in roles]
+    deadline = None if args.duration is None else time.monotonic() + args.duration
+    counts = dict.fromkeys(roles, 0)
+
+    with event_trace.TraceWriter(args.output, header_devices, started=time.time()) as writer:
+        next_flush = time.monotonic() + FLUSH_INTERVAL
+        while not stopping and (deadline is None or time.monotonic() < deadline):
+            for key, _ in selector.select(timeout=FLUSH_INTERVAL):
+                try:
+                    events = list(key.fileobj.read())
+                except BlockingIOError:
+                    continue
+                except OSError as e:
+                    print(f"{roles[key.data]} stopped: {e}")
+                    selector.unregister(key.fileobj)
+                    continue
+                for event in events:
+                    if args.all or event.type not in SKIPPED_TYPES:
+                        writer.write(key.data, event)
+                        counts[roles[key.data]] += 1
+            if time.monotonic() >= next_flush:
+                writer.flush()
+                next_flush = time.monotonic() + FLUSH_INTERVAL
+            if not selector.get_map():
+                break
+
+    size = os.path.getsize(args.output)
+    print(f"Wrote {writer.count} events ({counts}) to {args.output}, {size} bytes")
+
+
+if __name__ == "__main__":
+    main()